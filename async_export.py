@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""面向高延迟存储（NFS/SMB）的异步导出
+
+在网络文件系统上，每次打开、读取文件信息和写入都要等待一次网络往返，逐张处理时大部分时间在等待。
+这里用asyncio同时保持多个读取、stat和写入请求（数量可配置），文件整体读入内存后
+交给线程池解码、添加水印并编码，结果再异步写回。标准库没有异步文件接口，
+阻塞的文件操作在专用的I/O线程池中执行，asyncio负责调度和限制并发数量。
+
+LatencyFS给每次文件操作加上固定延迟，用来在本地模拟网络存储、衡量吞吐量。
+"""
+
+import io
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from backends import PillowBackend
+
+
+class LocalFS:
+    """直接读写本地文件（或挂载的网络文件系统）"""
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def write(self, path, data):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+class LatencyFS(LocalFS):
+    """每次操作前等待latency秒，模拟网络存储的往返延迟"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def stat(self, path):
+        time.sleep(self.latency)
+        return super().stat(path)
+
+    def read(self, path):
+        time.sleep(self.latency)
+        return super().read(path)
+
+    def write(self, path, data):
+        time.sleep(self.latency)
+        super().write(path, data)
+
+
+class AsyncExporter:
+    """并发读写、线程池渲染的批量导出"""
+
+    def __init__(self, job, fs=None, io_concurrency=32, cpu_workers=None, backend=None):
+        self.job = job
+        self.backend = backend or PillowBackend()
+        self.fs = fs or LocalFS()
+        self.io_concurrency = max(1, io_concurrency)
+        self.cpu_workers = max(1, cpu_workers or os.cpu_count() or 1)
+        self.counters = {'files': 0, 'failed': 0, 'bytes_read': 0, 'bytes_written': 0, 'elapsed': 0.0}
+
+    def render(self, image_path, data, mtime, outputs):
+        """在CPU线程池中调用：从内存中的原图生成所有输出，返回[(输出路径, 编码后的数据)]"""
+        source = io.BytesIO(data)
+        text = None
+        if self.job.use_date or self.job.text_template:
+            # 拍摄日期和拍摄信息从内存中的文件内容读取，没有EXIF日期时使用已取得的修改时间
+            text = self.job.text_for(image_path, mtime=mtime, source=source)
+        buffers = {}
+
+        def open_target(output_path):
+            return buffers.setdefault(output_path, io.BytesIO())
+
+        if not self.backend.export(image_path, outputs, self.job, text, source, open_target):
+            return None
+        return [(output_path, buffer.getvalue()) for output_path, buffer in buffers.items()]
+
+    async def export_one(self, image_path, outputs, io_limit, in_flight, io_pool, cpu_pool):
+        loop = asyncio.get_running_loop()
+        async with in_flight:
+            try:
+                async with io_limit:
+                    st = await loop.run_in_executor(io_pool, self.fs.stat, image_path)
+                async with io_limit:
+                    data = await loop.run_in_executor(io_pool, self.fs.read, image_path)
+                self.counters['bytes_read'] += len(data)
+
+                results = await loop.run_in_executor(
+                    cpu_pool, self.render, image_path, data, st.st_mtime, outputs
+                )
+                del data
+                if results is None:
+                    self.counters['failed'] += 1
+                    return False
+
+                async def write(output_path, encoded):
+                    async with io_limit:
+                        await loop.run_in_executor(io_pool, self.fs.write, output_path, encoded)
+                    self.counters['bytes_written'] += len(encoded)
+
+                await asyncio.gather(*(write(output_path, encoded) for output_path, encoded in results))
+                self.counters['files'] += 1
+                return True
+            except Exception as e:
+                print(f"处理图片{image_path}时出错: {e}")
+                self.counters['failed'] += 1
+                return False
+
+    async def export_all(self, items):
+        """items是[(图片路径, 输出)]，输出为单一输出路径，或使用导出配置时的[(rendition, 输出路径)]"""
+        started = time.monotonic()
+        io_limit = asyncio.Semaphore(self.io_concurrency)
+        # 同时在内存中的原图数量：正在读取的加上等待和正在渲染的
+        in_flight = asyncio.Semaphore(self.io_concurrency + 2 * self.cpu_workers)
+        with ThreadPoolExecutor(self.io_concurrency) as io_pool, ThreadPoolExecutor(self.cpu_workers) as cpu_pool:
+            results = await asyncio.gather(*(
+                self.export_one(image_path, outputs, io_limit, in_flight, io_pool, cpu_pool)
+                for image_path, outputs in items
+            ))
+        self.counters['elapsed'] = time.monotonic() - started
+        return {image_path: ok for (image_path, _), ok in zip(items, results)}
+
+    def run(self, items):
+        """同步入口，返回{图片路径: 是否成功}"""
+        return asyncio.run(self.export_all(list(items)))
+
+    def format_report(self):
+        c = self.counters
+        elapsed = c['elapsed'] or 1e-9
+        return (f"用时 {c['elapsed']:.1f}秒，{c['files'] / elapsed:.1f} 张/秒，"
+                f"读取 {c['bytes_read'] / elapsed / 1e6:.1f} MB/秒，写入 {c['bytes_written'] / elapsed / 1e6:.1f} MB/秒"
+                f"（I/O并发 {self.io_concurrency}，渲染线程 {self.cpu_workers}）")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""处理引擎基准测试：Pillow引擎与vips引擎导出同一批图片的用时和峰值内存
+
+在临时目录中生成一批大尺寸JPEG（默认8张2400万像素），每个引擎在单独的子进程中导出全部图片
+（峰值内存互不影响，libvips的线程数按CPU核数），分别测量单张输出和多尺寸输出（导出配置"原图+网页尺寸"）。
+每个引擎先导出一张预热，不计入结果。峰值内存是到该项测量结束时的峰值（多尺寸输出在单张输出之后测量）。
+
+    python backend_benchmark.py
+    python backend_benchmark.py --files 20 --megapixels 12 --workers 4
+"""
+
+import os
+import sys
+import time
+
+# 以子进程方式运行的参数
+CHILD_FLAG = '--child'
+RESULT_PREFIX = 'BENCHMARK'
+DEFAULT_FILES = 8
+DEFAULT_MEGAPIXELS = 24
+BACKEND_NAMES = ('pillow', 'vips')
+
+
+def peak_rss_mb():
+    """当前进程的峰值内存（MB），无法获取时返回-1
+
+    Linux上读取/proc中的VmHWM：ru_maxrss在exec后仍保留父进程（生成图片时）的峰值，不能反映子进程本身。
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return -1
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def child(backend_name, source_dir, output_dir, workers):
+    """在子进程中运行：用一个引擎导出source_dir中的全部图片，输出用时和峰值内存"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import watermark_core
+    from backends import get_backend
+    from scheduler import ExportScheduler
+
+    backend = get_backend(backend_name)
+    job = watermark_core.compile_settings({
+        'text': '© 2026 水印 Benchmark', 'font_size': 30, 'relative_size': True,
+        'color': (255, 255, 255, 160), 'position': 'bottom_right',
+    })
+    profile = watermark_core.DEFAULT_EXPORT_PROFILES[0]
+    sources = sorted(os.path.join(source_dir, name) for name in os.listdir(source_dir))
+
+    def single(path):
+        return os.path.join(output_dir, 'single_' + os.path.basename(path))
+
+    def renditions(path):
+        base_name = 'profile_' + os.path.splitext(os.path.basename(path))[0]
+        return [(rendition, os.path.join(output_dir, watermark_core.rendition_output_name(base_name, rendition)))
+                for rendition in profile['renditions']]
+
+    # 预热：加载字体、编解码库
+    backend.export(sources[0], single(sources[0]), job)
+    for name, outputs in (('single', single), ('profile', renditions)):
+        scheduler = ExportScheduler(workers=workers)
+        items = {path: outputs(path) for path in sources}
+        started = time.perf_counter()
+        results = scheduler.run(sources, lambda path: backend.export(path, items[path], job))
+        elapsed = time.perf_counter() - started
+        failed = sum(1 for ok in results.values() if not ok)
+        print(f"{RESULT_PREFIX} {name} {elapsed:.4f} {failed} {peak_rss_mb():.1f}", flush=True)
+
+
+def run_child(backend_name, source_dir, output_dir, workers):
+    """启动一个子进程测量一个引擎，返回{输出方式: (秒数, 失败数, 峰值内存MB)}"""
+    import subprocess
+    command = [sys.executable, os.path.abspath(__file__), CHILD_FLAG, backend_name, source_dir, output_dir,
+               str(workers)]
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    results = {}
+    for line in process.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            _, name, seconds, failed, rss = line.split()
+            results[name] = (float(seconds), int(failed), float(rss))
+    if process.returncode != 0 or len(results) != 2:
+        raise RuntimeError(f"引擎{backend_name}测量失败（退出码{process.returncode}）:\n{process.stderr}")
+    return results
+
+
+def generate(directory, count, megapixels):
+    """生成count张约megapixels百万像素的JPEG（带噪声的渐变，接近照片的压缩率）"""
+    import numpy as np
+    from PIL import Image
+
+    width = int((megapixels * 1e6 * 3 / 2) ** 0.5)
+    height = int(width * 2 / 3)
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 200, width, dtype=np.float32)[None, :, None]
+    base = gradient * [1.0, 0.7, 0.4] + 30
+    for i in range(count):
+        noise = rng.normal(0, 10, (height, width, 3)).astype(np.float32)
+        pixels = np.clip(base + noise + i * 3, 0, 255).astype(np.uint8)
+        Image.fromarray(pixels).save(os.path.join(directory, f"photo_{i:03d}.jpg"), quality=92)
+    return width, height
+
+
+def main():
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='对比Pillow引擎和vips引擎的导出用时和峰值内存')
+    parser.add_argument('--files', type=int, default=DEFAULT_FILES, help=f'图片数量（默认：{DEFAULT_FILES}）')
+    parser.add_argument('--megapixels', type=float, default=DEFAULT_MEGAPIXELS,
+                        help=f'每张图片的像素数（百万，默认：{DEFAULT_MEGAPIXELS}）')
+    parser.add_argument('--workers', type=int, default=1, help='并行处理的图片数（默认：1）')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'sources')
+        os.makedirs(source_dir)
+        width, height = generate(source_dir, max(1, args.files), args.megapixels)
+        print(f"{max(1, args.files)}张{width}x{height}的JPEG，{args.workers}个并行，CPU核数{os.cpu_count()}")
+        for backend_name in BACKEND_NAMES:
+            output_dir = os.path.join(temp_dir, backend_name)
+            os.makedirs(output_dir)
+            try:
+                results = run_child(backend_name, source_dir, output_dir, args.workers)
+            except RuntimeError as e:
+                print(e)
+                return 1
+            for name, label in (('single', '单张输出'), ('profile', '多尺寸输出')):
+                seconds, failed, rss = results[name]
+                print(f"  {backend_name:6} {label}: {seconds:7.2f}秒 {seconds / max(1, args.files):6.2f}秒/张 "
+                      f"峰值内存{'无法获取' if rss < 0 else f'{rss:.0f}MB'}" + (f" 失败{failed}张" if failed else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == [CHILD_FLAG]:
+        child(sys.argv[2], sys.argv[3], sys.argv[4], int(sys.argv[5]))
+    else:
+        sys.exit(main())
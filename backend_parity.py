@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""处理引擎一致性检查：vips引擎与Pillow引擎的输出应当相同
+
+在临时目录中生成各类原图（RGB/RGBA/L/LA/CMYK/16位/调色板、带EXIF方向的JPEG、libvips不支持的BMP、
+损坏的文件），对文字、旋转文字、平铺、Logo、拍摄日期几种水印设置，分别用两个引擎导出单张输出和
+多尺寸输出，检查：
+  - 两个引擎的成功与否相同（损坏的文件两者都失败，BMP由vips交给Pillow处理）
+  - 输出的尺寸和模式相同，EXIF方向都已重置、都不含缩略图
+  - 像素平均差不超过MAX_MEAN_DIFF（两个编码器和合成的舍入不同，不要求逐像素相同）
+
+需要安装pyvips；没有安装时以状态1退出。检查不通过时也以状态1退出：
+    python backend_parity.py
+"""
+
+import io
+import os
+import sys
+
+# 两个引擎输出的像素平均差上限（0~255）
+MAX_MEAN_DIFF = 1.5
+SOURCE_SIZE = (900, 600)
+# 水印设置：名称 -> 设置字典（Logo路径在运行时填入）
+SETTINGS = {
+    '文字': {'text': '水印 Watermark', 'font_size': 36, 'color': (255, 255, 255, 160), 'position': 'bottom_right'},
+    '旋转文字': {'text': '水印 Watermark', 'font_size': 48, 'color': (255, 0, 0, 128), 'position': 'center',
+             'rotation': 30},
+    '平铺': {'text': '© 平铺', 'font_size': 24, 'color': (0, 0, 0, 90), 'position': 'tile', 'rotation': 45},
+    'Logo': {'font_size': 36, 'color': (255, 255, 255, 200), 'position': 'top_left', 'logo_scale': 0.25},
+    '拍摄日期': {'use_date': True, 'font_size': 5, 'relative_size': True, 'color': (255, 255, 0, 255),
+             'position': 'bottom_center'},
+}
+PROFILE = [
+    {'max_size': None, 'format': 'JPEG', 'quality': 95, 'suffix': ''},
+    {'max_size': 400, 'format': 'PNG', 'suffix': '_400'},
+]
+
+
+def exif_bytes(orientation):
+    from PIL import Image
+
+    exif = Image.Exif()
+    exif[0x010F] = 'Canon'
+    exif[0x0112] = orientation
+    exif.get_ifd(0x8769)[0x9003] = '2024:05:06 07:08:09'
+    return exif.tobytes()
+
+
+def make_sources(directory):
+    """生成各类原图，返回[(名称, 路径)]"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, SOURCE_SIZE[0], dtype=np.float32)[None, :, None]
+    noise = rng.normal(0, 12, (SOURCE_SIZE[1], SOURCE_SIZE[0], 3))
+    rgb = Image.fromarray(np.clip(gradient * [1.0, 0.6, 0.3] + 40 + noise, 0, 255).astype(np.uint8))
+    sources = {
+        'rgb.jpg': lambda path: rgb.save(path, quality=95, exif=exif_bytes(1)),
+        'rotated.jpg': lambda path: rgb.save(path, quality=95, exif=exif_bytes(6)),
+        'rgba.png': lambda path: rgb.convert('RGBA').save(path),
+        'gray.png': lambda path: rgb.convert('L').save(path),
+        'gray_alpha.png': lambda path: rgb.convert('LA').save(path),
+        'cmyk.jpg': lambda path: rgb.convert('CMYK').save(path, quality=95),
+        'gray16.png': lambda path: Image.fromarray(np.asarray(rgb.convert('L'), dtype=np.uint16) * 257).save(path),
+        'palette.png': lambda path: rgb.convert('P').save(path),
+        'bitmap.bmp': lambda path: rgb.save(path),
+    }
+    paths = []
+    for name, save in sources.items():
+        path = os.path.join(directory, name)
+        save(path)
+        paths.append((name, path))
+    damaged = os.path.join(directory, 'damaged.jpg')
+    with open(damaged, 'wb') as f:
+        f.write(b'\xff\xd8\xff\xe0not a jpeg')
+    paths.append(('damaged.jpg', damaged))
+    return paths
+
+
+def compare(label, pillow_path, vips_path, failures):
+    """比较两个引擎的一个输出文件"""
+    import numpy as np
+    from PIL import Image
+    import watermark_core
+
+    with Image.open(pillow_path) as expected, Image.open(vips_path) as actual:
+        if (expected.size, expected.mode) != (actual.size, actual.mode):
+            failures.append(f"{label}: Pillow输出{expected.size} {expected.mode}，vips输出{actual.size} {actual.mode}")
+            return None
+        for engine, img in (('Pillow', expected), ('vips', actual)):
+            exif = img.info.get('exif')
+            if exif and watermark_core.find_orientation(exif)[0] != 1:
+                failures.append(f"{label}: {engine}输出的EXIF方向没有重置")
+            if exif and watermark_core.remove_thumbnail(exif) != exif:
+                failures.append(f"{label}: {engine}输出的EXIF中仍有缩略图")
+        difference = np.abs(np.asarray(expected, dtype=np.float32) - np.asarray(actual, dtype=np.float32)).mean()
+    if difference > MAX_MEAN_DIFF:
+        failures.append(f"{label}: 像素平均差{difference:.2f} > {MAX_MEAN_DIFF}")
+    return difference
+
+
+def run_case(backends, job, source_name, source_path, output_dir, failures):
+    """两个引擎各导出一次单张输出和多尺寸输出，返回像素平均差的列表"""
+    import watermark_core
+
+    base_name = os.path.splitext(source_name)[0]
+    results = {}
+    for backend in backends:
+        directory = os.path.join(output_dir, backend.name)
+        os.makedirs(directory, exist_ok=True)
+        single = os.path.join(directory, base_name + '.png')
+        renditions = [(rendition, os.path.join(directory, watermark_core.rendition_output_name(base_name, rendition)))
+                      for rendition in PROFILE]
+        results[backend.name] = (backend.export(source_path, single, job), single,
+                                 backend.export(source_path, renditions, job), [path for _, path in renditions])
+
+    (pillow_single_ok, pillow_single, pillow_profile_ok, pillow_profile), \
+        (vips_single_ok, vips_single, vips_profile_ok, vips_profile) = results['pillow'], results['vips']
+    if (pillow_single_ok, pillow_profile_ok) != (vips_single_ok, vips_profile_ok):
+        failures.append(f"{source_name}: 成功与否不同，Pillow {pillow_single_ok}/{pillow_profile_ok}，"
+                        f"vips {vips_single_ok}/{vips_profile_ok}")
+        return []
+    differences = []
+    pairs = [(pillow_single, vips_single)] if pillow_single_ok else []
+    if pillow_profile_ok:
+        pairs.extend(zip(pillow_profile, vips_profile))
+    for pillow_path, vips_path in pairs:
+        difference = compare(f"{source_name} -> {os.path.basename(pillow_path)}", pillow_path, vips_path, failures)
+        if difference is not None:
+            differences.append(difference)
+    return differences
+
+
+def main():
+    import argparse
+    import tempfile
+    from contextlib import redirect_stdout
+    from PIL import Image
+
+    parser = argparse.ArgumentParser(description='检查vips引擎与Pillow引擎的输出是否一致')
+    parser.add_argument('--keep', help='把输出保存到该文件夹，便于查看差异')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import watermark_core
+    from backends import get_backend
+
+    try:
+        backends = [get_backend('pillow'), get_backend('vips')]
+    except ValueError as e:
+        print(e)
+        return 1
+
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_root = args.keep or os.path.join(temp_dir, 'out')
+        sources = make_sources(temp_dir)
+        logo_path = os.path.join(temp_dir, 'logo.png')
+        logo = Image.new('RGBA', (240, 120), (0, 0, 0, 0))
+        logo.paste((30, 120, 220, 255), (20, 20, 220, 100))
+        logo.save(logo_path)
+
+        for setting_name, settings in SETTINGS.items():
+            if setting_name == 'Logo':
+                settings = dict(settings, logo_path=logo_path)
+            job = watermark_core.compile_settings(settings)
+            differences = []
+            for source_name, source_path in sources:
+                before = len(failures)
+                # 损坏的文件两个引擎都会输出错误信息，这里不显示
+                with redirect_stdout(io.StringIO()):
+                    case = run_case(backends, job, source_name, source_path,
+                                    os.path.join(output_root, setting_name), failures)
+                differences.extend(case)
+                if len(failures) > before:
+                    print(f"  {setting_name} {source_name}: 失败")
+            worst = max(differences) if differences else 0.0
+            print(f"{setting_name}: {len(sources)}张原图，比较{len(differences)}个输出，最大像素平均差{worst:.2f}")
+
+    for failure in failures:
+        print(f"检查失败: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
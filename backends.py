@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""可替换的图片处理引擎
+
+所有导出入口（界面、命令行、监视、分布式和异步导出）都通过引擎的export处理一张图片：
+  pillow  默认引擎，使用watermark_core中的Pillow实现
+  vips    可选引擎，需要安装pyvips（和libvips）。libvips按需逐块解码、合成和编码，
+          一张图片的处理也由多个线程并行完成，内存占用只与图片宽度成正比
+水印层（文字、Logo、平铺）始终由watermark_core渲染，两个引擎只在解码、合成和编码上不同。
+"""
+
+import os
+
+import watermark_core
+
+DEFAULT_BACKEND = 'pillow'
+
+
+class PillowBackend:
+    """使用Pillow解码、合成和编码"""
+
+    name = 'pillow'
+
+    def export(self, image_path, outputs, job, text=None, source=None, open_target=None):
+        """处理一张图片，返回是否全部输出成功
+
+        outputs是单一输出路径，或使用导出配置时的[(rendition, 输出路径)]；
+        source是已读入内存的原图，open_target(output_path)返回接收输出的类文件对象（见async_export）。
+        """
+        if isinstance(outputs, str):
+            target = open_target(outputs) if open_target else None
+            return watermark_core.watermark_file(image_path, outputs, job, text, source, target)
+        return watermark_core.export_renditions(image_path, outputs, job, text, source, open_target) == len(outputs)
+
+
+class VipsBackend:
+    """使用libvips（pyvips）按需流式处理
+
+    只处理8位的RGB和灰度图片（可带透明度）。libvips无法打开的格式、16位、CMYK等其他图片、
+    需要嵌入隐形水印（要把整张图读入NumPy）和使用自动位置（要先分析整张图）的任务交给Pillow引擎。
+    EXIF（去掉缩略图）、ICC和DPI由libvips保留，带方向标记的照片先按方向旋转，与Pillow引擎的输出一致。
+    """
+
+    name = 'vips'
+
+    def __init__(self):
+        try:
+            import pyvips
+        except (ImportError, OSError) as e:
+            # 没有安装pyvips，或找不到libvips动态库
+            raise ValueError(f"处理引擎vips需要安装pyvips和libvips: {e}")
+        self.pyvips = pyvips
+        # 批量处理时每个文件只读一次，libvips的操作缓存只会占用内存
+        pyvips.cache_set_max(0)
+        self.fallback = PillowBackend()
+
+    def load(self, image_path, source, sequential):
+        # sequential为True时只能从上到下读取一次，libvips可以边解码边处理、不必解码整张图
+        access = 'sequential' if sequential else 'random'
+        if source is not None:
+            source.seek(0)
+            return self.pyvips.Image.new_from_buffer(source.read(), '', access=access)
+        return self.pyvips.Image.new_from_file(image_path, access=access)
+
+    def metadata(self, img, name, default=None):
+        return img.get(name) if img.get_typeof(name) else default
+
+    def remove_thumbnail(self, img):
+        """与Pillow引擎相同，去掉EXIF中没有水印的缩略图（见watermark_core.remove_thumbnail）
+
+        libvips保存时按各个exif-ifd*字段和jpeg-thumbnail-data重新生成EXIF，要去掉的是这些字段。
+        """
+        fields = [name for name in img.get_fields()
+                  if name.startswith('exif-ifd1-') or name == 'jpeg-thumbnail-data']
+        if not fields:
+            return img
+        img = img.copy()
+        for name in fields:
+            img.remove(name)
+        return img
+
+    def supported(self, img):
+        return img.format == 'uchar' and img.interpretation in ('srgb', 'b-w') and img.bands <= 4
+
+    def export(self, image_path, outputs, job, text=None, source=None, open_target=None):
+        single = isinstance(outputs, str)
+        if job.invisible_mark or job.spec.anchor == 'auto':
+            return self.fallback.export(image_path, outputs, job, text, source, open_target)
+        try:
+            img = self.load(image_path, source, sequential=single)
+        except self.pyvips.Error:
+            # libvips没有该格式的加载器（如BMP）或无法读取，交给Pillow引擎（真正损坏的文件由它报告错误）
+            return self.fallback.export(image_path, outputs, job, text, source, open_target)
+        try:
+            if not self.supported(img):
+                return self.fallback.export(image_path, outputs, job, text, source, open_target)
+            if self.metadata(img, 'orientation', 1) != 1:
+                # 旋转需要随机访问，重新以随机访问方式打开
+                img = self.load(image_path, source, sequential=False).autorot()
+            img = self.remove_thumbnail(img)
+            if text is None:
+                text = job.text_for(image_path, self.metadata(img, 'exif-data'))
+        except Exception as e:
+            print(f"处理图片{image_path}时出错: {e}")
+            return False
+
+        if single:
+            return self.render_and_save(image_path, img, job, text, outputs, 95, open_target)
+
+        # 与watermark_core.export_renditions相同：从大到小依次缩小，水印按相对原图的缩放比例绘制
+        ordered = sorted(outputs, key=lambda item: -min(item[0].get('max_size') or float('inf'),
+                                                         max(img.width, img.height)))
+        success_count = 0
+        current = img
+        for rendition, output_path in ordered:
+            size = watermark_core.rendition_size((img.width, img.height), rendition.get('max_size'))
+            if size != (current.width, current.height):
+                current = current.resize(size[0] / current.width, vscale=size[1] / current.height,
+                                         kernel='lanczos3')
+            scale = min(current.width, current.height) / min(img.width, img.height)
+            if self.render_and_save(image_path, current, job, text, output_path,
+                                    rendition.get('quality', 95), open_target, scale):
+                success_count += 1
+        return success_count == len(outputs)
+
+    def render_and_save(self, image_path, img, job, text, output_path, quality, open_target, scale=1.0):
+        try:
+            result = self.composite(img, job, text, scale)
+            self.save(result, output_path, quality, open_target(output_path) if open_target else None)
+            return True
+        except Exception as e:
+            print(f"处理图片{image_path}（{output_path}）时出错: {e}")
+            return False
+
+    def composite(self, img, job, text, scale=1.0):
+        """把watermark_core渲染的水印层合成到图片上，图片保持原有的通道数"""
+        img_size = (img.width, img.height)
+        layer, box = job.layer(img_size, text, scale)
+        layer, (x, y) = watermark_core.clip_layer(layer, box, img_size)
+        if layer is None:
+            return img
+        overlay = self.pyvips.Image.new_from_memory(layer.tobytes(), layer.width, layer.height, 4, 'uchar')
+        overlay = overlay.copy(interpretation='srgb')
+        if img.interpretation == 'b-w':
+            overlay = overlay.colourspace('b-w')
+        # 只在水印覆盖的区域内合成（composite按浮点计算），再把结果放回原图
+        region = img.crop(x, y, layer.width, layer.height).composite2(overlay, 'over')
+        # 原图不透明时合成结果的alpha全为255，去掉多出的alpha通道
+        return img.insert(region.extract_band(0, n=img.bands).cast('uchar'), x, y)
+
+    def save(self, img, output_path, quality, target):
+        """按输出文件扩展名编码，EXIF和ICC随图片一起写入"""
+        if os.path.splitext(output_path)[1].lower() in ('.jpg', '.jpeg'):
+            # 与Pillow相同使用4:2:0色度抽样（libvips在高质量时默认不抽样，文件大得多）
+            suffix, options = '.jpg', {'Q': quality, 'subsample_mode': 'on'}
+            if img.hasalpha():
+                # JPEG不支持透明度，与Pillow引擎一样铺白色背景
+                img = img.flatten(background=[255] * (img.bands - 1))
+        else:
+            suffix, options = '.png', {}
+        if target is not None:
+            target.write(img.write_to_buffer(suffix, **options))
+        else:
+            img.write_to_file(output_path, **options)
+
+
+BACKENDS = {
+    PillowBackend.name: PillowBackend,
+    VipsBackend.name: VipsBackend,
+}
+
+
+def get_backend(name=None):
+    """按名称创建处理引擎，名称未知或依赖未安装时抛出ValueError"""
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"未知的处理引擎: {name}")
+    return BACKENDS[name]()
+
+
+def available_backends():
+    """当前环境中可以使用的引擎名称"""
+    names = []
+    for name in BACKENDS:
+        try:
+            get_backend(name)
+        except ValueError:
+            continue
+        names.append(name)
+    return names
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""多台机器协同批量添加水印
+
+协调进程把输入图片分成若干块，通过HTTP（JSON）租借给各台机器上的工作进程。
+工作进程处理完一块后报告结果；处理出错时释放租约，超时未续租的块也会收回，
+这些块会重新分配，超过最大尝试次数后记为失败。所有机器需要以相同路径访问输入和输出目录
+（例如同一个NFS/SMB挂载点），协调进程只传递路径和水印设置。
+
+监听本机以外的地址时必须设置共享口令（--token或环境变量PHOTO_WATERMARK_TOKEN），
+否则能访问该端口的任何主机都可以租借图片块、提交结果。
+
+    协调进程：python watermark_app.py /archive --serve 0.0.0.0:8765 --token 口令 --output-dir /archive_watermark
+    工作进程：python watermark_app.py --worker http://coordinator:8765 --token 口令
+"""
+
+import os
+import hmac
+import json
+import time
+import uuid
+import socket
+import ipaddress
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import request as urllib_request
+from urllib.error import URLError
+
+import watermark_core
+from backends import PillowBackend
+from scanner import FolderScanner
+from scheduler import ExportScheduler
+
+TOKEN_HEADER = 'X-Watermark-Token'
+
+
+def is_loopback(host):
+    """监听地址是否只能从本机访问（主机名除localhost外都按可从其他机器访问处理）"""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def list_images(input_dirs, output_dir=None, **scan_options):
+    """递归列出输入目录中的图片（按文件头识别，跳过输出目录），返回按路径排序的[(路径, 所在输入目录)]
+
+    scan_options传给scanner.FolderScanner（include、exclude、max_depth）。
+    """
+    skip_dirs = [output_dir] if output_dir else []
+    scanner = FolderScanner(skip_dirs=skip_dirs, **scan_options)
+    images = scanner.scan([os.path.abspath(input_dir) for input_dir in input_dirs])
+    for rejected_path, reason in scanner.rejected:
+        print(f"跳过 {rejected_path}: {reason}")
+    return sorted((image.path, image.root) for image in images)
+
+
+def read_manifest(manifest_path):
+    """读取清单文件（每行一个图片路径，#开头为注释），返回[(路径, 公共上级目录)]"""
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        paths = [os.path.abspath(line.strip()) for line in f if line.strip() and not line.startswith('#')]
+    if not paths:
+        return []
+    root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    return [(path, root) for path in paths]
+
+
+def plan_items(sources, output_dir):
+    """为每张图片确定输出位置，返回[[输入路径, 输出路径（不含扩展名）, 扩展名]]
+
+    输出保持相对于输入目录的子目录结构，文件名追加_watermark（与监视模式一致）。
+    """
+    items = []
+    for path, root in sources:
+        base_name, ext = os.path.splitext(os.path.relpath(path, root))
+        items.append([path, os.path.join(os.path.abspath(output_dir), f"{base_name}_watermark"), ext])
+    return items
+
+
+class Coordinator:
+    """管理图片块的租借、续租、完成和重试"""
+
+    def __init__(self, items, settings, profile=None, chunk_size=100, lease_timeout=300.0,
+                 max_attempts=3, token=None):
+        # 传给工作进程的任务设置（compile_settings的输入、导出配置名称和图片总数）
+        self.job = {'settings': settings, 'profile': profile, 'count': len(items)}
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.token = token
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+        self.chunks = {}
+        for start in range(0, len(items), chunk_size):
+            chunk_id = len(self.chunks)
+            self.chunks[chunk_id] = {
+                'items': items[start:start + chunk_size], 'start': start,
+                'state': 'pending', 'attempts': 0,
+                'lease': None, 'expires': 0.0, 'worker': None, 'error': None,
+            }
+        self.pending = deque(self.chunks)
+        self.total_files = len(items)
+        self.file_results = {}
+        self.workers = {}
+        self.started_at = time.monotonic()
+        if not self.chunks:
+            self.finished.set()
+
+    # ---------- 租约 ----------
+
+    def expire_leases(self):
+        """收回超时未续租的块（调用时需持有锁）"""
+        now = time.monotonic()
+        for chunk_id, chunk in self.chunks.items():
+            if chunk['state'] == 'leased' and chunk['expires'] < now:
+                self.retry(chunk_id, f"租约超时（{chunk['worker']}）")
+
+    def retry(self, chunk_id, error):
+        """块处理失败：重新排队，超过最大尝试次数时记为失败（调用时需持有锁）"""
+        chunk = self.chunks[chunk_id]
+        chunk['lease'] = None
+        chunk['error'] = error
+        if chunk['attempts'] >= self.max_attempts:
+            chunk['state'] = 'failed'
+            print(f"[协调] 块 {chunk_id} 已尝试 {chunk['attempts']} 次，放弃: {error}", flush=True)
+            self.check_finished()
+        else:
+            chunk['state'] = 'pending'
+            self.pending.append(chunk_id)
+            print(f"[协调] 块 {chunk_id} 重新排队: {error}", flush=True)
+
+    def check_finished(self):
+        if all(chunk['state'] in ('done', 'failed') for chunk in self.chunks.values()):
+            self.finished.set()
+
+    def lease(self, worker):
+        with self.lock:
+            self.workers[worker] = time.monotonic()
+            self.expire_leases()
+            if self.finished.is_set():
+                return {'done': True}
+            if not self.pending:
+                # 其他工作进程还在处理，稍后再来（它们失败时块会重新排队）
+                return {'wait': min(5.0, self.lease_timeout / 4)}
+            chunk_id = self.pending.popleft()
+            chunk = self.chunks[chunk_id]
+            chunk.update(state='leased', lease=uuid.uuid4().hex, worker=worker,
+                         expires=time.monotonic() + self.lease_timeout)
+            chunk['attempts'] += 1
+            return {'chunk': chunk_id, 'lease': chunk['lease'], 'items': chunk['items'],
+                    'start': chunk['start'], 'lease_timeout': self.lease_timeout}
+
+    def valid_lease(self, chunk_id, lease):
+        chunk = self.chunks.get(chunk_id)
+        return chunk is not None and chunk['state'] == 'leased' and chunk['lease'] == lease
+
+    def renew(self, chunk_id, lease):
+        with self.lock:
+            if not self.valid_lease(chunk_id, lease):
+                return {'ok': False}
+            self.chunks[chunk_id]['expires'] = time.monotonic() + self.lease_timeout
+            return {'ok': True}
+
+    def complete(self, chunk_id, lease, results):
+        """results是[[路径, 是否成功]]；租约已失效（超时后被收回）时忽略"""
+        with self.lock:
+            if not self.valid_lease(chunk_id, lease):
+                return {'ok': False}
+            chunk = self.chunks[chunk_id]
+            chunk['state'] = 'done'
+            chunk['lease'] = None
+            for path, ok in results:
+                self.file_results[path] = bool(ok)
+            self.check_finished()
+            return {'ok': True}
+
+    def release(self, chunk_id, lease, error):
+        with self.lock:
+            if self.valid_lease(chunk_id, lease):
+                self.retry(chunk_id, error or '工作进程释放租约')
+            return {'ok': True}
+
+    # ---------- 统计 ----------
+
+    def stats(self):
+        with self.lock:
+            states = [chunk['state'] for chunk in self.chunks.values()]
+            succeeded = sum(1 for ok in self.file_results.values() if ok)
+            return {
+                'chunks': len(states),
+                'done': states.count('done'),
+                'leased': states.count('leased'),
+                'pending': states.count('pending'),
+                'failed': states.count('failed'),
+                'files': self.total_files,
+                'succeeded': succeeded,
+                'failed_files': len(self.file_results) - succeeded,
+                'workers': len(self.workers),
+                'elapsed': time.monotonic() - self.started_at,
+            }
+
+    def print_stats(self):
+        s = self.stats()
+        rate = s['succeeded'] / s['elapsed'] if s['elapsed'] else 0.0
+        print(f"[协调] 块 {s['done']}/{s['chunks']} 完成，处理中 {s['leased']}，失败 {s['failed']}；"
+              f"图片成功 {s['succeeded']} 失败 {s['failed_files']}；工作进程 {s['workers']}；"
+              f"{rate:.1f} 张/秒", flush=True)
+
+    def failed_paths(self):
+        """失败的图片，包括放弃的块中的所有图片"""
+        with self.lock:
+            paths = [path for path, ok in self.file_results.items() if not ok]
+            for chunk in self.chunks.values():
+                if chunk['state'] == 'failed':
+                    paths.extend(item[0] for item in chunk['items'])
+            return paths
+
+    # ---------- HTTP服务 ----------
+
+    def handle(self, path, body):
+        if path == '/job':
+            return self.job
+        if path == '/lease':
+            return self.lease(body.get('worker', 'unknown'))
+        if path == '/renew':
+            return self.renew(body['chunk'], body['lease'])
+        if path == '/complete':
+            return self.complete(body['chunk'], body['lease'], body.get('results', []))
+        if path == '/release':
+            return self.release(body['chunk'], body['lease'], body.get('error'))
+        if path == '/stats':
+            return self.stats()
+        return None
+
+    def make_server(self, host, port):
+        coordinator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if coordinator.token and not hmac.compare_digest(self.headers.get(TOKEN_HEADER, ''),
+                                                                 coordinator.token):
+                    self.reply(403, {'error': 'forbidden'})
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                    result = coordinator.handle(self.path, body)
+                except (ValueError, KeyError) as e:
+                    self.reply(400, {'error': str(e)})
+                    return
+                if result is None:
+                    self.reply(404, {'error': 'not found'})
+                else:
+                    self.reply(200, result)
+
+            def reply(self, status, data):
+                payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return ThreadingHTTPServer((host, port), Handler)
+
+    def serve(self, host, port, stats_interval=10.0, grace=None):
+        """运行HTTP服务直到所有块完成或失败，返回失败的图片列表
+
+        完成后继续服务grace秒，让正在询问的工作进程收到结束通知。
+        监听本机以外的地址而没有设置口令时抛出ValueError。
+        """
+        if not self.token and not is_loopback(host):
+            raise ValueError(f"监听 {host} 时其他机器也能访问，必须设置共享口令（--token）")
+        server = self.make_server(host, port)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        print(f"[协调] 在 {server.server_address[0]}:{server.server_address[1]} 上分发 "
+              f"{self.total_files} 张图片（{len(self.chunks)} 块）", flush=True)
+        try:
+            while not self.finished.wait(stats_interval or None):
+                with self.lock:
+                    self.expire_leases()
+                self.print_stats()
+            time.sleep(min(5.0, self.lease_timeout / 4) if grace is None else grace)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.print_stats()
+        return self.failed_paths()
+
+
+class Worker:
+    """从协调进程租借图片块并在本机处理"""
+
+    def __init__(self, url, workers=None, max_memory=None, token=None, worker_id=None, backend=None):
+        self.url = url.rstrip('/')
+        # 处理引擎由每台机器自己选择（不同机器可能没有安装pyvips）
+        self.backend = backend or PillowBackend()
+        self.token = token
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.scheduler = ExportScheduler(workers, max_memory)
+        self.job = None
+        self.profile = None
+
+    def call(self, path, body=None, timeout=60):
+        data = json.dumps(body or {}).encode('utf-8')
+        req = urllib_request.Request(self.url + path, data=data, method='POST',
+                                     headers={'Content-Type': 'application/json'})
+        if self.token:
+            req.add_header(TOKEN_HEADER, self.token)
+        with urllib_request.urlopen(req, timeout=timeout) as response:
+            return json.loads(response.read())
+
+    def process(self, item):
+        input_path, output_base, ext = item
+        os.makedirs(os.path.dirname(output_base), exist_ok=True)
+        if self.profile:
+            outputs = [(rendition, os.path.join(os.path.dirname(output_base), watermark_core.rendition_output_name(
+                os.path.basename(output_base), rendition))) for rendition in self.profile['renditions']]
+            return self.backend.export(input_path, outputs, self.job)
+        return self.backend.export(input_path, output_base + ext, self.job)
+
+    def keep_alive(self, lease, stop_event):
+        """处理期间定期续租，避免大块被误判为超时"""
+        interval = max(1.0, lease['lease_timeout'] / 3)
+        while not stop_event.wait(interval):
+            try:
+                self.call('/renew', {'chunk': lease['chunk'], 'lease': lease['lease']})
+            except (URLError, OSError):
+                pass
+
+    def process_chunk(self, lease):
+        items = {item[0]: item for item in lease['items']}
+        if self.job.text_template and 'start' in lease:
+            # 只保留这一块的序号，工作进程处理的块再多内存也不会增长
+            self.job.numbering.reassign(items, lease['start'] + 1)
+        stop_event = threading.Event()
+        heartbeat = threading.Thread(target=self.keep_alive, args=(lease, stop_event), daemon=True)
+        heartbeat.start()
+        try:
+            results = self.scheduler.run(list(items), lambda path: self.process(items[path]))
+        finally:
+            stop_event.set()
+        return [[path, bool(results.get(path))] for path in items]
+
+    def run(self):
+        """循环租借并处理，直到协调进程通知结束或无法连接，返回处理成功的图片数量"""
+        job = self.call('/job')
+        # 文本模板中的序号按协调进程中的图片顺序，与哪个工作进程处理哪一块无关
+        self.job = watermark_core.compile_settings(job['settings']).numbered((), count=job.get('count'))
+        if job.get('profile'):
+            self.profile = watermark_core.find_export_profile(job['profile'])
+            if self.profile is None:
+                raise ValueError(f"找不到导出配置: {job['profile']}")
+        print(f"[工作] {self.worker_id} 已连接 {self.url}", flush=True)
+
+        success_count = 0
+        while True:
+            try:
+                lease = self.call('/lease', {'worker': self.worker_id})
+            except (URLError, OSError) as e:
+                print(f"[工作] 无法连接协调进程，退出: {e}", flush=True)
+                break
+            if lease.get('done'):
+                break
+            if 'wait' in lease:
+                time.sleep(lease['wait'])
+                continue
+
+            try:
+                results = self.process_chunk(lease)
+            except BaseException as e:
+                # 包括Ctrl+C：释放租约让其他工作进程立即重试这一块
+                try:
+                    self.call('/release', {'chunk': lease['chunk'], 'lease': lease['lease'], 'error': str(e) or type(e).__name__})
+                except (URLError, OSError):
+                    pass
+                if not isinstance(e, Exception):
+                    raise
+                print(f"[工作] 块 {lease['chunk']} 处理失败: {e}", flush=True)
+                continue
+
+            success_count += sum(1 for _, ok in results if ok)
+            try:
+                self.call('/complete', {'chunk': lease['chunk'], 'lease': lease['lease'], 'results': results})
+            except (URLError, OSError) as e:
+                print(f"[工作] 无法报告块 {lease['chunk']} 的结果: {e}", flush=True)
+        print(f"[工作] {self.worker_id} 结束，成功处理 {success_count} 张图片", flush=True)
+        return success_count
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""拍摄日期读取的基准测试：水印使用的exif_dates.format_capture_date与通过Pillow打开图片读取EXIF的对比
+
+在临时目录中生成一批小图片（默认10000张），按JPEG（DateTimeOriginal及时区、只有CreateDate、没有EXIF）、
+PNG（eXIf块）和TIFF混合，先完整读取一遍（使文件进入页缓存），再分别测量：
+  - Pillow：Image.open后读取Exif IFD中的日期，没有时使用修改时间（原来的做法）
+  - exif_dates.format_capture_date（日期水印和文本模板的{date}使用的函数），单线程和线程池
+  - exif_dates.read_shooting_info（文本模板读取相机、镜头等信息时使用的函数），单线程
+两种方法都找到EXIF日期的文件结果必须一致。也可以用--dir测量已有文件夹中的图片。
+
+结果不一致或加速比低于目标时以状态1退出：
+    python exif_benchmark.py
+    python exif_benchmark.py --files 2000 --workers 4 --min-speedup 3
+    python exif_benchmark.py --dir ~/Pictures
+"""
+
+import io
+import os
+import sys
+import time
+
+DEFAULT_FILES = 10000
+DEFAULT_WORKERS = 8
+# 单线程读取相对Pillow的最低加速比
+MIN_SPEEDUP = 2.0
+DATE_FORMAT = '%Y-%m-%d %H:%M'
+
+TAG_EXIF_IFD = 0x8769
+TAG_MAKE = 0x010F
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_CREATE_DATE = 0x9004
+TAG_OFFSET_TIME_ORIGINAL = 0x9011
+
+
+def sample_files():
+    """各类样本文件的内容，返回[(文件名后缀, 字节)]"""
+    from PIL import Image
+
+    def encode(img, format, **options):
+        buffer = io.BytesIO()
+        img.save(buffer, format, **options)
+        return buffer.getvalue()
+
+    def exif_bytes(tags):
+        exif = Image.Exif()
+        exif[TAG_MAKE] = 'Canon'
+        exif.get_ifd(TAG_EXIF_IFD).update(tags)
+        return exif.tobytes()
+
+    img = Image.new('RGB', (64, 48), (90, 120, 160))
+    original = exif_bytes({TAG_DATETIME_ORIGINAL: '2024:05:06 07:08:09', TAG_OFFSET_TIME_ORIGINAL: '+08:00'})
+    create_only = exif_bytes({TAG_CREATE_DATE: '2023:01:02 03:04:05'})
+    return [
+        ('.jpg', encode(img, 'JPEG', exif=original)),
+        ('.jpg', encode(img, 'JPEG', exif=create_only)),
+        ('.jpg', encode(img, 'JPEG')),
+        ('.png', encode(img, 'PNG', exif=original)),
+        ('.tif', encode(img, 'TIFF', exif=original)),
+    ]
+
+
+def generate(directory, count):
+    """在directory中生成count个样本文件，返回路径列表"""
+    samples = sample_files()
+    paths = []
+    for i in range(count):
+        extension, data = samples[i % len(samples)]
+        path = os.path.join(directory, f"img_{i:06d}{extension}")
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+def pillow_capture_date(image_path, date_format):
+    """原来的做法：Pillow打开图片读取EXIF日期，返回(格式化的日期, 是否来自EXIF)"""
+    from datetime import datetime
+    from PIL import Image
+
+    try:
+        with Image.open(image_path) as img:
+            exif_ifd = img.getexif().get_ifd(TAG_EXIF_IFD)
+        value = exif_ifd.get(TAG_DATETIME_ORIGINAL) or exif_ifd.get(TAG_CREATE_DATE)
+        if value:
+            return datetime.strptime(value.strip('\x00 '), '%Y:%m:%d %H:%M:%S').strftime(date_format), True
+    except Exception:
+        pass
+    return datetime.fromtimestamp(os.path.getmtime(image_path)).strftime(date_format), False
+
+
+def pooled_capture_dates(paths, date_format, workers):
+    """用线程池对每个文件调用format_capture_date，返回{路径: 格式化的日期}"""
+    from concurrent.futures import ThreadPoolExecutor
+    from exif_dates import format_capture_date
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(paths, executor.map(lambda path: format_capture_date(path, date_format), paths)))
+
+
+def timed(function):
+    started = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - started
+
+
+def main():
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='对比format_capture_date与通过Pillow读取拍摄日期的速度')
+    parser.add_argument('--files', type=int, default=DEFAULT_FILES, help=f'生成的样本文件数量（默认：{DEFAULT_FILES}）')
+    parser.add_argument('--dir', help='改为测量该文件夹（含子文件夹）中已有的图片，不生成样本')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f'线程池大小（默认：{DEFAULT_WORKERS}）')
+    parser.add_argument('--min-speedup', type=float, default=MIN_SPEEDUP,
+                        help=f'单线程读取相对Pillow的最低加速比，0为不检查（默认：{MIN_SPEEDUP}）')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from exif_dates import format_capture_date, read_capture_time, read_shooting_info
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if args.dir:
+            from scanner import scan_images
+            paths = scan_images([args.dir])
+        else:
+            paths = generate(temp_dir, args.files)
+        if not paths:
+            print("没有找到图片")
+            return 1
+        # 先完整读取一遍，各方法都在页缓存中读取
+        for path in paths:
+            with open(path, 'rb') as f:
+                f.read()
+
+        reference, pillow_seconds = timed(lambda: {path: pillow_capture_date(path, DATE_FORMAT) for path in paths})
+        serial, serial_seconds = timed(lambda: {path: format_capture_date(path, DATE_FORMAT) for path in paths})
+        pooled, pooled_seconds = timed(lambda: pooled_capture_dates(paths, DATE_FORMAT, args.workers))
+        _, info_seconds = timed(lambda: [read_shooting_info(path) for path in paths])
+        found = sum(1 for path in paths if read_capture_time(path) is not None)
+
+    mismatches = [path for path, (date, from_exif) in reference.items()
+                  if from_exif and (serial[path] != date or pooled[path] != date)]
+    speedup = pillow_seconds / serial_seconds
+    print(f"{len(paths)}个文件，其中{found}个有EXIF日期（Pillow找到{sum(1 for _, e in reference.values() if e)}个）")
+    print(f"  Pillow读取EXIF:               {pillow_seconds:.3f}秒")
+    print(f"  format_capture_date单线程:   {serial_seconds:.3f}秒（{speedup:.1f}倍）")
+    print(f"  format_capture_date {args.workers}线程:   {pooled_seconds:.3f}秒（{pillow_seconds / pooled_seconds:.1f}倍）")
+    print(f"  read_shooting_info单线程:    {info_seconds:.3f}秒（{pillow_seconds / info_seconds:.1f}倍）")
+
+    failed = False
+    for path in mismatches[:10]:
+        print(f"结果不一致: {path}: Pillow {reference[path][0]}，format_capture_date {serial[path]} / {pooled[path]}")
+    if mismatches:
+        print(f"共{len(mismatches)}个文件结果不一致")
+        failed = True
+    if args.min_speedup and speedup < args.min_speedup:
+        print(f"低于目标: 加速比{speedup:.1f}倍 < {args.min_speedup}倍")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""快速读取拍摄日期和拍摄信息
+
+只读取文件中EXIF所在的一小段：JPEG逐段跳过直到APP1，TIFF从文件头开始，PNG逐块跳过直到eXIf。
+然后在TIFF结构中沿IFD0 -> Exif IFD找到DateTimeOriginal/CreateDate及对应的时区偏移，
+不需要Pillow打开图片，也不解析其他标签。
+水印文本模板需要的相机、镜头、曝光等信息（ShootingInfo）在同一次遍历中与拍摄日期一起读取。
+"""
+
+import io
+import os
+import struct
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+# 用到的EXIF标签
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_CREATE_DATE = 0x9004
+TAG_OFFSET_TIME = 0x9010
+TAG_OFFSET_TIME_ORIGINAL = 0x9011
+TAG_OFFSET_TIME_DIGITIZED = 0x9012
+
+# 拍摄信息用到的IFD0和Exif IFD标签
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_ARTIST = 0x013B
+TAG_COPYRIGHT = 0x8298
+TAG_EXPOSURE_TIME = 0x829A
+TAG_F_NUMBER = 0x829D
+TAG_ISO = 0x8827
+TAG_FOCAL_LENGTH = 0x920A
+TAG_LENS_MODEL = 0xA434
+
+# 按优先级排列的(日期标签, 时区标签)
+DATE_TAGS = [
+    (TAG_DATETIME_ORIGINAL, TAG_OFFSET_TIME_ORIGINAL),
+    (TAG_CREATE_DATE, TAG_OFFSET_TIME_DIGITIZED),
+]
+
+DATE_EXIF_TAGS = {tag for pair in DATE_TAGS for tag in pair} | {TAG_OFFSET_TIME}
+INFO_IFD0_TAGS = {TAG_EXIF_IFD, TAG_MAKE, TAG_MODEL, TAG_ARTIST, TAG_COPYRIGHT}
+INFO_EXIF_TAGS = DATE_EXIF_TAGS | {TAG_EXPOSURE_TIME, TAG_F_NUMBER, TAG_ISO, TAG_FOCAL_LENGTH, TAG_LENS_MODEL}
+
+# 一次读取的拍摄信息，没有的项为None：date为拍摄时间（datetime），exposure_time、f_number和
+# focal_length为(分子, 分母)，iso为整数，其余为字符串
+ShootingInfo = namedtuple('ShootingInfo', 'date make model lens artist copyright iso exposure_time f_number focal_length')
+NO_SHOOTING_INFO = ShootingInfo(*[None] * len(ShootingInfo._fields))
+
+# 默认的输出格式
+DEFAULT_DATE_FORMAT = '%Y-%m-%d'
+# EXIF中的日期写法（标准为第一种，部分软件写成其他几种）
+EXIF_DATE_FORMATS = ['%Y:%m:%d %H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y:%m:%d %H:%M', '%Y:%m:%d']
+
+EXIF_HEADER = b'Exif\x00\x00'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# IFD目录项数量的上限，超过时认为数据已损坏
+MAX_IFD_ENTRIES = 1000
+
+
+def find_tiff_header(f):
+    """返回文件中EXIF（TIFF结构）的起始偏移，没有EXIF时返回None"""
+    head = f.read(8)
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 0
+    if head[:2] == b'\xff\xd8':
+        return _find_jpeg_exif(f)
+    if head == PNG_SIGNATURE:
+        return _find_png_exif(f)
+    return None
+
+
+def _find_jpeg_exif(f):
+    # 从SOI之后逐个读取段头，跳过段数据，直到APP1中的Exif或图像数据开始
+    position = 2
+    while True:
+        f.seek(position)
+        header = f.read(4)
+        if len(header) < 4 or header[0] != 0xFF:
+            return None
+        marker = header[1]
+        if marker == 0xFF:
+            # 填充字节
+            position += 1
+            continue
+        if marker in (0xDA, 0xD9):
+            # SOS之后是图像数据，EXIF只会出现在它之前
+            return None
+        length = struct.unpack('>H', header[2:])[0]
+        if marker == 0xE1 and f.read(6) == EXIF_HEADER:
+            return position + 4 + len(EXIF_HEADER)
+        position += 2 + length
+
+
+def _find_png_exif(f):
+    # 逐个读取数据块头，跳过块数据，直到eXIf（可能在图像数据之后）
+    position = len(PNG_SIGNATURE)
+    while True:
+        f.seek(position)
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type == b'eXIf':
+            # 个别软件在块数据前加了Exif头
+            if f.read(6) == EXIF_HEADER:
+                return position + 8 + len(EXIF_HEADER)
+            return position + 8
+        if chunk_type == b'IEND':
+            return None
+        position += 12 + length
+
+
+def _read_ifd(f, base, endian, offset, tags):
+    """读取一个IFD中指定标签的值，返回{标签: 值}
+
+    ASCII返回字符串，SHORT和LONG返回（第一个值的）整数，RATIONAL返回(分子, 分母)。
+    """
+    f.seek(base + offset)
+    data = f.read(2)
+    if len(data) < 2:
+        return {}
+    count = struct.unpack(endian + 'H', data)[0]
+    if count > MAX_IFD_ENTRIES:
+        return {}
+    entries = f.read(12 * count)
+    values = {}
+    for i in range(len(entries) // 12):
+        tag, field_type, value_count = struct.unpack_from(endian + 'HHI', entries, 12 * i)
+        if tag not in tags:
+            continue
+        raw = entries[12 * i + 8:12 * i + 12]
+        if field_type == 2:
+            # ASCII：不超过4字节时直接存放在目录项中，否则是偏移
+            if value_count > 4:
+                f.seek(base + struct.unpack(endian + 'I', raw)[0])
+                raw = f.read(value_count)
+            # 标准要求ASCII，作者、版权常被写成UTF-8（ASCII部分两者相同）
+            values[tag] = raw[:value_count].split(b'\x00', 1)[0].decode('utf-8', 'replace').strip()
+        elif field_type == 3:
+            values[tag] = struct.unpack(endian + 'H', raw[:2])[0]
+        elif field_type in (4, 13):
+            values[tag] = struct.unpack(endian + 'I', raw)[0]
+        elif field_type == 5:
+            # RATIONAL占8字节，总是通过偏移存放
+            f.seek(base + struct.unpack(endian + 'I', raw)[0])
+            rational = f.read(8)
+            if len(rational) == 8:
+                values[tag] = struct.unpack(endian + 'II', rational)
+    return values
+
+
+def _read_tiff_tags(f, base, ifd0_tags, exif_tags):
+    """从base处的TIFF结构中读取IFD0和Exif IFD中的指定标签，返回两个{标签: 值}"""
+    f.seek(base)
+    header = f.read(8)
+    if len(header) < 8:
+        return {}, {}
+    if header[:2] == b'II':
+        endian = '<'
+    elif header[:2] == b'MM':
+        endian = '>'
+    else:
+        return {}, {}
+    ifd0 = struct.unpack(endian + 'I', header[4:])[0]
+    ifd0_values = _read_ifd(f, base, endian, ifd0, ifd0_tags)
+    exif_ifd = ifd0_values.get(TAG_EXIF_IFD)
+    exif_values = _read_ifd(f, base, endian, exif_ifd, exif_tags) if exif_ifd else {}
+    return ifd0_values, exif_values
+
+
+def _pick_date(exif_values):
+    for date_tag, offset_tag in DATE_TAGS:
+        date = parse_exif_date(exif_values.get(date_tag),
+                               exif_values.get(offset_tag) or exif_values.get(TAG_OFFSET_TIME))
+        if date:
+            return date
+    return None
+
+
+def read_tiff_date(f, base):
+    """从base处的TIFF结构中读取拍摄时间，返回datetime（有时区偏移时带时区）或None"""
+    return _pick_date(_read_tiff_tags(f, base, {TAG_EXIF_IFD}, DATE_EXIF_TAGS)[1])
+
+
+def read_tiff_info(f, base):
+    """从base处的TIFF结构中一次读取拍摄时间和拍摄信息，返回ShootingInfo"""
+    ifd0_values, exif_values = _read_tiff_tags(f, base, INFO_IFD0_TAGS, INFO_EXIF_TAGS)
+    return ShootingInfo(
+        date=_pick_date(exif_values),
+        make=ifd0_values.get(TAG_MAKE) or None,
+        model=ifd0_values.get(TAG_MODEL) or None,
+        lens=exif_values.get(TAG_LENS_MODEL) or None,
+        artist=ifd0_values.get(TAG_ARTIST) or None,
+        copyright=ifd0_values.get(TAG_COPYRIGHT) or None,
+        iso=exif_values.get(TAG_ISO) or None,
+        exposure_time=_rational(exif_values.get(TAG_EXPOSURE_TIME)),
+        f_number=_rational(exif_values.get(TAG_F_NUMBER)),
+        focal_length=_rational(exif_values.get(TAG_FOCAL_LENGTH)),
+    )
+
+
+def _rational(value):
+    # 分母为0或类型不对的值按没有处理
+    if isinstance(value, tuple) and value[1]:
+        return value
+    return None
+
+
+def parse_exif_date(value, offset=None):
+    """解析EXIF日期字符串，offset是"+08:00"形式的时区偏移"""
+    if not value:
+        return None
+    for date_format in EXIF_DATE_FORMATS:
+        try:
+            date = datetime.strptime(value, date_format)
+            break
+        except ValueError:
+            continue
+    else:
+        return None
+    if offset and len(offset) >= 6 and offset[0] in '+-':
+        try:
+            minutes = int(offset[1:3]) * 60 + int(offset[4:6])
+        except ValueError:
+            return date
+        sign = -1 if offset[0] == '-' else 1
+        date = date.replace(tzinfo=timezone(timedelta(minutes=sign * minutes)))
+    return date
+
+
+def read_capture_time(image_path, source=None):
+    """读取图片文件的拍摄时间，没有EXIF日期时返回None
+
+    source是已经读入内存的文件内容（类文件对象），提供时不再打开image_path。
+    """
+    try:
+        if source is not None:
+            source.seek(0)
+            return _read_capture_time(source)
+        with open(image_path, 'rb') as f:
+            return _read_capture_time(f)
+    except (OSError, struct.error):
+        return None
+
+
+def _read_capture_time(f):
+    base = find_tiff_header(f)
+    if base is None:
+        return None
+    return read_tiff_date(f, base)
+
+
+def read_shooting_info(image_path, source=None):
+    """读取图片文件的拍摄时间和拍摄信息（ShootingInfo），没有EXIF时各项均为None"""
+    try:
+        if source is not None:
+            source.seek(0)
+            return _read_shooting_info(source)
+        with open(image_path, 'rb') as f:
+            return _read_shooting_info(f)
+    except (OSError, struct.error):
+        return NO_SHOOTING_INFO
+
+
+def _read_shooting_info(f):
+    base = find_tiff_header(f)
+    if base is None:
+        return NO_SHOOTING_INFO
+    return read_tiff_info(f, base)
+
+
+def shooting_info_from_exif(exif):
+    """从已经读到内存中的原始EXIF（可带Exif头）读取拍摄时间和拍摄信息"""
+    try:
+        base = len(EXIF_HEADER) if exif.startswith(EXIF_HEADER) else 0
+        return read_tiff_info(io.BytesIO(exif), base)
+    except struct.error:
+        return NO_SHOOTING_INFO
+
+
+def capture_time_from_exif(exif):
+    """从已经读到内存中的原始EXIF（可带Exif头）读取拍摄时间"""
+    try:
+        base = len(EXIF_HEADER) if exif.startswith(EXIF_HEADER) else 0
+        return read_tiff_date(io.BytesIO(exif), base)
+    except struct.error:
+        return None
+
+
+def format_capture_date(image_path, date_format=DEFAULT_DATE_FORMAT, exif=None, mtime=None, source=None):
+    """返回格式化的拍摄日期；没有EXIF日期时使用文件修改时间，文件不可读时使用当前日期
+
+    exif是解码时已经取得的原始EXIF数据，source是已读入内存的文件内容，mtime是已经取得的修改时间，
+    提供时不再访问文件。
+    """
+    try:
+        date = capture_time_from_exif(exif) if exif else read_capture_time(image_path, source)
+        if date is None:
+            date = datetime.fromtimestamp(mtime if mtime is not None else os.path.getmtime(image_path))
+        return date.strftime(date_format)
+    except Exception as e:
+        print(f"无法获取图片{image_path}的拍摄日期: {e}")
+        # 返回当前日期作为后备选项
+        return datetime.now().strftime(date_format)
+
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""图形界面的后台导出任务
+
+导出在后台线程中运行（内部仍由ExportScheduler分配给工作线程），界面线程只接收信号更新进度，
+导出期间主窗口保持可操作，可以导入和设置下一批图片。写入之前的预演（ExportPlan读取每张图片的文件头、
+检查输出路径冲突）也在后台线程中进行，有冲突或无法读取的图片时暂停，等界面确认后再开始写入。
+
+取消是协作式的：原图通过CancellableReader读取、输出通过CancellableWriter写入，
+Pillow解码和编码时按块读写文件，取消后下一次读写就会中断当前图片，
+不必等一张几百MB的图片处理完。压缩的TIFF（LZW、ZIP等）例外：libtiff一次读入整个文件后解码，
+解码期间无法中断，取消在解码结束后第一次写入输出时生效。输出先写入临时文件，成功后才改名为输出文件，
+取消或失败时不会留下写了一半的图片。
+"""
+
+import os
+import time
+import threading
+from collections import namedtuple
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from backends import PillowBackend
+from export_plan import ExportPlan
+from scheduler import ExportScheduler
+
+# 进度信号的内容：eta为预计剩余秒数，还无法估算时为None
+ExportProgress = namedtuple('ExportProgress', 'done total failed images_per_second megabytes_per_second eta')
+
+# 输出写完之前使用的临时文件后缀
+PARTIAL_SUFFIX = '.part'
+
+
+class ExportCancelled(BaseException):
+    """导出已取消
+
+    继承BaseException，使取消能穿过各处理函数中的except Exception直接结束当前图片。
+    """
+
+
+class CancellableReader:
+    """只读打开原图，每次读取前检查是否已取消
+
+    不提供name和fileno，Pillow因此按块调用read（不使用mmap），取消在解码过程中生效。
+    压缩的TIFF交给libtiff解码，Pillow一次read读入整个文件，取消要等解码结束后才生效。
+    """
+
+    def __init__(self, path, cancelled):
+        self.file = open(path, 'rb')
+        self.cancelled = cancelled
+
+    def read(self, size=-1):
+        if self.cancelled.is_set():
+            raise ExportCancelled()
+        return self.file.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CancellableWriter:
+    """写入输出的临时文件，每次写入前检查是否已取消；finish时改名为输出文件或删除"""
+
+    def __init__(self, output_path, cancelled):
+        self.output_path = output_path
+        self.partial_path = output_path + PARTIAL_SUFFIX
+        self.file = open(self.partial_path, 'wb')
+        self.cancelled = cancelled
+
+    def write(self, data):
+        if self.cancelled.is_set():
+            raise ExportCancelled()
+        return self.file.write(data)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def flush(self):
+        self.file.flush()
+
+    def finish(self, success):
+        self.file.close()
+        if success:
+            os.replace(self.partial_path, self.output_path)
+        else:
+            try:
+                os.remove(self.partial_path)
+            except OSError:
+                pass
+
+
+class ExportJob(QObject):
+    """在后台线程中导出一批图片，通过信号报告进度
+
+    信号在后台线程中发出，Qt按排队连接在界面线程中调用槽函数：
+      planned(ExportPlan, 是否等待确认)
+                                   预演完成；等待确认时调用resume开始写入，或调用cancel放弃
+      progress(ExportProgress)     每完成一张图片
+      file_failed(路径, 原因)       一张图片处理失败
+      finished(结果, 是否已取消)    全部结束，结果为{图片路径: 是否成功}，取消后未处理的图片不在其中
+    """
+
+    planned = pyqtSignal(object, bool)
+    progress = pyqtSignal(object)
+    file_failed = pyqtSignal(str, str)
+    finished = pyqtSignal(object, bool)
+
+    def __init__(self, items, job, backend=None, scheduler=None, parent=None):
+        """items是[(图片路径, 输出)]，输出为单一输出路径，或使用导出配置时的[(rendition, 输出路径)]"""
+        super().__init__(parent)
+        self.items = dict(items)
+        self.job = job
+        self.backend = backend or PillowBackend()
+        self.scheduler = scheduler or ExportScheduler()
+        self.cancelled = threading.Event()
+        self.resumed = threading.Event()
+        self.plan = None
+        self.thread = None
+        self.sizes = {}
+        self.started = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def resume(self):
+        """确认预演报告的冲突，开始写入"""
+        self.resumed.set()
+
+    def cancel(self):
+        """请求取消：不再开始新的图片，正在处理的图片在下一次读写时中断"""
+        self.cancelled.set()
+        self.resumed.set()
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def wait(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def process(self, image_path):
+        """在工作线程中调用：处理一张图片，所有输出都成功后才改名为输出文件"""
+        writers = []
+
+        def open_target(output_path):
+            writer = CancellableWriter(output_path, self.cancelled)
+            writers.append(writer)
+            return writer
+
+        success = False
+        try:
+            with CancellableReader(image_path, self.cancelled) as source:
+                success = self.backend.export(image_path, self.items[image_path], self.job,
+                                              source=source, open_target=open_target)
+        except ExportCancelled:
+            return None
+        except Exception as e:
+            self.file_failed.emit(image_path, str(e))
+            return False
+        finally:
+            for writer in writers:
+                writer.finish(success)
+        if not success:
+            self.file_failed.emit(image_path, "处理失败")
+        return success
+
+    def report_progress(self, results):
+        """按已处理的原图字节数计算速度和剩余时间（图片大小不一，按字节比按张数准确）"""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        done_bytes = sum(self.sizes[path] for path in results)
+        remaining_bytes = sum(self.sizes.values()) - done_bytes
+        eta = remaining_bytes / done_bytes * elapsed if done_bytes else None
+        failed = sum(1 for ok in results.values() if not ok)
+        self.progress.emit(ExportProgress(len(results), len(self.items), failed, len(results) / elapsed,
+                                          done_bytes / elapsed / 1024 ** 2, eta))
+
+    def run(self):
+        # 预演只读取文件头，但图片多时仍需要较长时间，因此也在后台线程中进行
+        self.plan = ExportPlan(self.items.items(), self.scheduler.workers, self.backend)
+        needs_confirmation = bool(self.plan.conflicts or self.plan.unreadable)
+        if not needs_confirmation:
+            self.resumed.set()
+        self.planned.emit(self.plan, needs_confirmation)
+        self.resumed.wait()
+        if self.cancelled.is_set():
+            self.finished.emit({}, True)
+            return
+
+        self.started = time.monotonic()
+        for image_path in self.items:
+            try:
+                self.sizes[image_path] = os.path.getsize(image_path)
+            except OSError:
+                self.sizes[image_path] = 0
+        results = {}
+
+        def on_result(image_path, result, done):
+            # 被取消中断的图片不计入结果
+            if result is not None:
+                results[image_path] = result
+                self.report_progress(results)
+
+        self.scheduler.run(list(self.items), self.process, on_result=on_result,
+                           should_stop=self.cancelled.is_set)
+        self.finished.emit(results, self.cancelled.is_set())
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""导出前的预演：在写入任何图片之前检查输出路径并估算输出大小和耗时
+
+只读取每张图片的文件头得到尺寸，计算所有输出路径，找出几张原图输出到同一个文件
+（如a.png和a.jpg都输出为a.jpg）、输出会覆盖已有文件或原图的情况。
+然后抽取少量图片在内存中完整处理一遍（不写文件），按像素数推算全部输出的大小和耗时。
+"""
+
+import io
+import os
+import time
+from collections import namedtuple
+
+from PIL import Image
+
+import watermark_core
+from backends import PillowBackend
+
+# outputs为[(输出路径, 输出尺寸)]；文件头无法读取时width/height为None
+PlannedImage = namedtuple('PlannedImage', 'path width height outputs')
+# kind为'collision'（多个输出是同一个文件）、'source'（输出会覆盖原图）或'exists'（输出文件已存在）
+Conflict = namedtuple('Conflict', 'kind output_path sources')
+# sampled为抽样的图片数量，为0时按经验值估算大小且没有耗时估算
+PlanEstimate = namedtuple('PlanEstimate', 'output_bytes seconds sampled')
+
+CONFLICT_LABELS = {
+    'collision': '多张图片输出到同一个文件',
+    'source': '输出会覆盖原图',
+    'exists': '输出文件已存在',
+}
+
+# 会使输出丢失的冲突：实际导出前遇到这些冲突时不写入任何文件（输出文件已存在只是覆盖上次的结果）
+BLOCKING_CONFLICTS = ('collision', 'source')
+
+# 没有抽样结果时每个输出像素的字节数（按扩展名，质量95左右的照片）
+DEFAULT_BYTES_PER_PIXEL = {'.jpg': 0.6, '.jpeg': 0.6, '.png': 2.5}
+DEFAULT_SAMPLE_SIZE = 3
+
+
+def path_key(path):
+    """用于比较的规范化路径（解析符号链接和相对路径，不区分大小写的系统上忽略大小写）"""
+    return os.path.normcase(os.path.realpath(path))
+
+
+def output_list(outputs):
+    """把单一输出路径或[(rendition, 输出路径)]统一为[(rendition或None, 输出路径)]"""
+    if isinstance(outputs, str):
+        return [(None, outputs)]
+    return list(outputs)
+
+
+def read_header(image_path, outputs):
+    """只读取文件头，得到原图尺寸和每个输出的尺寸"""
+    try:
+        with Image.open(image_path) as img:
+            size = img.size
+    except Exception:
+        return PlannedImage(image_path, None, None, [(path, None) for _, path in output_list(outputs)])
+    planned = []
+    for rendition, output_path in output_list(outputs):
+        max_size = rendition.get('max_size') if rendition else None
+        planned.append((output_path, watermark_core.rendition_size(size, max_size)))
+    return PlannedImage(image_path, size[0], size[1], planned)
+
+
+def find_conflicts(images):
+    """找出输出路径的冲突，返回[Conflict]"""
+    sources = {path_key(image.path): image.path for image in images}
+    targets = {}
+    for image in images:
+        for output_path, _ in image.outputs:
+            targets.setdefault(path_key(output_path), (output_path, []))[1].append(image.path)
+
+    conflicts = []
+    for key, (output_path, from_images) in targets.items():
+        if len(from_images) > 1:
+            conflicts.append(Conflict('collision', output_path, from_images))
+        if key in sources:
+            conflicts.append(Conflict('source', output_path, from_images))
+        elif os.path.exists(output_path):
+            conflicts.append(Conflict('exists', output_path, from_images))
+    return conflicts
+
+
+def pick_samples(images, sample_size):
+    """在按像素数排序的图片中等间隔抽样，大小不同的图片都有代表"""
+    readable = sorted((image for image in images if image.width), key=lambda image: image.width * image.height)
+    if len(readable) <= sample_size:
+        return readable
+    step = (len(readable) - 1) / max(1, sample_size - 1)
+    return [readable[int(round(i * step))] for i in range(sample_size)]
+
+
+def render_sample(image, items, job, backend):
+    """在内存中完整处理一张图片，返回{输出路径: 编码后的字节数}；处理失败时返回None"""
+    buffers = {}
+
+    def open_target(output_path):
+        return buffers.setdefault(output_path, io.BytesIO())
+
+    if not backend.export(image.path, items[image.path], job, open_target=open_target):
+        return None
+    return {output_path: len(buffer.getvalue()) for output_path, buffer in buffers.items()}
+
+
+class ExportPlan:
+    """一次导出的预演结果"""
+
+    def __init__(self, items, workers=None, backend=None):
+        """items是[(图片路径, 输出)]，输出为单一输出路径，或使用导出配置时的[(rendition, 输出路径)]"""
+        self.items = dict(items)
+        self.backend = backend or PillowBackend()
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.images = [read_header(image_path, outputs) for image_path, outputs in self.items.items()]
+        self.unreadable = [image.path for image in self.images if image.width is None]
+        self.conflicts = find_conflicts(self.images)
+        self.estimate = None
+
+    @property
+    def blocking_conflicts(self):
+        return [conflict for conflict in self.conflicts if conflict.kind in BLOCKING_CONFLICTS]
+
+    @property
+    def output_count(self):
+        return sum(len(image.outputs) for image in self.images)
+
+    def measure(self, job, sample_size=DEFAULT_SAMPLE_SIZE):
+        """抽样处理几张图片（不写文件），按像素数推算全部输出的字节数和耗时"""
+        bytes_per_pixel = {}
+        sample_seconds = 0.0
+        sample_pixels = 0
+        sampled = 0
+        for image in pick_samples(self.images, sample_size):
+            started = time.monotonic()
+            sizes = render_sample(image, self.items, job, self.backend)
+            if sizes is None:
+                continue
+            sample_seconds += time.monotonic() - started
+            sample_pixels += image.width * image.height
+            sampled += 1
+            for output_path, output_size in image.outputs:
+                ext = os.path.splitext(output_path)[1].lower()
+                total_bytes, total_pixels = bytes_per_pixel.get(ext, (0, 0))
+                bytes_per_pixel[ext] = (total_bytes + sizes.get(output_path, 0),
+                                        total_pixels + output_size[0] * output_size[1])
+
+        output_bytes = 0
+        for image in self.images:
+            for output_path, output_size in image.outputs:
+                if output_size is None:
+                    continue
+                ext = os.path.splitext(output_path)[1].lower()
+                total_bytes, total_pixels = bytes_per_pixel.get(ext, (0, 0))
+                ratio = total_bytes / total_pixels if total_pixels else DEFAULT_BYTES_PER_PIXEL.get(ext, 1.0)
+                output_bytes += int(ratio * output_size[0] * output_size[1])
+
+        seconds = None
+        if sample_pixels:
+            total_pixels = sum(image.width * image.height for image in self.images if image.width)
+            # 各线程并行处理，图片数量少于线程数时只能用到部分线程
+            parallel = min(self.workers, max(1, len(self.images) - len(self.unreadable)))
+            seconds = sample_seconds / sample_pixels * total_pixels / parallel
+        self.estimate = PlanEstimate(output_bytes, seconds, sampled)
+        return self.estimate
+
+    def format_report(self, max_conflicts=20):
+        lines = [f"{len(self.images)} 张图片，{self.output_count} 个输出文件"]
+        if self.estimate:
+            line = f"预计输出 {self.estimate.output_bytes / 1024 ** 2:.1f}MB"
+            if self.estimate.seconds is not None:
+                line += f"，用时约 {self.estimate.seconds:.1f}秒（抽样 {self.estimate.sampled} 张，{self.workers} 个线程）"
+            lines.append(line)
+        if self.unreadable:
+            lines.append(f"无法读取 {len(self.unreadable)} 张图片: " + ', '.join(self.unreadable[:5]))
+        for conflict in self.conflicts[:max_conflicts]:
+            lines.append(f"{CONFLICT_LABELS[conflict.kind]}: {conflict.output_path} <- {', '.join(conflict.sources)}")
+        if len(self.conflicts) > max_conflicts:
+            lines.append(f"……另有 {len(self.conflicts) - max_conflicts} 处冲突")
+        if not self.conflicts:
+            lines.append("没有输出路径冲突")
+        return '\n'.join(lines)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""隐形水印：把一小段文本（如"模板名|拍摄日期"）嵌入图片亮度的8×8块DCT系数中
+
+每个8×8块只用两个低中频系数(1,2)和(2,1)：按它们的差值的正负表示一位，差值不足时把两者向相反方向推开。
+块和位的对应关系以及每块的正负翻转由固定的伪随机序列决定，每一位重复写入图片中的大量块，
+提取时对所有块的差值加权投票，经过JPEG压缩后仍能读出。载荷带长度和CRC32，校验不通过即认为没有水印。
+
+只需要两个系数，DCT不必完整计算：基图像可以分解为行、列两个一维向量，先按列再按行做两次小矩阵乘法
+就能一次算出条带中所有块的系数。像素修改量只取决于取整后的系数修改量，预先算成查找表，
+按块取出后用饱和加减直接修改8位像素，不必转换为更宽的类型。
+处理按条带进行，内存占用与图片宽度成正比。平移裁剪和缩放会破坏分块对齐，之后无法再提取。
+16位灰度图片（如16位PNG）的系数按换算到8位的亮度计算，修改量乘以257后加到16位像素上，
+提取时同样换算，保存为16位PNG的图片也能读出。其他无法嵌入的图片（如小于一个块）抛出ValueError，
+该图片导出失败，不会在没有隐形水印的情况下输出。
+"""
+
+import zlib
+import struct
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+BLOCK = 8
+# 嵌入所用的两个低中频系数（JPEG对它们的量化步长较小，质量75压缩后仍能保留）
+COEFFICIENTS = ((1, 2), (2, 1))
+# 系数差值的最小幅度；纹理丰富的块（系数本身较大）按比例加强，最多MAX_STRENGTH
+STRENGTH = 10.0
+MAX_STRENGTH = 24.0
+TEXTURE_GAIN = 0.25
+# 载荷：1字节长度 + 最多MAX_PAYLOAD字节的UTF-8文本 + 4字节CRC32
+MAX_PAYLOAD = 31
+PAYLOAD_BITS = (1 + MAX_PAYLOAD + 4) * 8
+# 决定块和位对应关系的伪随机种子（修改后旧图片无法再提取）
+MARK_SEED = 0x57A7E2
+# 每个条带的块行数（条带较小时修改像素的几次运算都在CPU缓存中完成）
+STRIP_BLOCKS = 4
+# 16位灰度模式：按8位亮度计算，像素修改量乘以WIDE_SCALE
+WIDE_MODES = ('I;16', 'I')
+WIDE_SCALE = 257
+# 可以嵌入的图片模式
+SUPPORTED_MODES = ('RGB', 'RGBA', 'L', 'LA', 'CMYK') + WIDE_MODES
+
+
+def dct_vector(k):
+    """8点正交DCT-II的第k个基向量"""
+    x = np.arange(BLOCK)
+    scale = np.sqrt((1 if k == 0 else 2) / BLOCK)
+    return (scale * np.cos((2 * x + 1) * k * np.pi / (2 * BLOCK))).astype(np.float32)
+
+
+def dct_basis(u, v):
+    """8×8正交DCT-II中系数(u, v)对应的基图像"""
+    return np.outer(dct_vector(u), dct_vector(v))
+
+
+BASIS_A = dct_basis(*COEFFICIENTS[0])
+BASIS_B = dct_basis(*COEFFICIENTS[1])
+# 系数a增加delta/2、系数b减少delta/2时像素的变化量（每单位delta）
+PATTERN = (BASIS_A - BASIS_B) / 2
+# 计算系数时按列使用的基向量（COEFFICIENTS中出现的所有列序号）
+COLUMN_INDEXES = sorted({v for _, v in COEFFICIENTS})
+COLUMN_VECTORS = np.stack([dct_vector(v) for v in COLUMN_INDEXES], axis=1)
+# 查找表覆盖的系数修改量范围（更大的修改量按此截断，像素本身也只有0~255）
+MAX_DELTA = 255
+
+
+def encode_payload(text):
+    """把文本编码为PAYLOAD_BITS个0/1，超长的文本按UTF-8字符截断"""
+    data = text.encode('utf-8')[:MAX_PAYLOAD].decode('utf-8', 'ignore').encode('utf-8')
+    packed = bytes([len(data)]) + data.ljust(MAX_PAYLOAD, b'\x00')
+    packed += struct.pack('>I', zlib.crc32(packed))
+    return np.unpackbits(np.frombuffer(packed, dtype=np.uint8))
+
+
+def decode_payload(bits):
+    """把提取的位解码为文本，长度或CRC32不正确时返回None"""
+    packed = np.packbits(bits.astype(np.uint8)).tobytes()
+    body, crc = packed[:-4], struct.unpack('>I', packed[-4:])[0]
+    if zlib.crc32(body) != crc or body[0] > MAX_PAYLOAD:
+        return None
+    return body[1:1 + body[0]].decode('utf-8', 'replace')
+
+
+@lru_cache(maxsize=8)
+def block_layout(blocks_y, blocks_x):
+    """每个块对应的位序号和正负翻转（由MARK_SEED决定，只与分块数量有关，同样尺寸的图片共用）"""
+    rng = np.random.default_rng([MARK_SEED, blocks_y, blocks_x])
+    bit_index = rng.integers(0, PAYLOAD_BITS, size=(blocks_y, blocks_x))
+    flips = rng.integers(0, 2, size=(blocks_y, blocks_x)).astype(np.float32) * 2 - 1
+    return bit_index, flips
+
+
+def luminance(img):
+    """图片的8位亮度（Pillow按ITU-R 601权重转换，与JPEG的Y通道一致），16位灰度换算为8位的浮点数"""
+    if img.mode in WIDE_MODES:
+        return np.asarray(img, dtype=np.float32) / WIDE_SCALE
+    if img.mode in ('L', 'LA'):
+        return np.asarray(img.getchannel(0))
+    return np.asarray(img.convert('L'))
+
+
+def block_difference(y):
+    """条带亮度按8×8分块后每块两个系数的差值和绝对值之和，形状为(块行数, 块列数)"""
+    height, width = y.shape
+    # 先把每块的8列分别与列基向量相乘，再把结果的8行与行基向量相乘
+    columns = (y.reshape(height, width // BLOCK, BLOCK) @ COLUMN_VECTORS).reshape(
+        height // BLOCK, BLOCK, width // BLOCK, len(COLUMN_INDEXES))
+    (ua, va), (ub, vb) = COEFFICIENTS
+    a = np.einsum('iaj,a->ij', columns[..., COLUMN_INDEXES.index(va)], dct_vector(ua))
+    b = np.einsum('iaj,a->ij', columns[..., COLUMN_INDEXES.index(vb)], dct_vector(ub))
+    return a - b, np.abs(a) + np.abs(b)
+
+
+@lru_cache(maxsize=None)
+def change_tables(mode):
+    """取整后的系数修改量(-MAX_DELTA~MAX_DELTA)对应的8×8×通道数像素增量和减量，均为uint8
+
+    RGB(A)的前三个通道加同样的量，亮度变化等于增量、色度不变；L和LA只改第一个通道；
+    CMYK的C、M、Y通道反向修改（Pillow换算亮度时R=255-C-K，依此类推）；透明度和K通道不改。
+    """
+    levels = np.arange(-MAX_DELTA, MAX_DELTA + 1, dtype=np.float32)
+    change = np.rint(levels[:, None, None] * PATTERN).astype(np.int16)
+    bands = len(mode)
+    channels = np.zeros(bands, dtype=np.int16)
+    channels[:1 if mode in ('L', 'LA') else 3] = -1 if mode == 'CMYK' else 1
+    change = change[..., None] * channels
+    return np.clip(change, 0, 255).astype(np.uint8), np.clip(-change, 0, 255).astype(np.uint8)
+
+
+def embed_mark(img, text):
+    """把文本嵌入图片，返回新图片；不支持的模式或小于一个块的图片抛出ValueError"""
+    if img.mode not in SUPPORTED_MODES:
+        raise ValueError(f"{img.mode}模式的图片不支持嵌入隐形水印")
+    if img.width < BLOCK or img.height < BLOCK:
+        raise ValueError(f"图片小于{BLOCK}×{BLOCK}像素，无法嵌入隐形水印")
+    blocks_x, blocks_y = img.width // BLOCK, img.height // BLOCK
+    bit_index, flips = block_layout(blocks_y, blocks_x)
+    # 每块期望的差值符号：位为1时为正，再按块翻转
+    signs = (encode_payload(text)[bit_index].astype(np.float32) * 2 - 1) * flips
+    if img.mode in WIDE_MODES:
+        return embed_wide(img, signs)
+
+    # 在图片数据的副本上原地修改，再直接作为新图片的数据（省去NumPy与Pillow之间的两次复制）
+    bands = len(img.mode)
+    buffer = bytearray(img.tobytes())
+    pixels = np.frombuffer(buffer, dtype=np.uint8).reshape(img.height, img.width * bands)
+    increase, decrease = change_tables(img.mode)
+    width = blocks_x * BLOCK
+    for rows, delta in block_deltas(luminance(img), signs):
+        # 修改量取整后作为查找表的序号
+        index = np.clip(np.rint(delta), -MAX_DELTA, MAX_DELTA).astype(np.intp) + MAX_DELTA
+        strip = pixels[rows, :width * bands]
+        # 饱和加法：加上的量不超过到255的余量；饱和减法：减去的量不超过像素值
+        room = np.subtract(255, strip)
+        np.minimum(room, increase[index].transpose(0, 2, 1, 3, 4).reshape(strip.shape), out=room)
+        strip += room
+        np.minimum(strip, decrease[index].transpose(0, 2, 1, 3, 4).reshape(strip.shape), out=room)
+        strip -= room
+    result = Image.frombuffer(img.mode, img.size, buffer, 'raw', img.mode, 0, 1)
+    result.info = img.info.copy()
+    return result
+
+
+def embed_wide(img, signs):
+    """16位灰度图片的嵌入：修改量按8位计算，乘以257后加到16位像素上"""
+    pixels = np.array(img, dtype=np.int32)
+    blocks_y, blocks_x = signs.shape
+    width = blocks_x * BLOCK
+    for rows, delta in block_deltas(pixels[:, :width] / np.float32(WIDE_SCALE), signs):
+        change = np.rint(delta[:, :, None, None] * (PATTERN * WIDE_SCALE))
+        strip = pixels[rows, :width]
+        strip += change.astype(np.int32).transpose(0, 2, 1, 3).reshape(strip.shape)
+        np.clip(strip, 0, 65535, out=strip)
+    result = Image.fromarray(pixels.astype(np.uint16) if img.mode == 'I;16' else pixels)
+    result.info = img.info.copy()
+    return result
+
+
+def block_deltas(luma, signs):
+    """逐条带计算每块的系数修改量，产出(条带的行切片, 修改量)；差值已经足够的块修改量为0"""
+    blocks_y, blocks_x = signs.shape
+    for row in range(0, blocks_y, STRIP_BLOCKS):
+        rows = slice(row * BLOCK, min(row + STRIP_BLOCKS, blocks_y) * BLOCK)
+        difference, magnitude = block_difference(luma[rows, :blocks_x * BLOCK].astype(np.float32))
+        strength = np.clip(TEXTURE_GAIN * magnitude, STRENGTH, MAX_STRENGTH)
+        wanted = signs[row:row + STRIP_BLOCKS]
+        yield rows, np.where(wanted * difference < strength, wanted * strength - difference, 0)
+
+
+def extract_mark(img):
+    """从图片中提取隐形水印文本，没有水印（或已被破坏）时返回None"""
+    if img.mode not in SUPPORTED_MODES:
+        img = img.convert('RGB')
+    if img.width < BLOCK or img.height < BLOCK:
+        return None
+    blocks_x, blocks_y = img.width // BLOCK, img.height // BLOCK
+    bit_index, flips = block_layout(blocks_y, blocks_x)
+    luma = luminance(img)
+    votes = np.zeros(PAYLOAD_BITS, dtype=np.float64)
+    for row in range(0, blocks_y, STRIP_BLOCKS):
+        rows = slice(row * BLOCK, min(row + STRIP_BLOCKS, blocks_y) * BLOCK)
+        difference, _ = block_difference(luma[rows, :blocks_x * BLOCK].astype(np.float32))
+        # 按差值加权投票，差值被压缩抹平的块影响小
+        weighted = np.clip(difference, -MAX_STRENGTH, MAX_STRENGTH) * flips[row:row + STRIP_BLOCKS]
+        votes += np.bincount(bit_index[row:row + STRIP_BLOCKS].ravel(), weights=weighted.ravel(),
+                             minlength=PAYLOAD_BITS)
+    return decode_payload(votes > 0)
+
+
+def read_mark(image_path):
+    """读取图片文件中的隐形水印（导出的图片已按方向摆正，直接读取像素）"""
+    with Image.open(image_path) as img:
+        img.load()
+        return extract_mark(img)
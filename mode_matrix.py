@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""各图片模式的水印合成检查：正确性和吞吐量矩阵
+
+正确性部分对每种模式（RGB、RGBA、L、LA、CMYK、I;16、P）和旋转角度（0、30度）检查：
+  - 半透明Logo覆盖处的像素等于按透明度混合的结果，Logo之外的像素不变
+  - 半透明白色文字的亮度不超过透明度（透明度对RGB等不带alpha的模式同样生效）
+  - 快速路径的模式合成后保持原模式，不经过RGBA转换（P等其他模式转换为RGB）
+  - 结果能保存为JPEG和PNG，PNG重新读入后与保存前的像素一致
+吞吐量部分对每种模式测量一张大图上绘制文字水印（右下角和平铺）的时间，取多次测量的中位数。
+
+CI中可以直接运行，有检查不通过时以状态1退出：
+    python mode_matrix.py
+    python mode_matrix.py --megapixels 24 --runs 5
+"""
+
+import io
+import os
+import sys
+import time
+
+# 参与检查的模式，以及合成后应得到的模式
+MODES = {
+    'RGB': 'RGB', 'RGBA': 'RGBA', 'L': 'L', 'LA': 'LA', 'CMYK': 'CMYK', 'I;16': 'I;16', 'P': 'RGB',
+}
+ROTATIONS = (0, 30)
+OUTPUT_FORMATS = ('.jpg', '.png')
+# 检查用的底色、Logo颜色和透明度
+BASE_COLOR = (40, 90, 160)
+LOGO_COLOR = (220, 60, 30)
+ALPHA = 128
+# 混合结果允许的误差（8位取值）；旋转时双三次插值在边缘会略有过冲
+TOLERANCE = 2
+ROTATION_OVERSHOOT = 4
+CHECK_SIZE = (640, 480)
+DEFAULT_MEGAPIXELS = 12
+DEFAULT_RUNS = 3
+
+
+def solid_image(mode, size, color):
+    """指定模式的纯色图片，I;16按8位颜色的亮度乘以257"""
+    from PIL import Image
+
+    if mode == 'I;16':
+        level = Image.new('RGB', (1, 1), color).convert('L').getpixel((0, 0))
+        return Image.new('I;16', size, level * 257)
+    if mode == 'P':
+        # 不抖动，整张图是调色板中同一种颜色
+        return Image.new('RGB', size, color).convert('P', dither=Image.Dither.NONE)
+    if mode == 'LA':
+        return Image.new('RGB', size, color).convert('L').convert('LA')
+    return Image.new('RGB', size, color).convert(mode)
+
+
+def expected_pixel(mode, base, top, alpha):
+    """底色base上按alpha混合颜色top后，在mode下应得到的像素值"""
+    from PIL import Image
+
+    if mode == 'I;16':
+        base_level = solid_image('L', (1, 1), base).getpixel((0, 0)) * 257
+        top_level = solid_image('L', (1, 1), top).getpixel((0, 0)) * 257
+        return (round(base_level + (top_level - base_level) * alpha / 255),)
+    if mode in ('L', 'LA'):
+        # L的混合在灰度上进行
+        base_level = solid_image('L', (1, 1), base).getpixel((0, 0))
+        top_level = solid_image('L', (1, 1), top).getpixel((0, 0))
+        level = round(base_level + (top_level - base_level) * alpha / 255)
+        return (level, 255) if mode == 'LA' else (level,)
+    blended = tuple(round(b + (t - b) * alpha / 255) for b, t in zip(base, top))
+    pixel = Image.new('RGB', (1, 1), blended).convert(MODES[mode])
+    return as_tuple(pixel.getpixel((0, 0)))
+
+
+def as_tuple(pixel):
+    return pixel if isinstance(pixel, tuple) else (pixel,)
+
+
+def close_enough(actual, expected, scale=1):
+    return len(actual) == len(expected) and all(abs(a - e) <= TOLERANCE * scale for a, e in zip(actual, expected))
+
+
+def check_mode(mode, rotation, logo_path, failures):
+    """检查一种模式和旋转角度，返回合成用时（毫秒）"""
+    import watermark_core
+
+    scale = 257 if mode == 'I;16' else 1
+    job = watermark_core.compile_settings({
+        'font_size': 40, 'color': LOGO_COLOR + (ALPHA,), 'position': 'center', 'rotation': rotation,
+        'logo_path': logo_path, 'logo_scale': 0.5,
+    })
+    img = solid_image(mode, CHECK_SIZE, BASE_COLOR)
+    # P模式的底色是调色板中最接近的颜色
+    base = img.convert('RGB').getpixel((0, 0)) if mode == 'P' else BASE_COLOR
+    started = time.perf_counter()
+    result = job.render(img, '')
+    elapsed = (time.perf_counter() - started) * 1000
+    label = f"{mode} 旋转{rotation}度"
+
+    if result.mode != MODES[mode]:
+        failures.append(f"{label}: 合成后模式为{result.mode}，应为{MODES[mode]}")
+        return elapsed
+    center = (CHECK_SIZE[0] // 2, CHECK_SIZE[1] // 2)
+    actual = as_tuple(result.getpixel(center))
+    expected = expected_pixel(mode, base, LOGO_COLOR, ALPHA)
+    if not close_enough(actual, expected, scale):
+        failures.append(f"{label}: Logo处像素为{actual}，应为{expected}")
+    outside = as_tuple(result.getpixel((2, 2)))
+    untouched = as_tuple(solid_image(MODES[mode], (1, 1), base).getpixel((0, 0))) \
+        if mode != 'I;16' else as_tuple(img.getpixel((2, 2)))
+    if outside != untouched:
+        failures.append(f"{label}: Logo之外的像素被改变: {outside}，应为{untouched}")
+
+    text_job = watermark_core.compile_settings({
+        'font_size': 60, 'color': (255, 255, 255, ALPHA), 'position': 'center', 'rotation': rotation,
+    })
+    brightest = max_level(text_job.render(solid_image(mode, CHECK_SIZE, (0, 0, 0)), '水印 Mark'))
+    limit = ALPHA + (ROTATION_OVERSHOOT if rotation else TOLERANCE)
+    if brightest == 0 or brightest > limit:
+        failures.append(f"{label}: 透明度{ALPHA}的白色文字最亮处为{brightest}，应在1~{limit}之间")
+
+    check_save(label, result, failures)
+    return elapsed
+
+
+def max_level(img):
+    """图片最亮处的8位亮度"""
+    import numpy as np
+
+    if img.mode in ('I;16', 'I'):
+        return int(np.asarray(img).max()) // 257
+    return int(np.asarray(img.convert('L')).max())
+
+
+def check_save(label, img, failures):
+    """保存为JPEG和PNG并重新读入"""
+    from PIL import Image
+    import watermark_core
+
+    for extension in OUTPUT_FORMATS:
+        buffer = io.BytesIO()
+        try:
+            watermark_core.save_image(img.copy(), 'out' + extension, target=buffer)
+            buffer.seek(0)
+            saved = Image.open(buffer)
+            saved.load()
+        except Exception as e:
+            failures.append(f"{label}: 保存为{extension}失败: {e}")
+            continue
+        if saved.size != img.size:
+            failures.append(f"{label}: 保存为{extension}后尺寸为{saved.size}")
+        if extension == '.png':
+            # PNG无损，重新读入后应与转换为PNG支持的模式后的像素一致
+            prepared = watermark_core.prepare_for_format(img, 'PNG')
+            point = (img.width // 2, img.height // 2)
+            if as_tuple(saved.getpixel(point)) != as_tuple(prepared.getpixel(point)):
+                failures.append(f"{label}: PNG重新读入后像素为{saved.getpixel(point)}，"
+                                f"应为{prepared.getpixel(point)}")
+
+
+def measure_throughput(megapixels, runs):
+    """每种模式在大图上绘制文字水印的用时，返回[(模式, 位置, 毫秒)]"""
+    from statistics import median
+    import watermark_core
+
+    width = int((megapixels * 1e6 * 3 / 2) ** 0.5)
+    size = (width, int(width * 2 / 3))
+    results = []
+    for position in ('bottom_right', 'tile'):
+        job = watermark_core.compile_settings({
+            'font_size': 30, 'relative_size': True, 'color': (255, 255, 255, ALPHA), 'position': position,
+        })
+        for mode in MODES:
+            source = solid_image(mode, size, BASE_COLOR)
+            times = []
+            # 第一次绘制时生成字形和平铺条带的缓存，不计入结果
+            for run in range(runs + 1):
+                img = source.copy()
+                started = time.perf_counter()
+                job.render(img, '© 2026 水印 Mark')
+                if run:
+                    times.append((time.perf_counter() - started) * 1000)
+            results.append((mode, position, median(times)))
+    return results, size
+
+
+def main():
+    import argparse
+    import tempfile
+    from PIL import Image
+
+    parser = argparse.ArgumentParser(description='检查各图片模式的水印合成结果并测量吞吐量')
+    parser.add_argument('--megapixels', type=float, default=DEFAULT_MEGAPIXELS,
+                        help=f'吞吐量测量使用的图片像素数（百万，默认：{DEFAULT_MEGAPIXELS}），0为不测量')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help=f'吞吐量测量次数，取中位数（默认：{DEFAULT_RUNS}）')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        logo_path = os.path.join(temp_dir, 'logo.png')
+        Image.new('RGBA', (200, 100), LOGO_COLOR + (255,)).save(logo_path)
+        print("正确性检查:")
+        for mode in MODES:
+            for rotation in ROTATIONS:
+                before = len(failures)
+                elapsed = check_mode(mode, rotation, logo_path, failures)
+                status = '通过' if len(failures) == before else '失败'
+                print(f"  {mode:5} 旋转{rotation:2}度  {status}  （合成{elapsed:.1f}ms）")
+
+    if args.megapixels > 0:
+        results, size = measure_throughput(args.megapixels, max(1, args.runs))
+        print(f"吞吐量（{size[0]}x{size[1]}，{max(1, args.runs)}次中位数）:")
+        for mode, position, milliseconds in results:
+            print(f"  {mode:5} {position:12} {milliseconds:8.1f}ms  {1000 / max(milliseconds, 1e-3):8.0f}张/秒")
+
+    for failure in failures:
+        print(f"检查失败: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""预览与导出一致性检查：原尺寸预览必须与导出结果逐像素相同
+
+在临时目录中生成一组不大于预览区域的原图（缩小图就是原图，预览按1.0的比例绘制），覆盖
+RGB（带EXIF方向）、RGBA、L、CMYK、16位灰度和调色板；对手动位置、旋转、平铺、相对大小、Logo、
+拍摄日期、自动位置几种布局，按界面中的方式设置主窗口的各个控件，取出update_preview绘制的图片，
+再用同一份设置（compile_job）经Pillow引擎导出PNG，两者转换为PNG支持的模式后必须逐像素相同。
+没有PyQt5或指定--no-gui时，按预览的方式（decode_proxy后以缩小比例调用CompiledWatermark.render）绘制。
+
+--golden DIR把导出结果与DIR中保存的参考图片逐像素比较，--update改为把本次的导出结果写入DIR
+（参考图片与字体有关，应在同一环境中生成和比较）。任何比较不一致时以状态1退出：
+    python preview_golden.py
+    python preview_golden.py --golden golden --update
+    python preview_golden.py --golden golden
+"""
+
+import os
+import sys
+
+SOURCE_SIZE = (640, 480)
+# 预览区域需要容纳原图，缩小图才会是原图本身
+WINDOW_SIZE = (1600, 1100)
+# 布局：名称 -> (界面格式的模板设置, 手动拖拽的位置)，Logo路径在运行时填入
+LAYOUTS = {
+    'manual': ({'text': '手动 Manual', 'font_size': '40', 'position': 8, 'color': '#FFFFFF', 'opacity': '70%'},
+               (0.3, 0.6)),
+    'rotated': ({'text': '旋转 Rotated', 'font_size': '50', 'position': 4, 'color': '#FF0000', 'opacity': '50%',
+                 'rotation': 35}, None),
+    'tile': ({'text': '© 平铺', 'font_size': '25', 'position': 9, 'color': '#000000', 'opacity': '40%',
+              'rotation': -30}, None),
+    'relative': ({'text': '相对大小', 'font_size': '60', 'position': 7, 'color': '#FFFF00', 'opacity': '90%',
+                  'relative_size': True}, None),
+    'logo': ({'position': 2, 'opacity': '80%', 'logo_scale': '25%', 'rotation': 15}, None),
+    'date': ({'use_date': True, 'font_size': '35', 'position': 6, 'color': '#00FFFF', 'opacity': '100%'}, None),
+    'auto': ({'text': '自动 Auto', 'font_size': '45', 'position': 10, 'color': '#FFFFFF', 'opacity': '80%'}, None),
+}
+
+
+def make_sources(directory):
+    """生成各种模式的原图，返回路径列表"""
+    import numpy as np
+    from PIL import Image
+
+    width, height = SOURCE_SIZE
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    # 左上暗、右下亮，自动位置有明确的选择
+    channels = np.broadcast_arrays(x * 200 + y * 40, y * 180 + 30, (1 - x) * 150 + 50)
+    pixels = np.stack(channels, axis=-1) + rng.normal(0, 6, (height, width, 3))
+    rgb = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    exif.get_ifd(0x8769)[0x9003] = '2024:05:06 07:08:09'
+    sources = {
+        'rgb_rotated.jpg': lambda path: rgb.save(path, quality=95, exif=exif.tobytes()),
+        'rgba.png': lambda path: rgb.convert('RGBA').save(path),
+        'gray.png': lambda path: rgb.convert('L').save(path),
+        'cmyk.jpg': lambda path: rgb.convert('CMYK').save(path, quality=95),
+        'gray16.png': lambda path: Image.fromarray(np.asarray(rgb.convert('L'), dtype=np.uint16) * 257).save(path),
+        'palette.png': lambda path: rgb.convert('P').save(path),
+    }
+    paths = []
+    for name, save in sources.items():
+        path = os.path.join(directory, name)
+        save(path)
+        paths.append(path)
+    return paths
+
+
+class GuiPreview:
+    """用主窗口绘制预览：按界面中的方式设置控件，取出update_preview交给显示的图片"""
+
+    def __init__(self):
+        from PyQt5.QtWidgets import QApplication
+        import watermark_app
+
+        self.app = QApplication.instance() or QApplication(sys.argv[:1])
+        self.window = watermark_app.WatermarkApp()
+        self.window.resize(*WINDOW_SIZE)
+        self.window.show()
+        self.app.processEvents()
+        self.captured = []
+        show = self.window.pil_to_pixmap
+        self.window.pil_to_pixmap = lambda img: self.captured.append(img.copy()) or show(img)
+
+    def apply(self, template, watermark_pos):
+        """与加载模板相同地设置控件，返回导出使用的编译好的设置"""
+        window = self.window
+        window.watermark_text.setText(template.get('text', ''))
+        window.use_date_checkbox.setChecked(template.get('use_date', False))
+        window.font_size.setCurrentText(template.get('font_size', '30'))
+        window.position.setCurrentIndex(template['position'])
+        window.color.setText(template.get('color', '#FFFFFF'))
+        window.opacity.setCurrentText(template['opacity'])
+        window.rotate_slider.setValue(template.get('rotation', 0))
+        window.relative_size_checkbox.setChecked(template.get('relative_size', False))
+        window.logo_path.setText(template.get('logo', ''))
+        window.logo_scale.setCurrentText(template.get('logo_scale', '20%'))
+        window.watermark_pos = watermark_pos
+        return window.compile_job()
+
+    def render(self, image_path):
+        """返回(预览图片, 缩小图相对原图的比例)"""
+        window = self.window
+        window.image_paths = [image_path]
+        window.current_image_index = 0
+        self.captured.clear()
+        window.update_preview()
+        if not self.captured:
+            raise RuntimeError("update_preview没有绘制预览")
+        return self.captured[-1], window.proxy_scale(window.load_proxy(image_path))
+
+
+class CorePreview:
+    """没有图形界面时按预览的方式绘制：decode_proxy得到的缩小图上以缩小比例调用render"""
+
+    def apply(self, template, watermark_pos):
+        import watermark_core
+        self.job = watermark_core.compile_settings(watermark_core.template_settings(template), watermark_pos)
+        return self.job
+
+    def render(self, image_path):
+        import watermark_core
+        self.proxy = watermark_core.decode_proxy(image_path, max(WINDOW_SIZE))
+        scale = min(self.proxy.image.size) / min(self.proxy.size)
+        text = self.job.text_for(image_path, self.proxy.exif)
+        return self.job.render(self.proxy.image.copy(), text, scale), scale
+
+
+def compare(label, expected, actual, failures):
+    """逐像素比较两张图片，不一致时记录失败"""
+    import numpy as np
+
+    if (expected.size, expected.mode) != (actual.size, actual.mode):
+        failures.append(f"{label}: 尺寸或模式不同 {expected.size} {expected.mode} / {actual.size} {actual.mode}")
+        return
+    expected_pixels, actual_pixels = np.asarray(expected), np.asarray(actual)
+    if not np.array_equal(expected_pixels, actual_pixels):
+        different = expected_pixels != actual_pixels
+        if different.ndim == 3:
+            different = different.any(axis=-1)
+        failures.append(f"{label}: {int(different.sum())}个像素不同")
+
+
+def main():
+    import argparse
+    import tempfile
+    from PIL import Image
+
+    parser = argparse.ArgumentParser(description='检查原尺寸预览与导出结果逐像素相同')
+    parser.add_argument('--golden', help='参考图片文件夹：导出结果与其中的图片逐像素比较')
+    parser.add_argument('--update', action='store_true', help='把本次的导出结果写入--golden指定的文件夹')
+    parser.add_argument('--no-gui', action='store_true', help='不创建主窗口，按预览的方式直接调用绘制函数')
+    args = parser.parse_args()
+    if args.update and not args.golden:
+        parser.error("--update需要同时指定--golden")
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # 使用独立的配置目录，主窗口不读取本机的上次设置
+        os.environ['PHOTO_WATERMARK_CONFIG_DIR'] = os.path.join(temp_dir, 'config')
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        import watermark_core
+        from backends import PillowBackend
+
+        preview = None
+        if not args.no_gui:
+            try:
+                preview = GuiPreview()
+            except ImportError as e:
+                print(f"无法创建主窗口（{e}），改为直接调用绘制函数")
+        preview = preview or CorePreview()
+        backend = PillowBackend()
+        sources = make_sources(temp_dir)
+        logo_path = os.path.join(temp_dir, 'logo.png')
+        logo = Image.new('RGBA', (200, 100), (0, 0, 0, 0))
+        logo.paste((220, 40, 40, 255), (10, 10, 190, 90))
+        logo.save(logo_path)
+        if args.golden:
+            os.makedirs(args.golden, exist_ok=True)
+
+        for layout_name, (template, watermark_pos) in LAYOUTS.items():
+            if layout_name == 'logo':
+                template = dict(template, logo=logo_path)
+            job = preview.apply(template, watermark_pos)
+            checked = len(failures)
+            for source_path in sources:
+                source_name = os.path.splitext(os.path.basename(source_path))[0]
+                label = f"{layout_name} {source_name}"
+                output_path = os.path.join(temp_dir, f"{layout_name}_{source_name}.png")
+                if not backend.export(source_path, output_path, job):
+                    failures.append(f"{label}: 导出失败")
+                    continue
+                with Image.open(output_path) as exported:
+                    exported.load()
+                preview_img, scale = preview.render(source_path)
+                if scale != 1.0:
+                    failures.append(f"{label}: 预览不是原尺寸（比例{scale:.3f}），预览区域太小")
+                    continue
+                compare(f"{label} 预览/导出", exported, watermark_core.prepare_for_format(preview_img, 'PNG'),
+                        failures)
+
+                if args.golden:
+                    golden_path = os.path.join(args.golden, os.path.basename(output_path))
+                    if args.update:
+                        exported.save(golden_path)
+                    elif not os.path.exists(golden_path):
+                        failures.append(f"{label}: 没有参考图片{golden_path}")
+                    else:
+                        with Image.open(golden_path) as golden:
+                            golden.load()
+                        compare(f"{label} 参考/导出", golden, exported, failures)
+            status = '通过' if len(failures) == checked else '失败'
+            print(f"{layout_name:9} {len(sources)}张原图  {status}")
+
+    for failure in failures:
+        print(f"检查失败: {failure}")
+    if args.update and not failures:
+        print(f"参考图片已写入 {args.golden}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""图片扫描的基准测试：FolderScanner与原来的os.walk按扩展名筛选的对比
+
+在临时目录中生成一棵合成的目录树（默认6层、每个目录4个子目录，共5461个目录），每个目录中放入
+真实的JPEG和PNG、扩展名写错的图片，以及扩展名是图片但内容不是的文件（文本、空文件、
+macOS的._元数据文件），再加上其他扩展名的文件。然后分别测量：
+  - os.walk后按扩展名筛选（原来的做法，不读取文件头）
+  - FolderScanner在不同线程数下的总用时，以及产出第一张图片的用时
+FolderScanner找到的图片必须正好是内容为图片的文件（包括扩展名写错的），其他文件都应被排除。
+也可以用--dir测量已有的文件夹（只报告用时和数量，不检查结果）。
+
+结果不正确时以状态1退出：
+    python scan_benchmark.py
+    python scan_benchmark.py --depth 4 --fanout 8 --workers 1 8 32
+    python scan_benchmark.py --dir ~/Pictures
+"""
+
+import io
+import os
+import sys
+import time
+
+DEFAULT_DEPTH = 6
+DEFAULT_FANOUT = 4
+DEFAULT_WORKERS = (1, 4, 8, 16)
+
+
+def sample_files():
+    """每个目录中放入的文件：[(文件名, 内容, 是否是图片)]"""
+    from PIL import Image
+
+    def encode(format):
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), (90, 120, 160)).save(buffer, format)
+        return buffer.getvalue()
+
+    jpeg, png = encode('JPEG'), encode('PNG')
+    return [
+        ('photo.jpg', jpeg, True),
+        ('scan.png', png, True),
+        # 扩展名写错的图片按实际格式识别
+        ('misnamed.png', jpeg, True),
+        ('fake.jpg', b'this is not an image\n', False),
+        ('empty.png', b'', False),
+        ('._photo.jpg', b'\x00\x05\x16\x07\x00\x02\x00\x00Mac OS X', False),
+        ('notes.txt', b'notes\n', False),
+    ]
+
+
+def generate(root, depth, fanout):
+    """生成目录树，返回(目录数, 文件数, 内容为图片的文件路径集合)"""
+    samples = sample_files()
+    images = set()
+    directories = 0
+    level = [root]
+    for current_depth in range(depth + 1):
+        next_level = []
+        for directory in level:
+            directories += 1
+            for name, data, is_image in samples:
+                path = os.path.join(directory, name)
+                with open(path, 'wb') as f:
+                    f.write(data)
+                if is_image:
+                    images.add(path)
+            if current_depth < depth:
+                for i in range(fanout):
+                    subdir = os.path.join(directory, f"d{i}")
+                    os.mkdir(subdir)
+                    next_level.append(subdir)
+        level = next_level
+    return directories, directories * len(samples), images
+
+
+def walk_by_extension(root):
+    """原来的做法：os.walk遍历，按扩展名筛选"""
+    from watermark_core import SUPPORTED_FORMATS
+
+    files = []
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            if os.path.splitext(filename)[1].lower() in SUPPORTED_FORMATS:
+                files.append(os.path.join(directory, filename))
+    return files
+
+
+def scan(root, workers):
+    """用FolderScanner扫描，返回(图片路径集合, 排除的文件数, 总秒数, 第一张图片的秒数)"""
+    from scanner import FolderScanner
+
+    scanner = FolderScanner(workers=workers)
+    found = set()
+    first = None
+    started = time.perf_counter()
+    for image in scanner.scan([root]):
+        if first is None:
+            first = time.perf_counter() - started
+        found.add(image.path)
+    return found, len(scanner.rejected), time.perf_counter() - started, first
+
+
+def main():
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='对比FolderScanner与os.walk按扩展名筛选的扫描速度')
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH, help=f'目录树的层数（默认：{DEFAULT_DEPTH}）')
+    parser.add_argument('--fanout', type=int, default=DEFAULT_FANOUT, help=f'每个目录的子目录数（默认：{DEFAULT_FANOUT}）')
+    parser.add_argument('--workers', type=int, nargs='+', default=DEFAULT_WORKERS,
+                        help=f"测量的线程数（默认：{' '.join(map(str, DEFAULT_WORKERS))}）")
+    parser.add_argument('--dir', help='改为测量该文件夹，不生成目录树')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if args.dir:
+            root, expected = args.dir, None
+            print(f"扫描 {root}")
+        else:
+            root = temp_dir
+            directories, files, expected = generate(root, max(0, args.depth), max(1, args.fanout))
+            print(f"{directories}个目录，{files}个文件，其中{len(expected)}个内容是图片，CPU核数{os.cpu_count()}")
+        # 先遍历一遍，各方法都在缓存中读取目录
+        walk_by_extension(root)
+
+        started = time.perf_counter()
+        walked = walk_by_extension(root)
+        walk_seconds = time.perf_counter() - started
+        print(f"  os.walk按扩展名:  {walk_seconds:7.3f}秒  接受{len(walked)}个文件（不读取文件头）")
+
+        failed = False
+        for workers in args.workers:
+            found, rejected, seconds, first = scan(root, workers)
+            first_text = '没有图片' if first is None else f"{first * 1000:.1f}ms"
+            print(f"  FolderScanner {workers:2}线程: {seconds:7.3f}秒  找到{len(found)}张图片，排除{rejected}个文件，"
+                  f"第一张图片{first_text}")
+            if expected is not None and found != expected:
+                missing, extra = expected - found, found - expected
+                for path in sorted(missing)[:5]:
+                    print(f"结果不正确: 没有找到图片 {path}")
+                for path in sorted(extra)[:5]:
+                    print(f"结果不正确: 不是图片但被接受 {path}")
+                print(f"{workers}线程: 漏掉{len(missing)}张图片，多接受{len(extra)}个文件")
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
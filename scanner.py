@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""图片文件扫描：并行遍历子目录，按文件头识别图片
+
+每个目录用os.scandir读取一次（文件类型来自目录项，不必再对每个文件stat），
+子目录交给线程池并行读取，在网络文件系统和很深的目录树上同时保持多个请求。
+文件名先按包含/排除的通配符筛选，再读取文件开头的几个字节按格式签名确认是图片：
+扩展名写错的图片按实际格式识别，改了扩展名的其他文件和空文件、损坏的文件在导入时就被排除，
+不会到处理时才失败。结果在找到时逐个产出（不等整棵树扫描完），调用方需要顺序时自行排序。
+"""
+
+import os
+import re
+import fnmatch
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from watermark_core import SUPPORTED_FORMATS
+
+# 文件开头的签名和对应的格式（只包含Pillow能处理且SUPPORTED_FORMATS中列出的格式）
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'BM', 'BMP'),
+    (b'II*\x00', 'TIFF'),
+    (b'MM\x00*', 'TIFF'),
+]
+# 识别格式时读取的字节数
+HEADER_SIZE = 16
+# 默认只考虑支持的扩展名，其他文件不读取文件头
+DEFAULT_INCLUDE = tuple(f"*{ext}" for ext in SUPPORTED_FORMATS)
+DEFAULT_SCAN_WORKERS = 8
+
+# path为文件路径，root为所在的扫描起点，format为按文件头识别的格式，depth为相对起点的目录层数
+ScannedImage = namedtuple('ScannedImage', 'path root format depth')
+
+
+def sniff_format(path):
+    """读取文件开头，返回识别出的图片格式；不是支持的图片或无法读取时返回None"""
+    # 直接使用os.open/os.read，比open()少了缓冲和文本层，大量小文件时快得多
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    except OSError:
+        return None
+    try:
+        header = os.read(fd, HEADER_SIZE)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    return None
+
+
+def compile_patterns(patterns):
+    """把通配符列表编译为一个不区分大小写的正则表达式，没有通配符时返回None"""
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns), re.IGNORECASE)
+
+
+def matches(name, relative_path, pattern):
+    """文件名或相对路径匹配编译后的通配符"""
+    return pattern is not None and bool(pattern.match(name) or pattern.match(relative_path))
+
+
+class FolderScanner:
+    """按通配符和深度筛选、按文件头识别图片的并行目录扫描
+
+    include/exclude是通配符列表，与文件名或相对于扫描起点的路径（/分隔）比较，不区分大小写；
+    exclude同样作用于目录，被排除的目录不再进入。max_depth为0时只扫描起点目录本身，None表示不限制。
+    skip_dirs中的目录（如位于输入目录下的输出目录）不扫描。
+    """
+
+    def __init__(self, include=None, exclude=None, max_depth=None, workers=DEFAULT_SCAN_WORKERS,
+                 skip_dirs=()):
+        self.include = compile_patterns(include or DEFAULT_INCLUDE)
+        self.exclude = compile_patterns(exclude)
+        self.max_depth = max_depth
+        self.workers = max(1, workers)
+        self.skip_dirs = {os.path.abspath(path) for path in skip_dirs}
+        # 扩展名或通配符匹配、但文件头不是支持的图片的文件：[(路径, 原因)]
+        self.rejected = []
+
+    def check_file(self, path, name, relative_path):
+        """通配符筛选后读取文件头，返回格式；不是图片时记录原因并返回None"""
+        if not matches(name, relative_path, self.include) or matches(name, relative_path, self.exclude):
+            return None
+        image_format = sniff_format(path)
+        if image_format is None:
+            self.rejected.append((path, "文件头不是支持的图片格式"))
+        return image_format
+
+    def scan_dir(self, root, path, depth):
+        """在线程池中调用：读取一个目录，返回(找到的图片, 需要继续扫描的子目录)"""
+        images, subdirs = [], []
+        try:
+            entries = list(os.scandir(path))
+        except OSError as e:
+            self.rejected.append((path, f"无法读取目录: {e}"))
+            return images, subdirs
+        prefix = '' if depth == 0 else os.path.relpath(path, root).replace(os.sep, '/') + '/'
+        descend = self.max_depth is None or depth < self.max_depth
+        for entry in entries:
+            relative_path = prefix + entry.name
+            try:
+                # 不跟随指向目录的符号链接，避免循环
+                if entry.is_dir(follow_symlinks=False):
+                    if descend and os.path.abspath(entry.path) not in self.skip_dirs \
+                            and not matches(entry.name, relative_path, self.exclude):
+                        subdirs.append(entry.path)
+                    continue
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            image_format = self.check_file(entry.path, entry.name, relative_path)
+            if image_format:
+                images.append(ScannedImage(entry.path, root, image_format, depth))
+        return images, subdirs
+
+    def scan(self, paths):
+        """逐个产出paths中的图片（ScannedImage）：目录按设置扫描，直接给出的文件只识别文件头"""
+        with ThreadPoolExecutor(self.workers) as pool:
+            pending = {}
+            for path in paths:
+                if os.path.isdir(path):
+                    pending[pool.submit(self.scan_dir, path, path, 0)] = (path, 0)
+                else:
+                    image_format = sniff_format(path)
+                    if image_format:
+                        yield ScannedImage(path, os.path.dirname(path), image_format, 0)
+                    else:
+                        self.rejected.append((path, "文件头不是支持的图片格式"))
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    root, depth = pending.pop(future)
+                    images, subdirs = future.result()
+                    for subdir in subdirs:
+                        pending[pool.submit(self.scan_dir, root, subdir, depth + 1)] = (root, depth + 1)
+                    yield from images
+
+
+def scan_images(paths, **options):
+    """扫描paths，返回按路径排序的图片路径列表（options见FolderScanner）"""
+    return sorted(image.path for image in FolderScanner(**options).scan(paths))
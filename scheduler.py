@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""批量导出的调度器：按图片大小排序并限制同时解码占用的内存
+
+开始前只读取每张图片的文件头得到尺寸和模式，估算解码后占用的内存。
+任务按估算大小从大到小分配给工作线程（大图先开始，避免最后只剩一张大图在处理），
+同时处理的任务估算内存之和不超过内存预算，几张超大图片不会同时解码。
+"""
+
+import os
+import time
+import queue
+import threading
+from collections import namedtuple
+
+from PIL import Image
+
+# path为图片路径，pixels为像素数，memory为估算的处理时峰值内存（字节）
+ExportTask = namedtuple('ExportTask', 'path pixels memory')
+
+# 处理一张图片时内存约为解码后图片的倍数（原图、加水印/转换格式后的副本）
+MEMORY_FACTOR = 2
+# 文件头无法读取时的估算值
+UNKNOWN_PIXELS = 12 * 1000 * 1000
+
+MEMORY_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def bytes_per_pixel(mode):
+    """Pillow解码后每个像素占用的字节数（多通道图片按每像素4字节存储）"""
+    if mode in ('1', 'L', 'P'):
+        return 1
+    if mode.startswith('I;16'):
+        return 2
+    return 4
+
+
+def estimate_task(image_path):
+    """只读取文件头，估算一张图片的处理代价"""
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+            pixel_bytes = bytes_per_pixel(img.mode)
+    except Exception:
+        return ExportTask(image_path, UNKNOWN_PIXELS, UNKNOWN_PIXELS * 4 * MEMORY_FACTOR)
+    pixels = width * height
+    return ExportTask(image_path, pixels, pixels * pixel_bytes * MEMORY_FACTOR)
+
+
+def parse_memory_size(value):
+    """解析"512M"、"2G"或字节数形式的内存大小"""
+    value = str(value).strip().upper().rstrip('B')
+    if value and value[-1] in MEMORY_UNITS:
+        return int(float(value[:-1]) * MEMORY_UNITS[value[-1]])
+    return int(value)
+
+
+def default_memory_budget():
+    """默认的内存预算：物理内存的一半，无法获取时不限制"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class ExportScheduler:
+    """按图片大小和内存预算把导出任务分配给工作线程
+
+    Pillow在解码、缩放和编码时会释放GIL，因此使用线程即可并行处理。
+    """
+
+    def __init__(self, workers=None, max_memory=None):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        # None表示不限制内存
+        self.max_memory = max_memory
+        self.reset()
+
+    def reset(self):
+        self.pending = []
+        self.memory_in_use = 0
+        self.peak_memory = 0
+        self.busy_seconds = [0.0] * self.workers
+        self.task_counts = [0] * self.workers
+        self.elapsed = 0.0
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.results = queue.Queue()
+
+    def next_task(self):
+        """取出能放进内存预算的最大任务；没有正在运行的任务时，超出预算的任务也会单独运行"""
+        for index, task in enumerate(self.pending):
+            if (self.max_memory is None or self.memory_in_use == 0
+                    or self.memory_in_use + task.memory <= self.max_memory):
+                del self.pending[index]
+                self.memory_in_use += task.memory
+                self.peak_memory = max(self.peak_memory, self.memory_in_use)
+                return task
+        return None
+
+    def worker_loop(self, index, process):
+        while True:
+            with self.condition:
+                task = None
+                while not self.stopped and self.pending:
+                    task = self.next_task()
+                    if task is not None:
+                        break
+                    self.condition.wait()
+                if task is None:
+                    return
+            started = time.monotonic()
+            try:
+                result = process(task.path)
+            except Exception as e:
+                print(f"处理图片{task.path}时出错: {e}")
+                result = False
+            self.busy_seconds[index] += time.monotonic() - started
+            self.task_counts[index] += 1
+            with self.condition:
+                self.memory_in_use -= task.memory
+                self.condition.notify_all()
+            self.results.put((task.path, result))
+
+    def run(self, image_paths, process, on_result=None, should_stop=None):
+        """处理所有图片，返回{路径: process的返回值}
+
+        process(path)在工作线程中调用；on_result(path, result, 完成数量)和should_stop()
+        在调用run的线程中调用（界面可以在其中更新进度、处理事件），should_stop返回True时不再开始新任务。
+        """
+        self.reset()
+        started = time.monotonic()
+        tasks = [estimate_task(path) for path in image_paths]
+        # 大图先处理
+        self.pending = sorted(tasks, key=lambda task: task.pixels, reverse=True)
+
+        threads = []
+        for index in range(min(self.workers, len(tasks))):
+            thread = threading.Thread(target=self.worker_loop, args=(index, process), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        results = {}
+        while len(results) < len(tasks):
+            try:
+                path, result = self.results.get(timeout=0.1)
+            except queue.Empty:
+                path = None
+            if path is not None:
+                results[path] = result
+                if on_result:
+                    on_result(path, result, len(results))
+            if should_stop and not self.stopped and should_stop():
+                with self.condition:
+                    self.stopped = True
+                    self.pending = []
+                    self.condition.notify_all()
+            if not any(thread.is_alive() for thread in threads) and self.results.empty():
+                break
+
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.monotonic() - started
+        return results
+
+    def report(self):
+        """返回每个工作线程的利用率等统计信息"""
+        elapsed = self.elapsed or 1e-9
+        return {
+            'elapsed': self.elapsed,
+            'peak_memory': self.peak_memory,
+            'worker_tasks': list(self.task_counts),
+            'worker_utilization': [busy / elapsed for busy in self.busy_seconds],
+        }
+
+    def format_report(self):
+        report = self.report()
+        utilization = ' '.join(f"{value:.0%}" for value in report['worker_utilization'])
+        return (f"用时 {report['elapsed']:.1f}秒，{self.workers} 个线程，"
+                f"估算内存峰值 {report['peak_memory'] / 1024 ** 2:.0f}MB，"
+                f"线程利用率 {utilization}")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""图形界面启动性能测量：到第一次绘制窗口的时间、此时的内存占用和导入耗时排行
+
+每次测量都启动一个新的Python进程（导入缓存不会在多次测量之间共享），
+从启动子进程开始计时，到主窗口收到第一次绘制事件为止，取多次测量的中位数。
+另外用python -X importtime运行一次，列出累计耗时最多的模块。
+使用独立的临时配置目录，结果不受本机模板和上次设置的影响。
+
+CI中可以在无显示环境下运行（未设置QT_QPA_PLATFORM时使用offscreen），超过目标时以状态1退出：
+    python startup_profile.py
+    python startup_profile.py --target 0.8 --max-rss 100 --runs 9
+"""
+
+import os
+import sys
+import time
+
+# 子进程在第一次绘制时输出的行的前缀
+RESULT_PREFIX = 'FIRST_PAINT'
+# 以子进程方式运行的参数
+CHILD_FLAG = '--child'
+DEFAULT_RUNS = 5
+DEFAULT_TOP_IMPORTS = 15
+# 默认目标：到第一次绘制的秒数和此时的内存MB（均为中位数）
+TARGET_SECONDS = 0.5
+MAX_RSS_MB = 80
+
+
+def current_rss_mb():
+    """当前进程的常驻内存（MB），无法获取时返回None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # 没有/proc时退回到峰值内存（macOS以字节为单位，其他系统以KB为单位）
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def child():
+    """在子进程中运行：按watermark_app的GUI模式启动，第一次绘制主窗口时输出结果并退出"""
+    started = time.perf_counter()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import watermark_app
+    from PyQt5.QtCore import QObject, QEvent
+    from PyQt5.QtWidgets import QApplication
+    imported = time.perf_counter()
+
+    app = QApplication(sys.argv[:1])
+    window = watermark_app.WatermarkApp()
+
+    class FirstPaint(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint:
+                window.removeEventFilter(self)
+                rss = current_rss_mb()
+                print(f"{RESULT_PREFIX} {imported - started:.4f} {time.perf_counter() - started:.4f} "
+                      f"{-1 if rss is None else rss:.1f}", flush=True)
+                app.quit()
+            return False
+
+    first_paint = FirstPaint()
+    window.installEventFilter(first_paint)
+    window.show()
+    app.exec_()
+
+
+def run_child(env, importtime=False):
+    """启动一个子进程测量一次，返回(到第一次绘制的秒数, 导入秒数, 内存MB, importtime输出)"""
+    import subprocess
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [os.path.abspath(__file__), CHILD_FLAG]
+    started = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    first_paint = None
+    for line in process.stdout:
+        if line.startswith(RESULT_PREFIX):
+            first_paint = time.perf_counter() - started
+            _, import_seconds, _, rss = line.split()
+    _, errors = process.communicate()
+    if first_paint is None:
+        raise RuntimeError(f"界面没有完成第一次绘制（退出码{process.returncode}）:\n{errors}")
+    rss = float(rss)
+    return first_paint, float(import_seconds), None if rss < 0 else rss, errors
+
+
+def slowest_imports(importtime_output, count):
+    """解析-X importtime的输出，返回累计耗时最多的顶层导入[(模块, 毫秒)]"""
+    imports = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # 只统计顶层导入和它们直接导入的模块（缩进每层两个空格），更深的模块已计入上层的累计耗时
+        if len(name) - len(name.lstrip()) <= 3:
+            imports.append((name.strip(), int(cumulative) / 1000))
+    return sorted(imports, key=lambda item: -item[1])[:count]
+
+
+def main():
+    # 只在测量进程中使用的模块在这里导入
+    import argparse
+    import tempfile
+    from statistics import median
+
+    parser = argparse.ArgumentParser(description='测量图形界面启动到第一次绘制的时间和内存占用')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help=f'测量次数，取中位数（默认：{DEFAULT_RUNS}）')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP_IMPORTS,
+                        help=f'列出累计导入耗时最多的模块数量，0为不运行-X importtime（默认：{DEFAULT_TOP_IMPORTS}）')
+    parser.add_argument('--target', type=float, default=TARGET_SECONDS,
+                        help=f'到第一次绘制的秒数目标（中位数），0为不检查（默认：{TARGET_SECONDS}）')
+    parser.add_argument('--max-rss', type=float, default=MAX_RSS_MB,
+                        help=f'第一次绘制时的内存上限MB（中位数），0为不检查（默认：{MAX_RSS_MB}）')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        env = dict(os.environ, PHOTO_WATERMARK_CONFIG_DIR=config_dir)
+        env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        # 第一次运行要编译.pyc、读取磁盘上的库，不计入结果
+        run_child(env)
+        runs = [run_child(env) for _ in range(max(1, args.runs))]
+        importtime_output = run_child(env, importtime=True)[3] if args.top > 0 else ''
+
+    first_paint = median(run[0] for run in runs)
+    import_seconds = median(run[1] for run in runs)
+    rss_values = [run[2] for run in runs if run[2] is not None]
+    rss = median(rss_values) if rss_values else None
+    print(f"到第一次绘制: {first_paint:.3f}秒（{len(runs)}次中位数，"
+          f"最快{min(run[0] for run in runs):.3f}秒，最慢{max(run[0] for run in runs):.3f}秒）")
+    print(f"  其中导入watermark_app: {import_seconds:.3f}秒")
+    print(f"第一次绘制时内存: {'无法获取' if rss is None else f'{rss:.1f}MB'}")
+    if importtime_output:
+        print("累计导入耗时最多的模块（-X importtime，单次）:")
+        for name, milliseconds in slowest_imports(importtime_output, args.top):
+            print(f"  {milliseconds:8.1f}ms  {name}")
+
+    failed = False
+    if args.target and first_paint > args.target:
+        print(f"超过目标: 到第一次绘制{first_paint:.3f}秒 > {args.target}秒")
+        failed = True
+    if args.max_rss and rss is not None and rss > args.max_rss:
+        print(f"超过目标: 内存{rss:.1f}MB > {args.max_rss}MB")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    # 子进程不经过argparse，导入统计中只有图形界面本身
+    if sys.argv[1:] == [CHILD_FLAG]:
+        child()
+    else:
+        sys.exit(main())
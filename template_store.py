@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""模板和上次设置的存储
+
+文件保存在用户配置目录中（打包后的.app内部是只读的）。写入时先写临时文件再重命名，
+读-改-写过程持有文件锁，多个CLI或守护进程同时修改模板也不会损坏文件。
+旧版本保存在程序目录下的templates.json/last_settings.json仍会被读取。
+"""
+
+import os
+import sys
+import json
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+APP_NAME = 'PhotoWatermark'
+TEMPLATE_FILE = 'templates.json'
+SETTINGS_FILE = 'last_settings.json'
+
+# 旧版本的配置文件位置（程序所在目录）
+LEGACY_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def user_config_dir():
+    """返回当前用户的配置目录，可用环境变量PHOTO_WATERMARK_CONFIG_DIR覆盖"""
+    override = os.environ.get('PHOTO_WATERMARK_CONFIG_DIR')
+    if override:
+        return override
+    if sys.platform == 'darwin':
+        return os.path.expanduser(f'~/Library/Application Support/{APP_NAME}')
+    if sys.platform.startswith('win'):
+        return os.path.join(os.environ.get('APPDATA', os.path.expanduser('~')), APP_NAME)
+    base = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+    return os.path.join(base, APP_NAME)
+
+
+def atomic_write_json(path, data):
+    """先写入同目录下的临时文件并同步到磁盘，再重命名覆盖目标文件"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path), suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp创建的文件只有所有者可读写，恢复为普通配置文件的权限
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def read_json(filename, config_dir, default):
+    """从配置目录读取JSON，不存在时回退到旧版本的位置"""
+    for directory in (config_dir, LEGACY_DIR):
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    return default
+
+
+@contextmanager
+def file_lock(config_dir):
+    """进程间互斥锁（没有fcntl的平台上只依赖原子重命名）"""
+    os.makedirs(config_dir, exist_ok=True)
+    with open(os.path.join(config_dir, '.lock'), 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class TemplateStore:
+    """按名称索引的模板存储"""
+
+    def __init__(self, config_dir=None):
+        self.config_dir = config_dir or user_config_dir()
+        self.path = os.path.join(self.config_dir, TEMPLATE_FILE)
+        self.index = {}
+        self.reload()
+
+    def reload(self):
+        try:
+            templates = read_json(TEMPLATE_FILE, self.config_dir, [])
+        except Exception as e:
+            print(f"加载模板失败: {e}")
+            templates = []
+        # 名称重复时保留最后一个（旧版本允许重名）
+        self.index = {template['name']: template for template in templates if 'name' in template}
+
+    def names(self):
+        return list(self.index)
+
+    def templates(self):
+        return list(self.index.values())
+
+    def get(self, name):
+        """按名称查找模板，找不到时返回None"""
+        return self.index.get(name)
+
+    def save(self, template):
+        """新增或覆盖同名模板"""
+        with file_lock(self.config_dir):
+            # 在锁内重新读取，保留其他进程刚写入的模板
+            self.reload()
+            self.index[template['name']] = template
+            atomic_write_json(self.path, self.templates())
+
+    def delete(self, name):
+        with file_lock(self.config_dir):
+            self.reload()
+            if self.index.pop(name, None) is not None:
+                atomic_write_json(self.path, self.templates())
+
+
+def load_last_settings(config_dir=None):
+    """读取上次的设置，没有时返回空字典"""
+    try:
+        return read_json(SETTINGS_FILE, config_dir or user_config_dir(), {})
+    except Exception as e:
+        print(f"加载设置失败: {e}")
+        return {}
+
+
+def save_last_settings(settings, config_dir=None):
+    config_dir = config_dir or user_config_dir()
+    with file_lock(config_dir):
+        atomic_write_json(os.path.join(config_dir, SETTINGS_FILE), settings)
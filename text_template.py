@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""水印文本模板：按每张图片的文件信息、序号和EXIF拍摄信息生成水印文本
+
+写法与Python的str.format相同，如"{camera} · {date} · #{index:05d}"，{{和}}表示花括号本身。
+模板在任务开始时编译一次：字段名和格式在这里检查，写错时任务开始前就会报错；
+处理每张图片时只计算模板中用到的字段，只用到文件名和序号的模板不读取EXIF，
+用到拍摄信息的字段在一次遍历中读取（见exif_dates.read_tiff_info）。
+没有的信息（如图片没有EXIF时的相机型号）显示为空。
+"""
+
+import os
+import itertools
+from datetime import datetime
+from functools import lru_cache
+from string import Formatter
+
+from exif_dates import DEFAULT_DATE_FORMAT, read_shooting_info, shooting_info_from_exif
+
+# 可用字段和说明（界面提示和命令行帮助中列出）
+FIELDS = {
+    'index': '图片在本批中的序号（从1开始）',
+    'count': '本批图片的数量',
+    'name': '文件名（不含扩展名）',
+    'ext': '扩展名（不含点）',
+    'folder': '所在文件夹的名称',
+    'date': '拍摄时间（没有EXIF日期时为修改时间），默认按日期格式，也可写{date:%Y年%m月}',
+    'camera': '相机（厂商和型号，型号中已有厂商名时只用型号）',
+    'make': '相机厂商',
+    'model': '相机型号',
+    'lens': '镜头型号',
+    'artist': '作者',
+    'copyright': '版权',
+    'iso': 'ISO感光度（整数）',
+    'exposure': '快门速度，如1/250s',
+    'aperture': '光圈，如f/2.8',
+    'focal': '焦距，如35mm',
+}
+FILE_FIELDS = frozenset({'name', 'ext', 'folder'})
+SEQUENCE_FIELDS = frozenset({'index', 'count'})
+METADATA_FIELDS = frozenset(FIELDS) - FILE_FIELDS - SEQUENCE_FIELDS
+
+# 编译时用来检查格式的示例值（类型与实际值相同）
+SAMPLE_VALUES = dict({field: '' for field in FIELDS}, index=1, count=1, iso=100, date=datetime(2000, 1, 1))
+
+# 预览反复绘制同一张图片时，按缩小图缓存中的同一份EXIF取得已解析的拍摄信息（与缩小图缓存数量相同）
+INFO_CACHE_SIZE = 64
+
+
+@lru_cache(maxsize=INFO_CACHE_SIZE)
+def exif_info(exif):
+    """解析原始EXIF中的拍摄信息（ShootingInfo）"""
+    return shooting_info_from_exif(exif)
+
+
+def format_exposure(value):
+    numerator, denominator = value
+    seconds = numerator / denominator
+    if seconds >= 1 or not numerator:
+        return f"{seconds:g}s"
+    return f"1/{round(denominator / numerator)}s"
+
+
+def camera_name(make, model):
+    """厂商加型号；型号已经以厂商名开头时（如Canon EOS R5）只用型号"""
+    if not make:
+        return model
+    if not model:
+        return make
+    if model.lower().startswith(make.split()[0].lower()):
+        return model
+    return f"{make} {model}"
+
+
+# 拍摄信息字段的取值，信息中没有时为None
+METADATA_GETTERS = {
+    'camera': lambda info: camera_name(info.make, info.model),
+    'make': lambda info: info.make,
+    'model': lambda info: info.model,
+    'lens': lambda info: info.lens,
+    'artist': lambda info: info.artist,
+    'copyright': lambda info: info.copyright,
+    'iso': lambda info: info.iso,
+    'exposure': lambda info: info.exposure_time and format_exposure(info.exposure_time),
+    'aperture': lambda info: info.f_number and f"f/{round(info.f_number[0] / info.f_number[1], 1):g}",
+    'focal': lambda info: info.focal_length and f"{round(info.focal_length[0] / info.focal_length[1], 1):g}mm",
+}
+
+
+class Numbering:
+    """批量任务中各图片的序号，任务中各线程共用
+
+    序号按任务开始时给出的图片顺序确定，与并行处理的完成顺序无关；
+    没有预先给出的图片（如监视模式中新到达的图片）按第一次取序号的顺序依次编号。
+    """
+
+    def __init__(self, image_paths=(), start=1, count=None):
+        self.numbers = {}
+        self.total = count
+        self.next_number = itertools.count(start)
+        self.assign(image_paths, start)
+
+    def assign(self, image_paths, start):
+        """给一批图片指定从start开始的序号，之后没有指定的图片接着这批编号"""
+        image_paths = list(image_paths)
+        for number, image_path in enumerate(image_paths, start):
+            self.numbers[image_path] = number
+        if image_paths:
+            self.next_number = itertools.count(start + len(image_paths))
+
+    def reassign(self, image_paths, start):
+        """丢弃之前的序号，只保留这一批（分布式处理时每块图片各自指定，已处理的块不再需要）"""
+        self.numbers.clear()
+        self.assign(image_paths, start)
+
+    def number_for(self, image_path):
+        number = self.numbers.get(image_path)
+        if number is None:
+            number = self.numbers.setdefault(image_path, next(self.next_number))
+        return number
+
+    @property
+    def count(self):
+        # 未指定总数时为已编号的图片数量
+        return self.total if self.total is not None else len(self.numbers)
+
+
+class TextTemplate:
+    """编译好的水印文本模板"""
+
+    def __init__(self, template, date_format=DEFAULT_DATE_FORMAT):
+        self.template = template
+        # [(字面文本, 字段, 格式)]，字段为None表示只有字面文本
+        self.parts = []
+        try:
+            parsed = list(Formatter().parse(template))
+        except ValueError as e:
+            raise ValueError(f"文本模板格式错误: {e}")
+        for literal, field, spec, conversion in parsed:
+            if field is None:
+                self.parts.append((literal, None, None))
+                continue
+            if field not in FIELDS:
+                raise ValueError(f"文本模板中有未知字段{{{field}}}，可用字段: {', '.join(FIELDS)}")
+            if conversion or '{' in spec:
+                raise ValueError(f"文本模板字段{{{field}}}不支持转换和嵌套格式")
+            if field == 'date' and not spec:
+                spec = date_format
+            try:
+                format(SAMPLE_VALUES[field], spec)
+            except ValueError as e:
+                raise ValueError(f"文本模板字段{{{field}}}的格式\"{spec}\"无效: {e}")
+            self.parts.append((literal, field, spec))
+        self.fields = frozenset(field for _, field, _ in self.parts if field)
+
+    def values(self, image_path, numbering, exif=None, mtime=None, source=None):
+        """只计算模板中用到的字段，返回{字段: 值}"""
+        values = {}
+        if self.fields & FILE_FIELDS:
+            name, ext = os.path.splitext(os.path.basename(image_path))
+            values.update(name=name, ext=ext[1:], folder=os.path.basename(os.path.dirname(os.path.abspath(image_path))))
+        if self.fields & SEQUENCE_FIELDS:
+            values.update(index=numbering.number_for(image_path), count=numbering.count)
+        if self.fields & METADATA_FIELDS:
+            info = exif_info(exif) if exif else read_shooting_info(image_path, source)
+            for field in self.fields & METADATA_GETTERS.keys():
+                values[field] = METADATA_GETTERS[field](info)
+            if 'date' in self.fields:
+                values['date'] = info.date or modified_time(image_path, mtime)
+        return values
+
+    def render(self, image_path, numbering, exif=None, mtime=None, source=None):
+        """该图片的水印文本；exif、mtime和source含义同exif_dates.format_capture_date"""
+        values = self.values(image_path, numbering, exif, mtime, source)
+        return ''.join(literal if field is None or values[field] is None else literal + format(values[field], spec)
+                       for literal, field, spec in self.parts)
+
+
+def modified_time(image_path, mtime=None):
+    """没有EXIF日期时使用文件修改时间，文件不可读时使用当前时间"""
+    try:
+        return datetime.fromtimestamp(mtime if mtime is not None else os.path.getmtime(image_path))
+    except (OSError, ValueError, OverflowError) as e:
+        print(f"无法获取图片{image_path}的拍摄日期: {e}")
+        return datetime.now()
+
+
+def compile_template(template, date_format=DEFAULT_DATE_FORMAT):
+    """编译水印文本模板，模板为空时返回None；字段或格式写错时抛出ValueError"""
+    if not template:
+        return None
+    return TextTemplate(template, date_format)
+
+
+def describe_fields():
+    """可用字段的说明，每行一个"""
+    return '\n'.join(f"{{{field}}}  {description}" for field, description in FIELDS.items())
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""监视文件夹守护进程：新图片到达后自动添加水印
+
+Linux下使用inotify监听目录事件，其他平台（或inotify不可用时）退回到定时轮询。
+文件写入完成（大小和修改时间在防抖时间内保持不变）后才会进入处理队列。
+输出先写入临时文件，成功后才改名为输出文件；Ctrl+C和SIGTERM（如systemd停止服务）都会等正在处理的图片
+结束后再退出，不会在输出目录中留下写了一半的图片。
+"""
+
+import os
+import sys
+import time
+import errno
+import queue
+import signal
+import struct
+import threading
+
+from backends import PillowBackend
+from watermark_core import SUPPORTED_FORMATS, rendition_output_name
+
+# inotify事件掩码
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct('iIII')
+
+# 输出写完之前使用的临时文件后缀（与export_job相同）
+PARTIAL_SUFFIX = '.part'
+
+
+class InotifyWatcher:
+    """基于ctypes的inotify封装，只在Linux上可用"""
+
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        libc_name = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1失败")
+        self.watches = {}
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            import ctypes
+            raise OSError(ctypes.get_errno(), f"无法监听目录 {path}")
+        self.watches[wd] = path
+
+    def read_events(self, timeout):
+        """等待事件，返回[(路径, 掩码)]列表"""
+        import select
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            events.append((path, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class WatchDaemon:
+    """监视输入文件夹，把新增或修改过的图片放入队列并按模板添加水印"""
+
+    def __init__(self, input_dirs, output_dir, job, recursive=True,
+                 debounce=2.0, poll_interval=1.0, workers=1, use_inotify=True,
+                 stats_interval=10.0, backend=None, profile=None):
+        self.input_dirs = [os.path.abspath(d) for d in input_dirs]
+        self.output_dir = os.path.abspath(output_dir)
+        # 编译好的水印设置（watermark_core.CompiledWatermark）
+        self.job = job
+        # 导出配置（多尺寸输出），为None时每张图片只输出一个文件
+        self.profile = profile
+        self.backend = backend or PillowBackend()
+        self.recursive = recursive
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.workers = max(1, workers)
+        self.use_inotify = use_inotify
+        self.stats_interval = stats_interval
+
+        # 等待写入完成的文件：路径 -> (大小, 修改时间, 最后一次变化的时间)
+        self.pending = {}
+        # 已经处理过的文件签名：路径 -> (大小, 修改时间)
+        self.processed = {}
+        # 已在队列中或正在处理的文件
+        self.in_flight = set()
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.watcher = None
+        self.threads = []
+
+        # 统计计数器
+        self.started_at = None
+        self.counters = {
+            'queued': 0,
+            'processed': 0,
+            'failed': 0,
+            'bytes_in': 0,
+            'max_queue_depth': 0,
+        }
+        self.busy_seconds = [0.0] * self.workers
+
+    # ---------- 文件发现 ----------
+
+    def is_candidate(self, path):
+        if os.path.splitext(path)[1].lower() not in SUPPORTED_FORMATS:
+            return False
+        if os.path.basename(path).startswith('.'):
+            return False
+        # 输出目录位于输入目录下时，不能再次处理输出结果
+        return not path.startswith(self.output_dir + os.sep)
+
+    def iter_files(self):
+        for input_dir in self.input_dirs:
+            if self.recursive:
+                for root, dirs, filenames in os.walk(input_dir):
+                    dirs[:] = [d for d in dirs if os.path.join(root, d) != self.output_dir]
+                    for filename in filenames:
+                        yield os.path.join(root, filename)
+            else:
+                for entry in os.scandir(input_dir):
+                    if entry.is_file():
+                        yield entry.path
+
+    def setup_watcher(self):
+        if not self.use_inotify or not sys.platform.startswith('linux'):
+            return None
+        try:
+            watcher = InotifyWatcher()
+            for input_dir in self.input_dirs:
+                if self.recursive:
+                    for root, dirs, _ in os.walk(input_dir):
+                        dirs[:] = [d for d in dirs if os.path.join(root, d) != self.output_dir]
+                        watcher.add_watch(root)
+                else:
+                    watcher.add_watch(input_dir)
+            return watcher
+        except (OSError, AttributeError) as e:
+            print(f"inotify不可用，改用轮询: {e}")
+            return None
+
+    def touch(self, path):
+        """记录一次文件变化，重新开始防抖计时"""
+        if not self.is_candidate(path):
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.pending.pop(path, None)
+            return
+        signature = (st.st_size, st.st_mtime)
+        if self.processed.get(path) == signature:
+            return
+        previous = self.pending.get(path)
+        if previous is None or previous[:2] != signature:
+            self.pending[path] = (st.st_size, st.st_mtime, time.monotonic())
+
+    def promote_stable(self):
+        """把在防抖时间内没有变化的文件放入处理队列"""
+        now = time.monotonic()
+        for path, (size, mtime, changed_at) in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            if (st.st_size, st.st_mtime) != (size, mtime):
+                self.pending[path] = (st.st_size, st.st_mtime, now)
+                continue
+            if size == 0 or now - changed_at < self.debounce:
+                continue
+            with self.lock:
+                if path in self.in_flight:
+                    # 正在处理时又被修改，留在等待列表中，处理完成后再次入队
+                    continue
+                self.in_flight.add(path)
+                self.counters['queued'] += 1
+            del self.pending[path]
+            self.queue.put((path, (size, mtime)))
+            depth = self.queue.qsize()
+            with self.lock:
+                self.counters['max_queue_depth'] = max(self.counters['max_queue_depth'], depth)
+
+    # ---------- 处理 ----------
+
+    def get_output_path(self, image_path):
+        for input_dir in self.input_dirs:
+            if image_path.startswith(input_dir + os.sep):
+                relative = os.path.relpath(image_path, input_dir)
+                break
+        else:
+            relative = os.path.basename(image_path)
+        base_name, ext = os.path.splitext(relative)
+        return os.path.join(self.output_dir, f"{base_name}_watermark{ext}")
+
+    def get_outputs(self, image_path):
+        """单一输出路径，或使用导出配置时的[(rendition, 输出路径)]"""
+        output_path = self.get_output_path(image_path)
+        if not self.profile:
+            return output_path
+        base_name = os.path.splitext(output_path)[0]
+        return [(rendition, rendition_output_name(base_name, rendition)) for rendition in self.profile['renditions']]
+
+    def process(self, image_path):
+        """处理一张图片：各输出写入临时文件，全部成功后才改名为输出文件，失败时删除"""
+        outputs = self.get_outputs(image_path)
+        # 输出路径 -> 临时文件
+        targets = {}
+
+        def open_target(output_path):
+            target = targets[output_path] = open(output_path + PARTIAL_SUFFIX, 'wb')
+            return target
+
+        success = False
+        try:
+            os.makedirs(os.path.dirname(self.get_output_path(image_path)), exist_ok=True)
+            try:
+                success = self.backend.export(image_path, outputs, self.job, open_target=open_target)
+            finally:
+                for target in targets.values():
+                    target.close()
+            if success:
+                for output_path in targets:
+                    os.replace(output_path + PARTIAL_SUFFIX, output_path)
+        except OSError as e:
+            print(f"处理图片{image_path}时出错: {e}")
+            success = False
+        if not success:
+            for output_path in targets:
+                try:
+                    os.remove(output_path + PARTIAL_SUFFIX)
+                except OSError:
+                    pass
+        return success
+
+    def worker_loop(self, index):
+        while not self.stop_event.is_set():
+            try:
+                path, signature = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            started = time.monotonic()
+            ok = self.process(path)
+            elapsed = time.monotonic() - started
+            with self.lock:
+                self.busy_seconds[index] += elapsed
+                self.in_flight.discard(path)
+                if ok:
+                    self.counters['processed'] += 1
+                    self.counters['bytes_in'] += signature[0]
+                    self.processed[path] = signature
+                else:
+                    self.counters['failed'] += 1
+            self.queue.task_done()
+
+    # ---------- 统计 ----------
+
+    def stats(self):
+        """返回吞吐量和队列深度等计数器，用于评估需要多少个工作线程"""
+        with self.lock:
+            counters = dict(self.counters)
+            busy = list(self.busy_seconds)
+        uptime = time.monotonic() - self.started_at if self.started_at else 0.0
+        counters['queue_depth'] = self.queue.qsize()
+        counters['pending'] = len(self.pending)
+        counters['uptime'] = uptime
+        counters['images_per_second'] = counters['processed'] / uptime if uptime else 0.0
+        counters['mb_per_second'] = counters['bytes_in'] / uptime / 1e6 if uptime else 0.0
+        counters['worker_utilization'] = [b / uptime if uptime else 0.0 for b in busy]
+        return counters
+
+    def print_stats(self):
+        s = self.stats()
+        utilization = sum(s['worker_utilization']) / len(s['worker_utilization'])
+        print(f"[监视] 已处理 {s['processed']} 失败 {s['failed']} 队列 {s['queue_depth']} "
+              f"(峰值 {s['max_queue_depth']}) 等待写入 {s['pending']} "
+              f"{s['images_per_second']:.2f} 张/秒 {s['mb_per_second']:.2f} MB/秒 "
+              f"线程利用率 {utilization:.0%}", flush=True)
+
+    # ---------- 主循环 ----------
+
+    def run(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.started_at = time.monotonic()
+        self.watcher = self.setup_watcher()
+        mode = 'inotify' if self.watcher else f'轮询（{self.poll_interval}秒）'
+        print(f"开始监视 {', '.join(self.input_dirs)}，模式：{mode}，输出到 {self.output_dir}")
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.worker_loop, args=(i,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+        # 启动时先扫描一遍已有文件
+        for path in self.iter_files():
+            self.touch(path)
+
+        last_poll = last_stats = time.monotonic()
+        previous_handler = self.install_sigterm_handler()
+        try:
+            while not self.stop_event.is_set():
+                if self.watcher:
+                    for path, mask in self.watcher.read_events(min(0.5, self.debounce)):
+                        if mask & IN_ISDIR:
+                            if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                                self.watch_new_dir(path)
+                        else:
+                            self.touch(path)
+                else:
+                    time.sleep(min(0.5, self.poll_interval))
+                    if time.monotonic() - last_poll >= self.poll_interval:
+                        for path in self.iter_files():
+                            self.touch(path)
+                        last_poll = time.monotonic()
+
+                self.promote_stable()
+
+                if self.stats_interval and time.monotonic() - last_stats >= self.stats_interval:
+                    self.print_stats()
+                    last_stats = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if previous_handler is not None:
+                signal.signal(signal.SIGTERM, previous_handler)
+            self.stop()
+            self.print_stats()
+
+    def install_sigterm_handler(self):
+        """SIGTERM与Ctrl+C一样结束主循环，返回原来的处理函数；不在主线程中时不安装，返回None"""
+        def handle_sigterm(signum, frame):
+            raise KeyboardInterrupt()
+
+        try:
+            return signal.signal(signal.SIGTERM, handle_sigterm)
+        except ValueError:
+            # 只有主线程可以设置信号处理函数
+            return None
+
+    def watch_new_dir(self, path):
+        """新建的子目录需要补充监听，并扫描其中已经存在的文件"""
+        if path == self.output_dir:
+            return
+        for root, dirs, filenames in os.walk(path):
+            dirs[:] = [d for d in dirs if os.path.join(root, d) != self.output_dir]
+            try:
+                self.watcher.add_watch(root)
+            except OSError as e:
+                print(f"无法监听目录 {root}: {e}")
+            for filename in filenames:
+                self.touch(os.path.join(root, filename))
+
+    def stop(self):
+        self.stop_event.set()
+        busy = len(self.in_flight) - self.queue.qsize()
+        if busy > 0:
+            print(f"等待正在处理的{busy}张图片完成…", flush=True)
+        # 工作线程处理完当前图片（输出已改名或临时文件已删除）后才会退出，不能中途放弃
+        for thread in self.threads:
+            thread.join()
+        if self.watcher:
+            self.watcher.close()
+            self.watcher = None
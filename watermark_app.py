@@ -3,26 +3,37 @@
 
 import os
 import sys
-import argparse
-import json
-from datetime import datetime
-from PIL import Image, ImageDraw, ImageFont, ExifTags
-import piexif
+import math
+from collections import namedtuple
+import watermark_core
+import template_store
+from template_store import TemplateStore
+from text_template import FIELDS as TEMPLATE_FIELDS, describe_fields
+from backends import BACKENDS, DEFAULT_BACKEND, available_backends, get_backend
+from export_job import ExportJob
+from export_plan import ExportPlan, path_key
+from scanner import FolderScanner, scan_images
+from scheduler import ExportScheduler, default_memory_budget, parse_memory_size
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
     QLabel, QPushButton, QFileDialog, QListWidget, QListWidgetItem, 
     QComboBox, QLineEdit, QCheckBox, QGroupBox, QGridLayout, QFrame,
-    QSplitter, QMessageBox, QProgressDialog, QColorDialog, QSlider,
+    QSplitter, QMessageBox, QProgressBar, QColorDialog, QSlider,
     QMenu, QAction, QMenuBar, QInputDialog, QFormLayout
 )
 from PyQt5.QtGui import QPixmap, QIcon, QDragEnterEvent, QDropEvent, QColor, QImage, QPainter
-from PyQt5.QtCore import Qt, QSize, QUrl, QPoint, QRect
+from PyQt5.QtCore import Qt, QSize, QUrl, QPoint, QRect, QTimer
 
-# 确保中文显示正常
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-plt.rcParams["font.family"] = ["SimHei", "WenQuanYi Micro Hei", "Heiti TC"]
+# 列表缩略图的长边
+THUMBNAIL_SIZE = 120
+# 预览缩小图的长边按此步长取整，便于复用缓存
+PREVIEW_SIZE_STEP = 256
+# 扫描文件夹时每找到这么多张图片就加入列表并刷新一次界面
+SCAN_BATCH_SIZE = 200
+
+# 预览中图片的几何信息：size为原图（摆正后）尺寸，scale为屏幕像素/原图像素，
+# offset为缩放后的图片在预览标签中的左上角（保持宽高比居中显示产生的留边）
+PreviewGeometry = namedtuple('PreviewGeometry', 'size orientation scale offset')
 
 class WatermarkApp(QMainWindow):
     def __init__(self):
@@ -42,16 +53,22 @@ class WatermarkApp(QMainWindow):
         self.watermark_rotation = 0  # 水印旋转角度
         self.dragging = False  # 拖拽状态标志
         self.drag_start_pos = None  # 拖拽开始位置
+        self.drag_overlay = None  # 拖拽时的底图和水印层
+        self.preview_geometry = {}  # 图片路径 -> PreviewGeometry
+        
+        # 后台导出任务（ExportJob），没有进行中的导出时为None
+        self.export_job = None
+        self.export_failures = []
+        # 确认导出时选择了不导出
+        self.export_declined = False
         
         # 模板相关变量
+        self.template_store = TemplateStore()
         self.templates = []
         
         # 创建UI
         self.initUI()
         
-        # 创建菜单栏
-        self.create_menu_bar()
-        
         # 加载模板和上次的设置
         self.load_templates()
         self.load_last_settings()
@@ -59,6 +76,26 @@ class WatermarkApp(QMainWindow):
         # 启用拖放功能
         self.setAcceptDrops(True)
         
+        # 不影响第一次显示的初始化在窗口第一次绘制后进行（见paintEvent）
+        self.startup_finished = False
+        
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.startup_finished:
+            # 在show()之后直接排队的定时器会先于第一次绘制执行，所以在这里排队
+            self.startup_finished = True
+            QTimer.singleShot(0, self.finish_startup)
+        
+    def finish_startup(self):
+        # 去掉本机不可用的处理引擎；上次使用的引擎不可用时回到默认引擎
+        available = available_backends()
+        selected = self.backend.currentText()
+        for index in reversed(range(self.backend.count())):
+            if self.backend.itemText(index) not in available:
+                self.backend.removeItem(index)
+        if selected not in available:
+            self.backend.setCurrentText(DEFAULT_BACKEND)
+        
     def initUI(self):
         # 设置窗口标题和大小
         self.setWindowTitle('图片水印工具')
@@ -113,36 +150,6 @@ class WatermarkApp(QMainWindow):
         self.clear_btn.clicked.connect(self.clear_list)
         left_layout.addWidget(self.clear_btn)
         
-        # 中间面板：图片预览
-        middle_panel = QWidget()
-        middle_layout = QVBoxLayout(middle_panel)
-        middle_panel.setMinimumWidth(600)
-        
-        # 预览标签
-        self.preview_label = QLabel("图片预览")
-        self.preview_label.setAlignment(Qt.AlignCenter)
-        self.preview_label.setMinimumSize(400, 300)
-        self.preview_label.setStyleSheet("background-color: #f0f0f0; border: 1px solid #ccc;")
-        self.preview_label.mousePressEvent = self.on_preview_mouse_press
-        self.preview_label.mouseMoveEvent = self.on_preview_mouse_move
-        self.preview_label.mouseReleaseEvent = self.on_preview_mouse_release
-        
-        middle_layout.addWidget(self.preview_label)
-        
-        # 水印旋转控制
-        rotate_layout = QHBoxLayout()
-        rotate_layout.addWidget(QLabel("水印旋转:"))
-        self.rotate_slider = QSlider(Qt.Horizontal)
-        self.rotate_slider.setRange(-180, 180)
-        self.rotate_slider.setValue(0)
-        self.rotate_slider.setTickInterval(15)
-        self.rotate_slider.setTickPosition(QSlider.TicksBelow)
-        self.rotate_slider.valueChanged.connect(self.on_rotate_value_changed)
-        rotate_layout.addWidget(self.rotate_slider)
-        self.rotate_value = QLabel("0°")
-        rotate_layout.addWidget(self.rotate_value)
-        middle_layout.addLayout(rotate_layout)
-        
         # 右侧面板：设置
         right_panel = QWidget()
         right_layout = QVBoxLayout(right_panel)
@@ -163,6 +170,35 @@ class WatermarkApp(QMainWindow):
         self.use_date_checkbox.stateChanged.connect(self.update_preview)
         watermark_layout.addRow("使用拍摄日期:", self.use_date_checkbox)
         
+        # 文本模板：按文件名、序号和EXIF拍摄信息为每张图片生成文本，设置后代替上面的文本和日期
+        self.text_template = QLineEdit()
+        self.text_template.setPlaceholderText("如 {camera} · {date} · #{index:05d}，留空不使用")
+        self.text_template.setToolTip(describe_fields())
+        self.text_template.textChanged.connect(self.update_preview)
+        watermark_layout.addRow("文本模板:", self.text_template)
+        
+        # 图片（Logo）水印：选择后代替文字水印
+        logo_layout = QHBoxLayout()
+        self.logo_path = QLineEdit()
+        self.logo_path.setReadOnly(True)
+        self.logo_path.setPlaceholderText("未选择（使用文字水印）")
+        self.logo_path.textChanged.connect(self.update_preview)
+        logo_layout.addWidget(self.logo_path)
+        self.logo_picker = QPushButton("选择")
+        self.logo_picker.clicked.connect(self.pick_logo)
+        logo_layout.addWidget(self.logo_picker)
+        self.logo_clear = QPushButton("清除")
+        self.logo_clear.clicked.connect(self.logo_path.clear)
+        logo_layout.addWidget(self.logo_clear)
+        watermark_layout.addRow("图片水印:", logo_layout)
+        
+        # Logo大小（图片短边的百分比）
+        self.logo_scale = QComboBox()
+        self.logo_scale.addItems([f"{i}%" for i in range(5, 51, 5)])
+        self.logo_scale.setCurrentText("20%")
+        self.logo_scale.currentTextChanged.connect(self.update_preview)
+        watermark_layout.addRow("Logo大小:", self.logo_scale)
+        
         # 字体大小选择
         self.font_size = QComboBox()
         self.font_size.addItems([str(i) for i in range(10, 101, 5)])
@@ -170,6 +206,11 @@ class WatermarkApp(QMainWindow):
         self.font_size.currentTextChanged.connect(self.update_preview)
         watermark_layout.addRow("字体大小:", self.font_size)
         
+        # 按图片短边比例缩放：字号按短边的千分比解释，混合分辨率的批量图片效果一致
+        self.relative_size_checkbox = QCheckBox("字号按短边千分比")
+        self.relative_size_checkbox.stateChanged.connect(self.update_preview)
+        watermark_layout.addRow("相对尺寸:", self.relative_size_checkbox)
+        
         # 位置选择
         self.position = QComboBox()
         self.position.addItem("左上角", "top_left")
@@ -181,6 +222,8 @@ class WatermarkApp(QMainWindow):
         self.position.addItem("左下角", "bottom_left")
         self.position.addItem("底部居中", "bottom_center")
         self.position.addItem("右下角", "bottom_right")
+        self.position.addItem("平铺", "tile")
+        self.position.addItem("自动（按图片内容）", "auto")
         self.position.setCurrentIndex(8)  # 默认右下角
         self.position.currentIndexChanged.connect(self.on_position_changed)
         watermark_layout.addRow("位置:", self.position)
@@ -259,6 +302,26 @@ class WatermarkApp(QMainWindow):
         self.add_suffix.toggled.connect(self.suffix_text.setEnabled)
         export_layout.addWidget(self.suffix_text, 4, 1)
         
+        # 导出配置：一次解码输出多个尺寸
+        export_layout.addWidget(QLabel("导出配置:"), 5, 0)
+        self.export_profile = QComboBox()
+        self.export_profile.addItem("单一输出", None)
+        for profile in watermark_core.load_export_profiles():
+            self.export_profile.addItem(profile['name'], profile)
+        export_layout.addWidget(self.export_profile, 5, 1)
+        
+        # 处理引擎：先列出所有引擎，窗口显示后再去掉当前环境不可用的（检测vips要加载libvips）
+        export_layout.addWidget(QLabel("处理引擎:"), 6, 0)
+        self.backend = QComboBox()
+        self.backend.addItems(list(BACKENDS))
+        export_layout.addWidget(self.backend, 6, 1)
+        
+        # 隐形水印：导出时把"标识|拍摄日期"嵌入图片，可用--verify-mark读取
+        export_layout.addWidget(QLabel("隐形水印:"), 7, 0)
+        self.invisible_mark = QLineEdit()
+        self.invisible_mark.setPlaceholderText("留空不嵌入")
+        export_layout.addWidget(self.invisible_mark, 7, 1)
+        
         export_group.setLayout(export_layout)
         right_layout.addWidget(export_group)
         
@@ -296,25 +359,22 @@ class WatermarkApp(QMainWindow):
         main_layout.addWidget(preview_group, 2)
         main_layout.addWidget(right_panel, 1)
         
-        # 状态栏
+        # 状态栏：导出进行中时在右侧显示进度条和取消按钮
+        self.export_progress = QProgressBar()
+        self.export_progress.setMaximumWidth(200)
+        self.export_progress.hide()
+        self.statusBar().addPermanentWidget(self.export_progress)
+        self.cancel_export_btn = QPushButton('取消导出')
+        self.cancel_export_btn.clicked.connect(self.cancel_export)
+        self.cancel_export_btn.hide()
+        self.statusBar().addPermanentWidget(self.cancel_export_btn)
         self.statusBar().showMessage('就绪')
         
     def toggle_watermark_text(self, state):
-        if state == Qt.Checked:
-            self.watermark_text.setEnabled(False)
-            if self.current_image_index >= 0:
-                self.update_watermark_text()
-        else:
-            self.watermark_text.setEnabled(True)
+        # 日期文本在update_preview中按当前图片取得，这里只切换输入框
+        self.watermark_text.setEnabled(state != Qt.Checked)
         self.update_preview()
     
-    def update_watermark_text(self):
-        if self.current_image_index >= 0 and self.current_image_index < len(self.image_paths):
-            current_image_path = self.image_paths[self.current_image_index]
-            date = self.get_image_creation_date(current_image_path)
-            # 注意：我们不直接修改watermark_text的值，而是在update_preview中处理日期显示
-            pass
-        
     def import_images(self):
         options = QFileDialog.Options()
         file_types = "图片文件 (" + " ".join([f"*{ext}" for ext in self.supported_formats]) + ")"
@@ -323,7 +383,7 @@ class WatermarkApp(QMainWindow):
         )
         
         if files:
-            self.add_images(files)
+            self.add_scanned(files)
             
     def import_folder(self):
         options = QFileDialog.Options()
@@ -332,21 +392,34 @@ class WatermarkApp(QMainWindow):
         )
         
         if folder:
-            files = []
-            for root, _, filenames in os.walk(folder):
-                for filename in filenames:
-                    ext = os.path.splitext(filename)[1].lower()
-                    if ext in self.supported_formats:
-                        files.append(os.path.join(root, filename))
-            
-            if files:
-                self.add_images(files)
-            else:
+            if not self.add_scanned([folder]):
                 QMessageBox.information(self, "提示", "所选文件夹中没有支持的图片文件")
                 
+    def add_scanned(self, paths):
+        # 并行扫描文件夹、按文件头识别图片，边扫描边分批加入列表（大目录不必等扫描完），返回找到的数量
+        scanner = FolderScanner()
+        found = 0
+        batch = []
+        for image in scanner.scan(paths):
+            batch.append(image.path)
+            if len(batch) >= SCAN_BATCH_SIZE:
+                found += len(batch)
+                self.add_images(sorted(batch))
+                batch = []
+                QApplication.processEvents()
+        if batch:
+            found += len(batch)
+            self.add_images(sorted(batch))
+        if scanner.rejected:
+            self.statusBar().showMessage(
+                f'已导入 {len(self.image_paths)} 张图片，跳过 {len(scanner.rejected)} 个不是图片或已损坏的文件'
+            )
+        return found
+        
     def add_images(self, file_paths):
         # 检查文件是否已经存在
-        new_files = [f for f in file_paths if f not in self.image_paths]
+        existing = set(self.image_paths)
+        new_files = [f for f in dict.fromkeys(file_paths) if f not in existing]
         
         if new_files:
             # 添加新文件
@@ -355,8 +428,6 @@ class WatermarkApp(QMainWindow):
             # 更新列表视图
             for file_path in new_files:
                 self.add_image_to_list(file_path)
-                # 连接点击事件
-                self.image_list.itemClicked.connect(self.on_image_item_clicked)
             
             # 如果是第一次添加图片，选中第一张
             if len(self.image_paths) == len(new_files):
@@ -373,9 +444,9 @@ class WatermarkApp(QMainWindow):
             # 创建列表项
             item = QListWidgetItem()
             
-            # 获取图片缩略图
-            pixmap = QPixmap(file_path)
-            scaled_pixmap = pixmap.scaled(120, 120, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            # 获取图片缩略图（缩小解码并按EXIF方向摆正）
+            proxy = watermark_core.decode_proxy(file_path, THUMBNAIL_SIZE)
+            scaled_pixmap = self.pil_to_pixmap(proxy.image)
             
             # 设置图标和文本
             item.setIcon(QIcon(scaled_pixmap))
@@ -391,13 +462,15 @@ class WatermarkApp(QMainWindow):
     def clear_list(self):
         self.image_list.clear()
         self.image_paths = []
+        self.preview_geometry = {}
         self.update_button_states()
         self.statusBar().showMessage('列表已清空')
         
     def update_button_states(self):
-        has_images = len(self.image_paths) > 0
-        self.export_btn.setEnabled(has_images)
-        self.apply_btn.setEnabled(has_images)
+        # 导出进行中时不能开始新的导出，但可以继续导入图片和调整设置
+        can_export = len(self.image_paths) > 0 and self.export_job is None
+        self.export_btn.setEnabled(can_export)
+        self.apply_btn.setEnabled(can_export)
         
     def browse_output_dir(self):
         options = QFileDialog.Options()
@@ -406,9 +479,10 @@ class WatermarkApp(QMainWindow):
         )
         
         if folder:
-            # 检查是否与输入文件夹相同
+            # 检查是否与输入文件夹相同（比较解析符号链接后的路径）
+            folder_key = path_key(folder)
             for img_path in self.image_paths:
-                if os.path.dirname(img_path) == folder:
+                if path_key(os.path.dirname(img_path)) == folder_key:
                     QMessageBox.warning(self, "警告", "禁止导出到原图片所在文件夹，以防止覆盖原图")
                     return
             
@@ -455,135 +529,107 @@ class WatermarkApp(QMainWindow):
             # 获取当前图片路径
             image_path = self.image_paths[self.current_image_index]
             
-            # 打开图片
-            img = Image.open(image_path)
-            
-            # 深拷贝图片以便不修改原图
-            preview_img = img.copy()
-            
-            # 获取水印文本
-            if self.use_date_checkbox.isChecked():
-                watermark_text = self.get_image_creation_date(image_path)
-            else:
-                watermark_text = self.watermark_text.text()
-                if not watermark_text:  # 如果文本为空，不添加水印
-                    watermark_text = "水印"
-            
-            # 获取水印设置
-            font_size = int(self.font_size.currentText())
-            position = self.position.currentData()
+            # 取得与预览区域大小相当的缩小图（已按EXIF方向摆正）
+            proxy = self.load_proxy(image_path)
             
-            # 解析颜色和透明度
-            color_str = self.color.text()
-            opacity = int(self.opacity.currentText().rstrip('%'))
-            color = self.parse_color(color_str, opacity)
+            # 与导出使用同一份编译好的设置和同一个绘制函数，只是画在缩小图上
+            try:
+                job = self.compile_job()
+            except ValueError as e:
+                # 文本模板输入到一半时字段还不完整，只在状态栏提示
+                self.statusBar().showMessage(f"水印设置无效: {e}", 3000)
+                return
+            watermark_text = job.text_for(image_path, proxy.exif)
             
-            # 在预览图上添加水印
-            self.draw_watermark_on_preview(preview_img, watermark_text, font_size, color, position)
+            # 在缩小图的副本上添加水印（不修改缓存），布局按缩小图相对原图的比例换算
+            preview_img = job.render(proxy.image.copy(), watermark_text, self.proxy_scale(proxy))
             
             try:
-                # 直接使用QImage转换，避免依赖ImageQt
-                width, height = preview_img.size
-                
-                # 确保图像是RGB模式
-                if preview_img.mode != 'RGB':
-                    preview_img = preview_img.convert('RGB')
-                
-                # 转换PIL图像到QImage
-                data = preview_img.tobytes('raw', 'RGB')
-                q_image = QImage(data, width, height, 3 * width, QImage.Format_RGB888)
-                qpixmap = QPixmap.fromImage(q_image)
-                
                 # 显示缩放后的图像
-                scaled_pixmap = qpixmap.scaled(
+                scaled_pixmap = self.pil_to_pixmap(preview_img).scaled(
                     self.preview_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation
                 )
                 self.preview_label.setPixmap(scaled_pixmap)
+                self.update_geometry(image_path, proxy, scaled_pixmap)
             except Exception as e:
                 print(f"更新预览失败: {str(e)}")
             
         except Exception as e:
             print(f"更新预览失败: {e}")
     
-    def draw_watermark_on_preview(self, img, text, font_size, color, position):
-        # 创建绘图对象
-        draw = ImageDraw.Draw(img)
-        
-        # 尝试加载系统字体，如果失败则使用默认字体
-        try:
-            font = ImageFont.truetype("Arial.ttf", font_size)
-        except IOError:
-            try:
-                font = ImageFont.truetype("/System/Library/Fonts/PingFang.ttc", font_size)
-            except IOError:
-                font = ImageFont.load_default()
-        
-        # 获取文本大小 (使用textbbox替代textsize)
-        try:
-            # 对于Pillow 9.0.0及以上版本，使用textbbox
-            bbox = draw.textbbox((0, 0), text, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-        except AttributeError:
-            # 对于旧版本的Pillow，回退到textsize
-            text_width, text_height = draw.textsize(text, font=font)
-        
-        # 确定水印位置
-        img_width, img_height = img.size
-        
-        if self.watermark_pos:
-            # 使用手动拖拽的位置
-            x, y = self.watermark_pos
-        else:
-            # 使用预设位置
-            if position == 'top_left':
-                x, y = 10, 10
-            elif position == 'top_center':
-                x, y = (img_width - text_width) // 2, 10
-            elif position == 'top_right':
-                x, y = img_width - text_width - 10, 10
-            elif position == 'left_center':
-                x, y = 10, (img_height - text_height) // 2
-            elif position == 'center':
-                x, y = (img_width - text_width) // 2, (img_height - text_height) // 2
-            elif position == 'right_center':
-                x, y = img_width - text_width - 10, (img_height - text_height) // 2
-            elif position == 'bottom_left':
-                x, y = 10, img_height - text_height - 10
-            elif position == 'bottom_center':
-                x, y = (img_width - text_width) // 2, img_height - text_height - 10
-            elif position == 'bottom_right':
-                x, y = img_width - text_width - 10, img_height - text_height - 10
-            else:
-                # 默认位置为右下角
-                x, y = img_width - text_width - 10, img_height - text_height - 10
-        
-        # 如果有旋转角度，创建一个新的图像用于旋转
-        if self.watermark_rotation != 0:
-            # 创建一个透明的新图像来绘制旋转的文本
-            txt_img = Image.new('RGBA', (text_width + 20, text_height + 20), (255, 255, 255, 0))
-            txt_draw = ImageDraw.Draw(txt_img)
-            
-            # 绘制文本和阴影到临时图像
-            txt_draw.text((10, 10), text, font=font, fill=color)
-            txt_draw.text((11, 11), text, font=font, fill=(0, 0, 0, 128))  # 阴影
-            
-            # 旋转文本图像
-            rotated_txt = txt_img.rotate(self.watermark_rotation, expand=True)
-            
-            # 计算旋转后的位置
-            rot_width, rot_height = rotated_txt.size
-            rot_x = x - (rot_width - text_width) // 2
-            rot_y = y - (rot_height - text_height) // 2
-            
-            # 粘贴旋转后的文本到原图
-            if img.mode != 'RGBA':
-                img = img.convert('RGBA')
-            img.paste(rotated_txt, (rot_x, rot_y), rotated_txt)
-        else:
-            # 直接绘制水印（添加阴影效果增强可读性）
-            draw.text((x+1, y+1), text, font=font, fill=(0, 0, 0, 128))  # 阴影
-            draw.text((x, y), text, font=font, fill=color)
+    def compile_job(self, watermark_pos=None):
+        # 预览、拖拽和导出共用的水印设置，watermark_pos默认为当前手动拖拽的位置；
+        # 文本模板中的序号按图片在列表中的顺序
+        job = watermark_core.compile_settings(self.current_settings(), watermark_pos or self.watermark_pos)
+        return job.numbered(self.image_paths)
+    
+    def proxy_scale(self, proxy):
+        # 缩小图相对原图的比例（按短边计算，与多尺寸输出的换算一致）
+        return min(proxy.image.size) / min(proxy.size)
+    
+    def update_geometry(self, image_path, proxy, pixmap):
+        # 记录图片在预览标签中的缩放比例和位置，拖拽定位时不需要再读取图片
+        rect = self.preview_label.contentsRect()
+        offset = (rect.x() + (rect.width() - pixmap.width()) // 2,
+                  rect.y() + (rect.height() - pixmap.height()) // 2)
+        scale = pixmap.width() / proxy.size[0]
+        self.preview_geometry[image_path] = PreviewGeometry(proxy.size, proxy.orientation, scale, offset)
+    
+    def load_proxy(self, image_path):
+        # 预览用的缩小图：长边按预览区域（含高分屏缩放）向上取整到PREVIEW_SIZE_STEP的倍数，
+        # 窗口小幅缩放时仍命中同一份缓存
+        label_size = self.preview_label.size()
+        longest = max(label_size.width(), label_size.height()) * self.devicePixelRatioF()
+        max_size = max(1, math.ceil(longest / PREVIEW_SIZE_STEP)) * PREVIEW_SIZE_STEP
+        return watermark_core.decode_proxy(image_path, max_size)
+    
+    def pil_to_pixmap(self, img):
+        # 直接使用QImage转换，避免依赖ImageQt
+        # 确保图像是RGB模式（16位灰度先降为8位，透明图合成到白色背景上）
+        if img.mode != 'RGB':
+            img = watermark_core.prepare_for_format(img, 'JPEG').convert('RGB')
+        width, height = img.size
+        data = img.tobytes('raw', 'RGB')
+        q_image = QImage(data, width, height, 3 * width, QImage.Format_RGB888)
+        return QPixmap.fromImage(q_image)
+    
+    def layer_to_pixmap(self, layer):
+        # RGBA水印层转换为带透明度的QPixmap
+        width, height = layer.size
+        data = layer.tobytes('raw', 'RGBA')
+        q_image = QImage(data, width, height, 4 * width, QImage.Format_RGBA8888)
+        return QPixmap.fromImage(q_image)
+    
+    def current_settings(self):
+        # 界面中的水印设置，格式与watermark_core.template_settings的结果相同
+        logo_path, logo_scale = self.logo_settings()
+        opacity = int(self.opacity.currentText().rstrip('%'))
+        return {
+            'text': self.watermark_text.text(),
+            'use_date': self.use_date_checkbox.isChecked(),
+            'font_size': int(self.font_size.currentText()),
+            'color': self.parse_color(self.color.text(), opacity),
+            'position': self.position.currentData(),
+            'rotation': self.watermark_rotation,
+            'relative_size': self.relative_size_checkbox.isChecked(),
+            'logo_path': logo_path,
+            'logo_scale': logo_scale,
+            'invisible_mark': self.invisible_mark.text().strip() or None,
+            'text_template': self.text_template.text() or None,
+        }
+    
+    def logo_settings(self):
+        # 当前的图片水印路径和大小，未选择Logo时路径为None
+        logo_path = self.logo_path.text() or None
+        return logo_path, watermark_core.parse_logo_scale(self.logo_scale.currentText())
+    
+    def pick_logo(self):
+        # 选择PNG等带透明通道的图片作为水印
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "选择水印图片", "", "图片文件 (*.png *.jpg *.jpeg *.bmp *.tiff *.tif)"
+        )
+        if file_path:
+            self.logo_path.setText(file_path)
     
     def on_position_changed(self):
         # 当位置选择变更时，重置手动拖拽的位置
@@ -604,14 +650,52 @@ class WatermarkApp(QMainWindow):
         # 记录拖动开始的位置
         self.dragging = True
         self.drag_start_pos = event.pos()
+        self.drag_overlay = self.create_drag_overlay()
+    
+    def create_drag_overlay(self):
+        # 拖动开始时准备一次不带水印的底图和单独的水印层，拖动过程中只移动水印层
+        image_path = self.image_paths[self.current_image_index]
+        geometry = self.preview_geometry.get(image_path)
+        if geometry is None or self.position.currentData() == 'tile':
+            return None
+        try:
+            proxy = self.load_proxy(image_path)
+            # 水印放在缩小图的(0, 0)处，得到水印层相对于拖拽点的位置
+            job = self.compile_job(watermark_pos=(0.0, 0.0))
+            layer, (x, y) = job.layer(
+                proxy.image.size, job.text_for(image_path, proxy.exif), self.proxy_scale(proxy)
+            )
+            # 缩小图到屏幕的缩放比例
+            factor = geometry.scale * proxy.size[0] / proxy.image.width
+            base = self.pil_to_pixmap(proxy.image).scaled(
+                self.preview_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation
+            )
+            overlay = self.layer_to_pixmap(layer).scaled(
+                max(1, round(layer.width * factor)), max(1, round(layer.height * factor)),
+                Qt.IgnoreAspectRatio, Qt.SmoothTransformation
+            )
+            return base, overlay, (x * factor, y * factor)
+        except Exception as e:
+            print(f"准备拖拽预览失败: {e}")
+            return None
     
     def on_preview_mouse_move(self, event):
         # 检查是否在拖动状态
-        if not self.dragging:
+        if not self.dragging or self.drag_overlay is None:
             return
         
-        # 更新预览
-        self.update_preview()
+        # 在底图上把水印层移动到鼠标位置，不重新绘制整张预览图
+        geometry = self.preview_geometry[self.image_paths[self.current_image_index]]
+        base, overlay, (dx, dy) = self.drag_overlay
+        canvas = QPixmap(base)
+        painter = QPainter(canvas)
+        painter.drawPixmap(
+            round(event.pos().x() - geometry.offset[0] + dx),
+            round(event.pos().y() - geometry.offset[1] + dy),
+            overlay
+        )
+        painter.end()
+        self.preview_label.setPixmap(canvas)
     
     def on_preview_mouse_release(self, event):
         # 检查是否在拖动状态
@@ -620,31 +704,23 @@ class WatermarkApp(QMainWindow):
         
         # 停止拖动
         self.dragging = False
+        self.drag_overlay = None
         
-        # 获取当前图片路径
+        # 获取当前图片的几何信息（更新预览时记录）
         image_path = self.image_paths[self.current_image_index]
+        geometry = self.preview_geometry.get(image_path)
+        if geometry is None:
+            return
+        img_width, img_height = geometry.size
         
-        # 打开图片获取原始尺寸
-        img = Image.open(image_path)
-        img_width, img_height = img.size
-        
-        # 获取标签尺寸
-        label_width = self.preview_label.width()
-        label_height = self.preview_label.height()
-        
-        # 计算缩放比例
-        scale_x = img_width / label_width
-        scale_y = img_height / label_height
-        
-        # 选择较小的缩放比例以保持宽高比
-        scale = min(scale_x, scale_y)
-        
-        # 计算点击位置相对于图片的实际坐标
-        click_x = event.pos().x() * scale
-        click_y = event.pos().y() * scale
+        # 去掉预览图四周的留边后换算为原图坐标，并限制在图片范围内
+        click_x = (event.pos().x() - geometry.offset[0]) / geometry.scale
+        click_y = (event.pos().y() - geometry.offset[1]) / geometry.scale
+        click_x = min(max(click_x, 0), img_width)
+        click_y = min(max(click_y, 0), img_height)
         
-        # 保存手动拖拽的位置
-        self.watermark_pos = (int(click_x), int(click_y))
+        # 保存手动拖拽的位置（相对图片宽高的比例，批量中不同尺寸的图片都适用）
+        self.watermark_pos = (click_x / img_width, click_y / img_height)
         
         # 更新预览
         self.update_preview()
@@ -663,14 +739,21 @@ class WatermarkApp(QMainWindow):
                 'position': self.position.currentIndex(),
                 'color': self.color.text(),
                 'opacity': self.opacity.currentText(),
-                'rotation': self.watermark_rotation
+                'rotation': self.watermark_rotation,
+                'relative_size': self.relative_size_checkbox.isChecked(),
+                'logo': self.logo_path.text(),
+                'logo_scale': self.logo_scale.currentText(),
+                'invisible_mark': self.invisible_mark.text(),
+                'text_template': self.text_template.text()
             }
             
-            # 添加到模板列表
-            self.templates.append(template)
-            
-            # 保存模板到文件
-            self.save_templates()
+            # 保存模板（同名模板会被覆盖）
+            try:
+                self.template_store.save(template)
+            except Exception as e:
+                QMessageBox.warning(self, "警告", f"保存模板失败: {e}")
+                return
+            self.templates = self.template_store.templates()
             
             QMessageBox.information(self, "成功", f"模板 '{template_name}' 已保存")
     
@@ -687,28 +770,32 @@ class WatermarkApp(QMainWindow):
         template_name, ok = QInputDialog.getItem(self, "加载模板", "请选择要加载的模板:", template_names, 0, False)
         
         if ok:
-            # 查找选中的模板
-            for template in self.templates:
-                if template['name'] == template_name:
-                    # 应用模板设置
-                    self.watermark_text.setText(template['text'])
-                    self.use_date_checkbox.setChecked(template['use_date'])
-                    self.font_size.setCurrentText(template['font_size'])
-                    self.position.setCurrentIndex(template['position'])
-                    self.color.setText(template['color'])
-                    self.opacity.setCurrentText(template['opacity'])
-                    self.rotate_slider.setValue(template['rotation'])
-                    self.watermark_rotation = template['rotation']
-                    self.rotate_value.setText(f"{template['rotation']}°")
-                    
-                    # 重置手动位置
-                    self.watermark_pos = None
-                    
-                    # 更新预览
-                    self.update_preview()
-                    
-                    QMessageBox.information(self, "成功", f"模板 '{template_name}' 已加载")
-                    break
+            # 按名称查找选中的模板
+            template = self.template_store.get(template_name)
+            if template:
+                # 应用模板设置
+                self.watermark_text.setText(template['text'])
+                self.use_date_checkbox.setChecked(template['use_date'])
+                self.font_size.setCurrentText(template['font_size'])
+                self.position.setCurrentIndex(template['position'])
+                self.color.setText(template['color'])
+                self.opacity.setCurrentText(template['opacity'])
+                self.rotate_slider.setValue(template['rotation'])
+                self.watermark_rotation = template['rotation']
+                self.rotate_value.setText(f"{template['rotation']}°")
+                self.relative_size_checkbox.setChecked(template.get('relative_size', False))
+                self.logo_path.setText(template.get('logo', ''))
+                self.logo_scale.setCurrentText(template.get('logo_scale', '20%'))
+                self.invisible_mark.setText(template.get('invisible_mark', ''))
+                self.text_template.setText(template.get('text_template', ''))
+                
+                # 重置手动位置
+                self.watermark_pos = None
+                
+                # 更新预览
+                self.update_preview()
+                
+                QMessageBox.information(self, "成功", f"模板 '{template_name}' 已加载")
     
     def delete_template(self):
         # 检查是否有模板
@@ -723,36 +810,20 @@ class WatermarkApp(QMainWindow):
         template_name, ok = QInputDialog.getItem(self, "删除模板", "请选择要删除的模板:", template_names, 0, False)
         
         if ok:
-            # 查找并删除选中的模板
-            for i, template in enumerate(self.templates):
-                if template['name'] == template_name:
-                    del self.templates[i]
-                    
-                    # 保存更新后的模板列表
-                    self.save_templates()
-                    
-                    QMessageBox.information(self, "成功", f"模板 '{template_name}' 已删除")
-                    break
-    
-    def save_templates(self):
-        # 保存模板到文件
-        try:
-            template_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates.json')
-            with open(template_file, 'w', encoding='utf-8') as f:
-                json.dump(self.templates, f, ensure_ascii=False, indent=4)
-        except Exception as e:
-            print(f"保存模板失败: {e}")
+            # 删除选中的模板并保存
+            try:
+                self.template_store.delete(template_name)
+            except Exception as e:
+                QMessageBox.warning(self, "警告", f"删除模板失败: {e}")
+                return
+            self.templates = self.template_store.templates()
+            
+            QMessageBox.information(self, "成功", f"模板 '{template_name}' 已删除")
     
     def load_templates(self):
-        # 从文件加载模板
-        try:
-            template_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates.json')
-            if os.path.exists(template_file):
-                with open(template_file, 'r', encoding='utf-8') as f:
-                    self.templates = json.load(f)
-        except Exception as e:
-            print(f"加载模板失败: {e}")
-            self.templates = []
+        # 从模板存储加载模板
+        self.template_store.reload()
+        self.templates = self.template_store.templates()
     
     def save_last_settings(self):
         # 保存最后一次的设置
@@ -764,33 +835,41 @@ class WatermarkApp(QMainWindow):
                 'position': self.position.currentIndex(),
                 'color': self.color.text(),
                 'opacity': self.opacity.currentText(),
-                'rotation': self.watermark_rotation
+                'rotation': self.watermark_rotation,
+                'relative_size': self.relative_size_checkbox.isChecked(),
+                'logo': self.logo_path.text(),
+                'logo_scale': self.logo_scale.currentText(),
+                'invisible_mark': self.invisible_mark.text(),
+                'text_template': self.text_template.text(),
+                'backend': self.backend.currentText()
             }
             
-            settings_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'last_settings.json')
-            with open(settings_file, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, ensure_ascii=False, indent=4)
+            template_store.save_last_settings(settings)
         except Exception as e:
             print(f"保存设置失败: {e}")
     
     def load_last_settings(self):
         # 加载最后一次的设置
         try:
-            settings_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'last_settings.json')
-            if os.path.exists(settings_file):
-                with open(settings_file, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-                    
-                    # 应用设置
-                    self.watermark_text.setText(settings.get('text', '水印'))
-                    self.use_date_checkbox.setChecked(settings.get('use_date', False))
-                    self.font_size.setCurrentText(settings.get('font_size', '30'))
-                    self.position.setCurrentIndex(settings.get('position', 8))
-                    self.color.setText(settings.get('color', '#FFFFFF'))
-                    self.opacity.setCurrentText(settings.get('opacity', '80%'))
-                    self.rotate_slider.setValue(settings.get('rotation', 0))
-                    self.watermark_rotation = settings.get('rotation', 0)
-                    self.rotate_value.setText(f"{settings.get('rotation', 0)}°")
+            settings = template_store.load_last_settings()
+            if settings:
+                # 应用设置
+                self.watermark_text.setText(settings.get('text', '水印'))
+                self.use_date_checkbox.setChecked(settings.get('use_date', False))
+                self.font_size.setCurrentText(settings.get('font_size', '30'))
+                self.position.setCurrentIndex(settings.get('position', 8))
+                self.color.setText(settings.get('color', '#FFFFFF'))
+                self.opacity.setCurrentText(settings.get('opacity', '80%'))
+                self.rotate_slider.setValue(settings.get('rotation', 0))
+                self.watermark_rotation = settings.get('rotation', 0)
+                self.rotate_value.setText(f"{settings.get('rotation', 0)}°")
+                self.relative_size_checkbox.setChecked(settings.get('relative_size', False))
+                self.logo_path.setText(settings.get('logo', ''))
+                self.logo_scale.setCurrentText(settings.get('logo_scale', '20%'))
+                self.invisible_mark.setText(settings.get('invisible_mark', ''))
+                self.text_template.setText(settings.get('text_template', ''))
+                # 上次使用的引擎在本机不可用时保持默认
+                self.backend.setCurrentText(settings.get('backend', DEFAULT_BACKEND))
         except Exception as e:
             print(f"加载设置失败: {e}")
     
@@ -809,23 +888,8 @@ class WatermarkApp(QMainWindow):
         files = [url.toLocalFile() for url in event.mimeData().urls()]
         
         if files:
-            valid_files = []
-            for file_path in files:
-                if os.path.isdir(file_path):
-                    # 处理文件夹
-                    for root, _, filenames in os.walk(file_path):
-                        for filename in filenames:
-                            ext = os.path.splitext(filename)[1].lower()
-                            if ext in self.supported_formats:
-                                valid_files.append(os.path.join(root, filename))
-                else:
-                    # 处理单个文件
-                    ext = os.path.splitext(file_path)[1].lower()
-                    if ext in self.supported_formats:
-                        valid_files.append(file_path)
-            
-            if valid_files:
-                self.add_images(valid_files)
+            # 文件夹和文件都按文件头识别，不是图片的文件直接跳过
+            self.add_scanned(files)
                 
     def apply_watermark(self):
         # 检查输出文件夹是否设置
@@ -833,245 +897,155 @@ class WatermarkApp(QMainWindow):
             QMessageBox.warning(self, "警告", "请先设置输出文件夹")
             return
         
-        # 创建进度对话框
-        progress = QProgressDialog("正在处理图片...", "取消", 0, len(self.image_paths), self)
-        progress.setWindowModality(Qt.WindowModal)
-        progress.setMinimumDuration(0)
-        
-        success_count = 0
-        
-        for i, image_path in enumerate(self.image_paths):
-            if progress.wasCanceled():
-                break
-            
-            try:
-                # 获取水印文本
-                if self.use_date_checkbox.isChecked():
-                    watermark_text = self.get_image_creation_date(image_path)
-                else:
-                    watermark_text = self.watermark_text.text()
-                
-                # 获取水印设置
-                font_size = int(self.font_size.currentText())
-                position = self.position.currentData()
-                
-                # 解析颜色和透明度
-                color_str = self.color.text()
-                opacity = int(self.opacity.currentText().rstrip('%'))
-                color = self.parse_color(color_str, opacity)
-                
-                # 创建输出文件路径
-                output_path = self.get_output_path(image_path)
-                
-                # 添加水印
-                if self.add_watermark(image_path, output_path, watermark_text, font_size, color, position):
-                    success_count += 1
-                
-            except Exception as e:
-                print(f"处理图片失败: {e}")
-            
-            progress.setValue(i + 1)
-            
-        progress.close()
-        
-        QMessageBox.information(
-            self, "完成", f"处理完成！成功添加水印 {success_count} 张图片，失败 {len(self.image_paths) - success_count} 张图片"
-        )
-        
-    def get_output_path(self, image_path):
+        # 水印设置在任务开始时编译一次，不再为每张图片重新读取界面控件
+        try:
+            job = self.compile_job()
+        except Exception as e:
+            QMessageBox.warning(self, "警告", f"水印设置无效: {e}")
+            return
+        profile = self.export_profile.currentData()
+        backend = get_backend(self.backend.currentText())
+        
+        # 输出路径依赖界面控件，在开始前计算好
+        if profile:
+            output_paths = {
+                image_path: [(rendition, self.get_output_path(image_path, rendition))
+                             for rendition in profile['renditions']]
+                for image_path in self.image_paths
+            }
+        else:
+            output_paths = {image_path: self.get_output_path(image_path) for image_path in self.image_paths}
+        
+        # 在后台线程中先检查输出路径冲突，再大图优先、按内存预算并行处理，界面通过信号更新进度
+        scheduler = ExportScheduler(max_memory=default_memory_budget())
+        self.export_job = ExportJob(output_paths.items(), job, backend, scheduler, self)
+        self.export_job.planned.connect(self.on_export_planned)
+        self.export_job.progress.connect(self.on_export_progress)
+        self.export_job.file_failed.connect(self.on_export_failed)
+        self.export_job.finished.connect(self.on_export_finished)
+        self.export_failures = []
+        self.export_declined = False
+        self.export_progress.setRange(0, len(output_paths))
+        self.export_progress.setValue(0)
+        self.export_progress.show()
+        self.cancel_export_btn.setEnabled(True)
+        self.cancel_export_btn.show()
+        self.statusBar().showMessage(f"正在检查 {len(output_paths)} 张图片的输出路径...")
+        self.update_button_states()
+        self.export_job.start()
+    
+    def on_export_planned(self, plan, needs_confirmation):
+        # 预演期间已经取消时，后台任务会直接结束
+        if self.export_job is None or self.export_job.cancelled.is_set():
+            return
+        # 预演发现输出路径冲突或无法读取的图片时，确认后才开始写入
+        if needs_confirmation:
+            reply = QMessageBox.question(
+                self, "确认导出", f"{plan.format_report(max_conflicts=10)}\n\n是否继续导出？",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+            )
+            # 等待确认期间可能已经关闭窗口
+            if self.export_job is None or self.export_job.cancelled.is_set():
+                return
+            if reply != QMessageBox.Yes:
+                self.export_declined = True
+                self.export_job.cancel()
+                return
+            self.export_job.resume()
+        self.statusBar().showMessage(f"正在导出 {len(plan.items)} 张图片...")
+    
+    def on_export_progress(self, progress):
+        # 后台导出每完成一张图片更新一次进度
+        self.export_progress.setValue(progress.done)
+        message = (f"已导出 {progress.done}/{progress.total} 张，"
+                   f"{progress.images_per_second:.1f} 张/秒，{progress.megabytes_per_second:.1f} MB/秒")
+        if progress.eta is not None and progress.done < progress.total:
+            message += f"，剩余约 {progress.eta:.0f}秒"
+        if progress.failed:
+            message += f"，失败 {progress.failed} 张"
+        self.statusBar().showMessage(message)
+    
+    def on_export_failed(self, image_path, reason):
+        self.export_failures.append(f"{os.path.basename(image_path)}: {reason}")
+    
+    def cancel_export(self):
+        # 协作式取消：正在处理的图片在下一次读写文件时中断，已写了一半的输出会被删除
+        if self.export_job is not None:
+            self.export_job.cancel()
+            self.cancel_export_btn.setEnabled(False)
+            self.statusBar().showMessage("正在取消导出...")
+    
+    def on_export_finished(self, results, cancelled):
+        scheduler_report = self.export_job.scheduler.format_report()
+        placement_report = self.export_job.job.placement_log.format_report()
+        self.export_job.deleteLater()
+        self.export_job = None
+        self.export_progress.hide()
+        self.cancel_export_btn.hide()
+        self.update_button_states()
+        if self.export_declined:
+            # 确认时选择不导出，没有写入任何图片
+            self.statusBar().showMessage("已取消导出")
+            return
+        self.statusBar().showMessage(scheduler_report)
+        
+        success_count = sum(1 for ok in results.values() if ok)
+        failed_count = len(results) - success_count
+        message = f"成功添加水印 {success_count} 张图片，失败 {failed_count} 张图片"
+        if placement_report:
+            message += f"\n{placement_report}"
+        if self.export_failures:
+            message += "\n\n" + "\n".join(self.export_failures[:10])
+            if len(self.export_failures) > 10:
+                message += f"\n……另有 {len(self.export_failures) - 10} 张"
+        if cancelled:
+            QMessageBox.information(self, "已取消", f"导出已取消！{message}")
+        else:
+            QMessageBox.information(self, "完成", f"处理完成！{message}")
+    
+    def closeEvent(self, event):
+        # 关闭窗口时取消正在进行的导出，等待正在处理的图片中断并删除临时文件
+        if self.export_job is not None:
+            self.export_job.cancel()
+            self.export_job.wait(10)
+        super().closeEvent(event)
+        
+    def get_output_path(self, image_path, rendition=None):
         # 获取基本信息
         base_name = os.path.basename(image_path)
         name_without_ext, ext = os.path.splitext(base_name)
         
         # 获取输出格式
-        output_format = self.output_format.currentText().split('.')[-1].lower()
+        output_format = self.output_format.currentText().split('*.')[-1].rstrip(')').lower()
         
         # 应用命名规则
         if self.keep_original_name.isChecked():
-            new_name = f"{name_without_ext}.{output_format}"
+            new_name = name_without_ext
         elif self.add_prefix.isChecked():
             prefix = self.prefix_text.text()
-            new_name = f"{prefix}{name_without_ext}.{output_format}"
+            new_name = f"{prefix}{name_without_ext}"
         elif self.add_suffix.isChecked():
             suffix = self.suffix_text.text()
-            new_name = f"{name_without_ext}{suffix}.{output_format}"
+            new_name = f"{name_without_ext}{suffix}"
+        else:
+            new_name = f"{name_without_ext}_watermark"
+        
+        # 多尺寸输出时追加尺寸后缀并使用该尺寸的格式
+        if rendition:
+            new_name = watermark_core.rendition_output_name(new_name, rendition)
         else:
-            new_name = f"{name_without_ext}_watermark.{output_format}"
+            new_name = f"{new_name}.{output_format}"
         
         # 返回完整路径
         return os.path.join(self.output_dir.text(), new_name)
         
     def get_image_creation_date(self, image_path):
         """从图片的EXIF信息中提取拍摄日期时间"""
-        try:
-            img = Image.open(image_path)
-            # 尝试通过piexif库获取EXIF信息
-            try:
-                exif_dict = piexif.load(img.info['exif'])
-                if piexif.ExifIFD.DateTimeOriginal in exif_dict['Exif']:
-                    date_str = exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal].decode('utf-8')
-                    # 格式通常是"YYYY:MM:DD HH:MM:SS"
-                    try:
-                        date_obj = datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
-                        return date_obj.strftime('%Y-%m-%d')
-                    except ValueError:
-                        # 尝试其他常见格式
-                        pass
-            except (KeyError, AttributeError, piexif.InvalidImageDataError):
-                # 如果piexif失败，尝试使用PIL的ExifTags
-                exif_data = img._getexif()
-                if exif_data:
-                    for tag, value in exif_data.items():
-                        tag_name = ExifTags.TAGS.get(tag, tag)
-                        if tag_name == 'DateTimeOriginal':
-                            try:
-                                date_obj = datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
-                                return date_obj.strftime('%Y-%m-%d')
-                            except ValueError:
-                                pass
-            
-            # 如果无法获取EXIF信息，返回文件的修改时间
-            file_mtime = os.path.getmtime(image_path)
-            date_obj = datetime.fromtimestamp(file_mtime)
-            return date_obj.strftime('%Y-%m-%d')
-        except Exception as e:
-            print(f"无法获取图片{image_path}的拍摄日期: {e}")
-            # 返回当前日期作为后备选项
-            return datetime.now().strftime('%Y-%m-%d')
+        return watermark_core.get_image_creation_date(image_path)
         
     def parse_color(self, color_str, opacity):
         """解析颜色字符串为RGBA元组，应用透明度"""
-        # 支持的预定义颜色
-        colors = {
-            'black': (0, 0, 0),
-            'white': (255, 255, 255),
-            'red': (255, 0, 0),
-            'green': (0, 255, 0),
-            'blue': (0, 0, 255),
-            'yellow': (255, 255, 0),
-            'cyan': (0, 255, 255),
-            'magenta': (255, 0, 255)
-        }
-        
-        # 检查是否是预定义颜色
-        if color_str.lower() in colors:
-            r, g, b = colors[color_str.lower()]
-        # 尝试解析HEX颜色代码
-        elif color_str.startswith('#'):
-            try:
-                # 去除#号
-                color_str = color_str.lstrip('#')
-                # 解析RGB值
-                r = int(color_str[0:2], 16)
-                g = int(color_str[2:4], 16)
-                b = int(color_str[4:6], 16)
-            except ValueError:
-                # 默认返回白色
-                r, g, b = 255, 255, 255
-        else:
-            # 默认返回白色
-            r, g, b = 255, 255, 255
-        
-        # 应用透明度
-        a = int(255 * opacity / 100)
-        return (r, g, b, a)
-        
-    def add_watermark(self, image_path, output_path, text, font_size, color, position):
-        """给图片添加文字水印"""
-        try:
-            # 打开图片
-            img = Image.open(image_path)
-            
-            # 获取文本大小和位置
-            try:
-                font = ImageFont.truetype("Arial.ttf", font_size)
-            except IOError:
-                try:
-                    font = ImageFont.truetype("/System/Library/Fonts/PingFang.ttc", font_size)
-                except IOError:
-                    font = ImageFont.load_default()
-            
-            # 创建绘图对象
-            draw = ImageDraw.Draw(img)
-            
-            # 获取文本大小 (使用textbbox替代textsize)
-            try:
-                # 对于Pillow 9.0.0及以上版本，使用textbbox
-                bbox = draw.textbbox((0, 0), text, font=font)
-                text_width = bbox[2] - bbox[0]
-                text_height = bbox[3] - bbox[1]
-            except AttributeError:
-                # 对于旧版本的Pillow，回退到textsize
-                text_width, text_height = draw.textsize(text, font=font)
-            
-            # 确定水印位置
-            img_width, img_height = img.size
-            
-            if self.watermark_pos:
-                # 使用手动拖拽的位置
-                x, y = self.watermark_pos
-            else:
-                # 使用预设位置
-                if position == 'top_left':
-                    x, y = 10, 10
-                elif position == 'top_center':
-                    x, y = (img_width - text_width) // 2, 10
-                elif position == 'top_right':
-                    x, y = img_width - text_width - 10, 10
-                elif position == 'left_center':
-                    x, y = 10, (img_height - text_height) // 2
-                elif position == 'center':
-                    x, y = (img_width - text_width) // 2, (img_height - text_height) // 2
-                elif position == 'right_center':
-                    x, y = img_width - text_width - 10, (img_height - text_height) // 2
-                elif position == 'bottom_left':
-                    x, y = 10, img_height - text_height - 10
-                elif position == 'bottom_center':
-                    x, y = (img_width - text_width) // 2, img_height - text_height - 10
-                elif position == 'bottom_right':
-                    x, y = img_width - text_width - 10, img_height - text_height - 10
-                else:
-                    # 默认位置为右下角
-                    x, y = img_width - text_width - 10, img_height - text_height - 10
-            
-            # 如果有旋转角度，创建一个新的图像用于旋转
-            if self.watermark_rotation != 0:
-                # 创建一个透明的新图像来绘制旋转的文本
-                txt_img = Image.new('RGBA', (text_width + 20, text_height + 20), (255, 255, 255, 0))
-                txt_draw = ImageDraw.Draw(txt_img)
-                
-                # 绘制文本和阴影到临时图像
-                txt_draw.text((10, 10), text, font=font, fill=color)
-                txt_draw.text((11, 11), text, font=font, fill=(0, 0, 0, 128))  # 阴影
-                
-                # 旋转文本图像
-                rotated_txt = txt_img.rotate(self.watermark_rotation, expand=True)
-                
-                # 计算旋转后的位置
-                rot_width, rot_height = rotated_txt.size
-                rot_x = x - (rot_width - text_width) // 2
-                rot_y = y - (rot_height - text_height) // 2
-                
-                # 粘贴旋转后的文本到原图
-                if img.mode != 'RGBA':
-                    img = img.convert('RGBA')
-                img.paste(rotated_txt, (rot_x, rot_y), rotated_txt)
-            else:
-                # 直接绘制水印（添加阴影效果增强可读性）
-                draw.text((x+1, y+1), text, font=font, fill=(0, 0, 0, 128))  # 阴影
-                draw.text((x, y), text, font=font, fill=color)
-            
-            # 保存图片
-            output_format = os.path.splitext(output_path)[1].lower()
-            if output_format == '.jpg' or output_format == '.jpeg':
-                img.save(output_path, 'JPEG', quality=95)
-            else:
-                img.save(output_path, 'PNG')
-            
-            return True
-        except Exception as e:
-            print(f"处理图片{image_path}时出错: {e}")
-            return False
+        return watermark_core.parse_color(color_str, opacity)
         
     def export_images(self):
         # 这个函数可以简单地调用apply_watermark，因为主要的导出逻辑已经在那里实现了
@@ -1085,109 +1059,293 @@ class QRadioButton(QCheckBox):
 if __name__ == '__main__':
     # 检查是否有命令行参数
     if len(sys.argv) > 1:
-        # 如果有参数，使用命令行模式
+        # 如果有参数，使用命令行模式（argparse只在这里用到，图形界面启动时不导入）
+        import argparse
+        
         parser = argparse.ArgumentParser(description='给图片添加水印')
-        parser.add_argument('path', help='图片文件路径或包含图片的目录路径')
+        parser.add_argument('path', nargs='*', help='图片文件路径或包含图片的目录路径（监视和协调模式下可指定多个目录）')
         parser.add_argument('--font-size', type=int, default=30, help='水印字体大小（默认：30）')
         parser.add_argument('--color', default='white', help='水印颜色，可以是预定义颜色或HEX代码（默认：white）')
         parser.add_argument('--opacity', type=int, default=80, help='水印透明度（0-100，默认：80）')
         parser.add_argument('--position', choices=['top_left', 'top_right', 'bottom_left', 'bottom_right', 'center', 
-                                                  'top_center', 'left_center', 'right_center', 'bottom_center'], 
-                            default='bottom_right', help='水印位置（默认：bottom_right）')
+                                                  'top_center', 'left_center', 'right_center', 'bottom_center', 'tile',
+                                                  'auto'], 
+                            default='bottom_right',
+                            help='水印位置，tile为斜向平铺满整张图，auto按图片内容选择最清晰的位置和黑/白文字颜色（默认：bottom_right）')
         parser.add_argument('--output-dir', help='输出文件夹路径')
         parser.add_argument('--text', help='水印文本')
         parser.add_argument('--use-date', action='store_true', help='使用拍摄日期作为水印')
+        parser.add_argument('--text-template', metavar='TEMPLATE',
+                            help='水印文本模板，按每张图片生成文本（覆盖--text、--use-date和模板中的文本），'
+                                 '如"{camera} · {date} · #{index:05d}"；可用字段: ' + ' '.join(TEMPLATE_FIELDS))
+        parser.add_argument('--date-format', default=watermark_core.DEFAULT_DATE_FORMAT,
+                            help='拍摄日期的格式，strftime写法，如"%%Y年%%m月%%d日"或"%%Y-%%m-%%d %%H:%%M%%z"（默认：%%Y-%%m-%%d）')
         parser.add_argument('--rotation', type=int, default=0, help='水印旋转角度（-180到180，默认：0）')
+        parser.add_argument('--relative-size', action='store_true', help='字体大小按图片短边的千分比解释，不同分辨率的图片水印比例一致')
+        parser.add_argument('--logo', help='使用图片（如带透明通道的PNG）作为水印，代替文字水印')
+        parser.add_argument('--logo-scale', type=float, default=20, help='Logo宽度占图片短边的百分比（默认：20）')
+        parser.add_argument('--profile', help='使用导出配置一次输出多个尺寸（如"原图+网页尺寸"，可在export_profiles.json中自定义）')
+        parser.add_argument('--template', metavar='NAME', help='使用已保存的水印模板（覆盖其他水印选项）')
+        parser.add_argument('--watch', action='store_true', help='监视模式：持续监视输入目录，为新到达的图片添加水印')
+        parser.add_argument('--poll', action='store_true', help='监视模式下不使用inotify，始终轮询')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='轮询间隔秒数（默认：1）')
+        parser.add_argument('--debounce', type=float, default=2.0, help='文件大小保持不变多少秒后才处理（默认：2）')
+        parser.add_argument('--workers', type=int, help='处理线程数（默认：批量处理时为CPU核数，监视模式下为1）')
+        parser.add_argument('--max-memory', help='同时处理的图片估算内存上限，如512M、4G（默认：物理内存的一半）')
+        parser.add_argument('--async-io', action='store_true', help='适合NFS/SMB等高延迟存储：同时进行多个读写请求，渲染交给线程池')
+        parser.add_argument('--io-concurrency', type=int, default=32, help='--async-io时同时进行的文件操作数量（默认：32）')
+        parser.add_argument('--io-latency', type=float, default=0, help='--async-io时给每次文件操作增加的延迟毫秒数，用于模拟网络存储测试吞吐量')
+        parser.add_argument('--serve', metavar='HOST:PORT', help='协调模式：把输入图片分块，分发给其他机器上的工作进程')
+        parser.add_argument('--worker', metavar='URL', help='工作模式：从协调进程（如http://host:8765）领取图片块并处理')
+        parser.add_argument('--manifest', help='协调模式下从清单文件读取图片路径（每行一个），代替遍历目录')
+        parser.add_argument('--chunk-size', type=int, default=100, help='协调模式下每块的图片数量（默认：100）')
+        parser.add_argument('--lease-timeout', type=float, default=300.0, help='工作进程多少秒未续租时收回图片块（默认：300）')
+        parser.add_argument('--max-attempts', type=int, default=3, help='每块最多尝试次数（默认：3）')
+        parser.add_argument('--token', default=os.environ.get('PHOTO_WATERMARK_TOKEN'),
+                            help='协调进程和工作进程之间的共享口令（默认取环境变量PHOTO_WATERMARK_TOKEN）；协调模式监听本机以外的地址时必须设置')
+        parser.add_argument('--invisible-mark', metavar='TEXT',
+                            help='在导出的图片中嵌入隐形水印"TEXT|拍摄日期"（UTF-8最多31字节，经JPEG质量75压缩仍可读取；'
+                                 '16位灰度图片嵌入在16位亮度中，小于8×8像素等无法嵌入的图片导出失败）')
+        parser.add_argument('--verify-mark', action='store_true',
+                            help='不添加水印，读取指定图片（或目录中所有图片）中的隐形水印')
+        parser.add_argument('--backend', choices=sorted(BACKENDS), default=DEFAULT_BACKEND,
+                            help='处理引擎：pillow，或需要安装pyvips的vips（按需流式、多线程处理大图）（默认：pillow）')
+        parser.add_argument('--dry-run', action='store_true', help='只预演不写入：列出输出路径冲突，抽样估算输出大小和耗时')
+        parser.add_argument('--include', action='append', metavar='GLOB',
+                            help='扫描目录时只处理匹配的文件（文件名或相对路径，不区分大小写，可多次指定；默认为支持的图片扩展名）')
+        parser.add_argument('--exclude', action='append', metavar='GLOB',
+                            help='扫描目录时跳过匹配的文件和子目录（可多次指定）')
+        parser.add_argument('--max-depth', type=int,
+                            help='扫描子目录的最大层数，-1为不限制（默认：处理单个目录时为0，协调模式不限制）')
+        parser.add_argument('--stats-interval', type=float, default=10.0, help='监视模式下输出统计信息的间隔秒数（默认：10）')
         
         args = parser.parse_args()
         
-        # 解析颜色
-        def parse_color(color_str, opacity):
-            # 支持的预定义颜色
-            colors = {
-                'black': (0, 0, 0),
-                'white': (255, 255, 255),
-                'red': (255, 0, 0),
-                'green': (0, 255, 0),
-                'blue': (0, 0, 255),
-                'yellow': (255, 255, 0),
-                'cyan': (0, 255, 255),
-                'magenta': (255, 0, 255)
+        try:
+            backend = get_backend(args.backend)
+        except ValueError as e:
+            parser.error(str(e))
+        
+        # 扫描目录的选项；未指定深度时由各模式决定
+        scan_options = {'include': args.include, 'exclude': args.exclude}
+        if args.max_depth is not None:
+            scan_options['max_depth'] = None if args.max_depth < 0 else args.max_depth
+        
+        if args.worker:
+            # 工作模式：水印设置由协调进程提供
+            from distributed import Worker
+            
+            try:
+                max_memory = parse_memory_size(args.max_memory) if args.max_memory else default_memory_budget()
+            except ValueError:
+                parser.error(f"无效的内存大小: {args.max_memory}")
+            try:
+                Worker(args.worker, args.workers, max_memory, args.token, backend=backend).run()
+            except (OSError, ValueError) as e:
+                # 包括无法连接、口令错误（HTTP 403）和本机缺少导出配置
+                print(f"工作进程启动失败: {e}")
+                sys.exit(1)
+            sys.exit(0)
+        if not args.path and not args.manifest:
+            parser.error("请指定图片文件或目录")
+        
+        if args.verify_mark:
+            from invisible_mark import read_mark
+            
+            missing = 0
+            for path in args.path:
+                if os.path.isdir(path):
+                    image_paths = scan_images([path], **{'max_depth': 0, **scan_options})
+                else:
+                    image_paths = [path]
+                for image_path in image_paths:
+                    try:
+                        mark = read_mark(image_path)
+                    except Exception as e:
+                        print(f"{image_path}: 读取失败: {e}")
+                        mark = None
+                    else:
+                        print(f"{image_path}: {mark if mark is not None else '未检测到隐形水印'}")
+                    missing += mark is None
+            sys.exit(1 if missing else 0)
+        
+        # 水印设置：模板优先，否则使用命令行选项
+        if args.template:
+            template = TemplateStore().get(args.template)
+            if template is None:
+                parser.error(f"找不到模板: {args.template}")
+            settings = watermark_core.template_settings(template)
+        else:
+            settings = {
+                'text': args.text or "水印",
+                'use_date': args.use_date,
+                'font_size': args.font_size,
+                'color': watermark_core.parse_color(args.color, args.opacity),
+                'position': args.position,
+                'rotation': args.rotation,
+                'relative_size': args.relative_size,
+                'logo_path': args.logo,
+                'logo_scale': args.logo_scale / 100,
+                'date_format': args.date_format,
             }
+        # 命令行指定的隐形水印和文本模板同样覆盖模板中的设置
+        if args.invisible_mark:
+            settings['invisible_mark'] = args.invisible_mark
+        if args.text_template:
+            settings['text_template'] = args.text_template
+        
+        # 水印设置在任务开始时编译一次
+        try:
+            job = watermark_core.compile_settings(settings)
+        except Exception as e:
+            parser.error(f"水印设置无效: {e}")
+        
+        if args.serve:
+            from distributed import Coordinator, is_loopback, list_images, plan_items, read_manifest
             
-            # 检查是否是预定义颜色
-            if color_str.lower() in colors:
-                r, g, b = colors[color_str.lower()]
-            # 尝试解析HEX颜色代码
-            elif color_str.startswith('#'):
-                try:
-                    # 去除#号
-                    color_str = color_str.lstrip('#')
-                    # 解析RGB值
-                    r = int(color_str[0:2], 16)
-                    g = int(color_str[2:4], 16)
-                    b = int(color_str[4:6], 16)
-                except ValueError:
-                    # 默认返回白色
-                    r, g, b = 255, 255, 255
+            host, _, port = args.serve.rpartition(':')
+            if not port.isdigit():
+                parser.error(f"无效的监听地址: {args.serve}")
+            host = host or '0.0.0.0'
+            if not args.token and not is_loopback(host):
+                # 没有口令时能访问该端口的任何主机都可以领取图片块、提交结果
+                parser.error(f"监听 {host} 时必须用 --token 或环境变量 PHOTO_WATERMARK_TOKEN 设置共享口令"
+                             f"（只在本机使用时可监听 127.0.0.1）")
+            if args.profile and watermark_core.find_export_profile(args.profile) is None:
+                parser.error(f"找不到导出配置: {args.profile}")
+            if args.manifest:
+                sources = read_manifest(args.manifest)
+                output_dir = args.output_dir or os.path.join(os.path.dirname(os.path.abspath(args.manifest)), "watermark")
             else:
-                # 默认返回白色
-                r, g, b = 255, 255, 255
+                output_dir = args.output_dir or f"{args.path[0].rstrip(os.sep)}_watermark"
+                sources = list_images(args.path, output_dir, **scan_options)
+            coordinator = Coordinator(
+                plan_items(sources, output_dir), settings, args.profile,
+                chunk_size=args.chunk_size, lease_timeout=args.lease_timeout,
+                max_attempts=args.max_attempts, token=args.token
+            )
+            failed = coordinator.serve(host, int(port), args.stats_interval)
+            for failed_path in failed[:20]:
+                print(f"失败: {failed_path}")
+            sys.exit(1 if failed else 0)
+        
+        if args.watch:
+            from watch_daemon import WatchDaemon
             
-            # 应用透明度
-            a = int(255 * opacity / 100)
-            return (r, g, b, a)
-        
-        color = parse_color(args.color, args.opacity)
+            for path in args.path:
+                if not os.path.isdir(path):
+                    parser.error(f"监视模式需要目录: {path}")
+            profile = None
+            if args.profile:
+                profile = watermark_core.find_export_profile(args.profile)
+                if profile is None:
+                    parser.error(f"找不到导出配置: {args.profile}")
+            output_dir = args.output_dir or f"{args.path[0].rstrip(os.sep)}_watermark"
+            daemon = WatchDaemon(
+                args.path, output_dir, job,
+                debounce=args.debounce, poll_interval=args.poll_interval,
+                workers=args.workers or 1, use_inotify=not args.poll,
+                stats_interval=args.stats_interval, backend=backend, profile=profile
+            )
+            daemon.run()
+            sys.exit(0)
+        
+        if len(args.path) > 1:
+            parser.error("非监视模式只能指定一个路径")
+        path = args.path[0]
         
         # 设置输出目录
         if not args.output_dir:
-            output_dir = f"{args.path}_watermark" if os.path.isfile(args.path) else f"{args.path}_watermark"
+            output_dir = f"{path}_watermark"
         else:
             output_dir = args.output_dir
         
-        os.makedirs(output_dir, exist_ok=True)
-        
         # 获取要处理的文件列表
-        if os.path.isfile(args.path):
+        if os.path.isfile(path):
             # 如果输入是单个文件
-            files_to_process = [os.path.basename(args.path)]
-            input_dir = os.path.dirname(args.path)
+            file_paths = [path]
+            input_dir = os.path.dirname(path)
             if not input_dir:
                 input_dir = '.'
         else:
-            # 如果输入是目录
-            files_to_process = [f for f in os.listdir(args.path) if os.path.splitext(f)[1].lower() in ['.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.tif']]
-            input_dir = args.path
-        
-        # 创建水印应用实例
-        app = WatermarkApp()
-        app.watermark_rotation = args.rotation  # 设置旋转角度
-        
-        # 处理每个文件
-        success_count = 0
-        for filename in files_to_process:
-            file_path = os.path.join(input_dir, filename)
-            if not os.path.isfile(file_path):
-                continue
-            
-            # 获取水印文本
-            if args.use_date:
-                watermark_text = app.get_image_creation_date(file_path)
-            elif args.text:
-                watermark_text = args.text
-            else:
-                watermark_text = "水印"
-            
+            # 如果输入是目录：按通配符和深度扫描，按文件头识别图片（跳过位于输入目录下的输出目录）
+            scanner = FolderScanner(skip_dirs=[output_dir], **{'max_depth': 0, **scan_options})
+            file_paths = sorted(image.path for image in scanner.scan([path]))
+            for rejected_path, reason in scanner.rejected:
+                print(f"跳过 {rejected_path}: {reason}")
+            input_dir = path
+        # 文本模板中的序号按排序后的文件顺序，与并行处理的完成顺序无关
+        job = job.numbered(file_paths)
+        
+        # 多尺寸导出配置
+        profile = None
+        if args.profile:
+            profile = watermark_core.find_export_profile(args.profile)
+            if profile is None:
+                parser.error(f"找不到导出配置: {args.profile}")
+        
+        def target_dir_for(file_path):
+            # 扫描子目录时输出保持相对于输入目录的子目录结构
+            return os.path.normpath(os.path.join(output_dir, os.path.relpath(os.path.dirname(file_path), input_dir)))
+        
+        def outputs_for(file_path):
             # 创建输出文件路径
-            base_name, ext = os.path.splitext(filename)
-            output_path = os.path.join(output_dir, f"{base_name}_watermark{ext}")
+            base_name, ext = os.path.splitext(os.path.basename(file_path))
+            target_dir = target_dir_for(file_path)
+            
+            if profile:
+                # 每张原图只解码一次，输出配置中的所有尺寸
+                return [(rendition, os.path.join(target_dir, watermark_core.rendition_output_name(f"{base_name}_watermark", rendition)))
+                        for rendition in profile['renditions']]
             
+            return os.path.join(target_dir, f"{base_name}_watermark{ext}")
+        
+        def process(file_path):
             # 添加水印并保存
-            if app.add_watermark(file_path, output_path, watermark_text, args.font_size, color, args.position):
-                success_count += 1
+            return backend.export(file_path, outputs_for(file_path), job)
+        
+        # 写入之前只读取文件头检查输出路径（实际导出时也检查）
+        plan = ExportPlan([(file_path, outputs_for(file_path)) for file_path in file_paths], args.workers, backend)
+        if args.dry_run:
+            # 再抽样处理几张图片，不创建输出目录也不写入任何文件
+            plan.measure(job)
+            print(plan.format_report())
+            if job.placement_log.placements:
+                print(f"抽样图片的{job.placement_log.format_report()}")
+            sys.exit(1 if plan.conflicts else 0)
+        if plan.blocking_conflicts:
+            # 多张图片输出到同一个文件或输出会覆盖原图时，后写的会覆盖先写的，不开始导出
+            print(plan.format_report())
+            print("输出路径冲突，没有写入任何文件；请调整原图文件名或输出文件夹后重试")
+            sys.exit(1)
         
-        print(f"处理完成！成功添加水印 {success_count} 张图片，失败 {len(files_to_process) - success_count} 张图片")
+        os.makedirs(output_dir, exist_ok=True)
+        for directory in {target_dir_for(file_path) for file_path in file_paths}:
+            os.makedirs(directory, exist_ok=True)
+        if args.async_io:
+            # 高延迟存储：并发读写，线程池渲染
+            from async_export import AsyncExporter, LatencyFS
+            
+            fs = LatencyFS(args.io_latency / 1000) if args.io_latency else None
+            exporter = AsyncExporter(job, fs, args.io_concurrency, args.workers, backend)
+            results = exporter.run((file_path, outputs_for(file_path)) for file_path in file_paths)
+            report = exporter.format_report()
+        else:
+            # 大图优先、按内存预算并行处理每个文件
+            file_paths = [file_path for file_path in file_paths if os.path.isfile(file_path)]
+            try:
+                max_memory = parse_memory_size(args.max_memory) if args.max_memory else default_memory_budget()
+            except ValueError:
+                parser.error(f"无效的内存大小: {args.max_memory}")
+            scheduler = ExportScheduler(args.workers, max_memory)
+            results = scheduler.run(file_paths, process)
+            report = scheduler.format_report()
+        success_count = sum(1 for ok in results.values() if ok)
+        
+        print(f"处理完成！成功添加水印 {success_count} 张图片，失败 {len(file_paths) - success_count} 张图片")
+        print(report)
+        if job.placement_log.placements:
+            print(job.placement_log.format_report())
     else:
         # 如果没有参数，启动GUI模式
         app = QApplication(sys.argv)
@@ -1195,4 +1353,4 @@ if __name__ == '__main__':
         window.show()
         # 在应用退出前保存最后一次的设置
         app.aboutToQuit.connect(window.save_last_settings)
-        sys.exit(app.exec_())
\ No newline at end of file
+        sys.exit(app.exec_())
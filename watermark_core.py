@@ -0,0 +1,1253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""水印核心：不依赖GUI的水印绘制、颜色解析、日期提取和模板读取"""
+
+import os
+import math
+import struct
+from collections import namedtuple
+from functools import lru_cache
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+from exif_dates import DEFAULT_DATE_FORMAT, format_capture_date
+from template_store import read_json, user_config_dir
+from text_template import Numbering, compile_template
+
+# 支持的图片格式
+SUPPORTED_FORMATS = ['.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.tif']
+
+# 位置选项，顺序与界面中位置下拉框一致（模板中保存的是下拉框索引）
+POSITIONS = [
+    'top_left', 'top_center', 'top_right',
+    'left_center', 'center', 'right_center',
+    'bottom_left', 'bottom_center', 'bottom_right',
+    'tile', 'auto',
+]
+
+# 报告中使用的位置名称
+POSITION_LABELS = {
+    'top_left': '左上角', 'top_center': '顶部居中', 'top_right': '右上角',
+    'left_center': '左侧居中', 'center': '居中', 'right_center': '右侧居中',
+    'bottom_left': '左下角', 'bottom_center': '底部居中', 'bottom_right': '右下角',
+    'tile': '平铺', 'auto': '自动', 'manual': '手动',
+}
+
+# 相对尺寸模式下，字号以短边的千分比表示；边距为短边的1%（1000像素短边时与固定的10像素一致）
+RELATIVE_SIZE_UNIT = 1000
+RELATIVE_MARGIN = 0.01
+
+
+def parse_color(color_str, opacity):
+    """解析颜色字符串为RGBA元组，应用透明度"""
+    # 支持的预定义颜色
+    colors = {
+        'black': (0, 0, 0),
+        'white': (255, 255, 255),
+        'red': (255, 0, 0),
+        'green': (0, 255, 0),
+        'blue': (0, 0, 255),
+        'yellow': (255, 255, 0),
+        'cyan': (0, 255, 255),
+        'magenta': (255, 0, 255)
+    }
+
+    # 检查是否是预定义颜色
+    if color_str.lower() in colors:
+        r, g, b = colors[color_str.lower()]
+    # 尝试解析HEX颜色代码
+    elif color_str.startswith('#'):
+        try:
+            # 去除#号
+            color_str = color_str.lstrip('#')
+            # 解析RGB值
+            r = int(color_str[0:2], 16)
+            g = int(color_str[2:4], 16)
+            b = int(color_str[4:6], 16)
+        except ValueError:
+            # 默认返回白色
+            r, g, b = 255, 255, 255
+    else:
+        # 默认返回白色
+        r, g, b = 255, 255, 255
+
+    # 应用透明度
+    a = int(255 * opacity / 100)
+    return (r, g, b, a)
+
+
+@lru_cache(maxsize=32)
+def load_font(font_size):
+    """加载系统字体，如果失败则使用默认字体（按字号缓存）"""
+    try:
+        return ImageFont.truetype("Arial.ttf", font_size)
+    except IOError:
+        try:
+            return ImageFont.truetype("/System/Library/Fonts/PingFang.ttc", font_size)
+        except IOError:
+            try:
+                # Pillow 10.1及以上版本的默认字体支持指定字号
+                return ImageFont.load_default(font_size)
+            except TypeError:
+                return ImageFont.load_default()
+
+
+def get_image_creation_date(image_path, exif=None, date_format=DEFAULT_DATE_FORMAT):
+    """从图片的EXIF信息中提取拍摄日期（DateTimeOriginal，其次CreateDate），没有时使用文件修改时间
+
+    exif是解码时已经取得的原始EXIF数据，提供时不再读取文件。
+    """
+    return format_capture_date(image_path, date_format, exif)
+
+
+def measure_text(draw, text, font):
+    """获取文本大小 (使用textbbox替代textsize)"""
+    try:
+        # 对于Pillow 9.0.0及以上版本，使用textbbox
+        bbox = draw.textbbox((0, 0), text, font=font)
+        return bbox[2] - bbox[0], bbox[3] - bbox[1]
+    except AttributeError:
+        # 对于旧版本的Pillow，回退到textsize
+        return draw.textsize(text, font=font)
+
+
+_measure_draw = ImageDraw.Draw(Image.new('L', (1, 1)))
+
+
+@lru_cache(maxsize=1024)
+def text_size(text, font_size):
+    """按(文本, 字号)缓存的文本尺寸"""
+    if use_glyph_atlas(text, font_size):
+        left, top, right, bottom = glyph_run(text, font_size)[1]
+        return right - left, bottom - top
+    return measure_text(_measure_draw, text, load_font(font_size))
+
+
+# ---------- 字形缓存 ----------
+# 日期、序号等每张图片都不同的文本只由少数字符组成（数字和几个分隔符）。
+# 每个字符在每个字号下只光栅化一次，整段文字的蒙版由缓存的字形拼接而成，
+# 不再为每张图片重新排版和光栅化。字母等可能有连字或上下文变形的字符仍整段渲染。
+
+GLYPH_ATLAS_PUNCTUATION = frozenset(' !"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~')
+
+
+def is_atlas_char(ch):
+    """可以单独渲染再拼接的字符：ASCII数字和标点、中日韩文字及全角符号"""
+    return (('0' <= ch <= '9') or ch in GLYPH_ATLAS_PUNCTUATION
+            or '\u3000' <= ch <= '\u9fff' or '\uff00' <= ch <= '\uffef')
+
+
+def use_glyph_atlas(text, font_size):
+    return (len(text) > 1 and all(is_atlas_char(ch) for ch in text)
+            and isinstance(load_font(font_size), ImageFont.FreeTypeFont))
+
+
+@lru_cache(maxsize=1024)
+def glyph_metrics(ch, font_size):
+    """单个字符的(前进宽度, 以原点为基准的边界框)"""
+    font = load_font(font_size)
+    return font.getlength(ch), _measure_draw.textbbox((0, 0), ch, font=font)
+
+
+@lru_cache(maxsize=4096)
+def glyph_kerning(first, second, font_size):
+    """一对字符之间的字距调整（与整段排版使用同一个排版引擎）"""
+    font = load_font(font_size)
+    return font.getlength(first + second) - font.getlength(first) - font.getlength(second)
+
+
+def glyph_run(text, font_size):
+    """返回(各字符的整数像素位置, 整段文字的边界框)，与ImageDraw.text排版一致"""
+    positions = []
+    pen = 0.0
+    left = top = float('inf')
+    right = bottom = float('-inf')
+    previous = None
+    for ch in text:
+        if previous is not None:
+            pen += glyph_kerning(previous, ch, font_size)
+        # 与FreeType渲染时一样，把字形放在四舍五入后的整数像素位置
+        x = math.floor(pen + 0.5)
+        advance, (g_left, g_top, g_right, g_bottom) = glyph_metrics(ch, font_size)
+        if g_right > g_left:
+            left, top = min(left, x + g_left), min(top, g_top)
+            right, bottom = max(right, x + g_right), max(bottom, g_bottom)
+        positions.append(x)
+        pen += advance
+        previous = ch
+    if right < left:
+        # 全是空格
+        return positions, (0, 0, math.floor(pen + 0.5), 0)
+    return positions, (left, top, right, bottom)
+
+
+@lru_cache(maxsize=1024)
+def glyph_mask(ch, font_size):
+    """单个字符的灰度蒙版（字符原点位于(TEXT_PAD, TEXT_PAD)），按字号缓存"""
+    return draw_text_mask(ch, font_size, _measure_draw.textbbox((0, 0), ch, font=load_font(font_size)))
+
+
+def text_mask_size(bbox):
+    _, _, right, bottom = bbox
+    return max(right, 1) + 2 * TEXT_PAD + SHADOW_OFFSET, max(bottom, 1) + 2 * TEXT_PAD + SHADOW_OFFSET
+
+
+def draw_text_mask(text, font_size, bbox):
+    """整段排版并光栅化文字的灰度蒙版（文字原点位于(TEXT_PAD, TEXT_PAD)）"""
+    mask = Image.new('L', text_mask_size(bbox), 0)
+    ImageDraw.Draw(mask).text((TEXT_PAD, TEXT_PAD), text, font=load_font(font_size), fill=255)
+    return mask
+
+
+def assemble_text_mask(text, font_size):
+    """用缓存的字形拼接文字蒙版；字形边缘重叠处取较大值，与FreeType整段渲染相同"""
+    positions, bbox = glyph_run(text, font_size)
+    mask = Image.new('L', text_mask_size(bbox), 0)
+    for x, ch in zip(positions, text):
+        if ch == ' ':
+            continue
+        glyph = glyph_mask(ch, font_size)
+        box = (x, 0, x + glyph.width, glyph.height)
+        mask.paste(ImageChops.lighter(mask.crop(box), glyph), box)
+    return mask
+
+
+@lru_cache(maxsize=256)
+def alpha_table(alpha):
+    """把蒙版值按透明度缩放的查找表"""
+    return [v * alpha // 255 for v in range(256)]
+
+
+# 与分辨率无关的水印布局：
+#   size     字号；relative为True时是短边的比例，否则是像素
+#   margin   边距；relative为True时是短边的比例，否则是像素
+#   anchor   POSITIONS中的预设位置，或'manual'表示手动拖拽的位置
+#   offset   相对图片宽高的偏移（anchor为'manual'时就是水印左上角的相对坐标）
+WatermarkSpec = namedtuple('WatermarkSpec', 'size margin relative anchor offset')
+
+
+def make_spec(font_size, position, watermark_pos=None, relative_size=False):
+    """根据界面/命令行设置创建水印布局
+
+    relative_size为True时font_size按短边的千分比解释；watermark_pos是相对图片宽高的(0~1, 0~1)坐标。
+    """
+    if relative_size:
+        size, margin = font_size / RELATIVE_SIZE_UNIT, RELATIVE_MARGIN
+    else:
+        size, margin = font_size, 10
+    if watermark_pos and position != 'tile':
+        return WatermarkSpec(size, margin, relative_size, 'manual', tuple(watermark_pos))
+    return WatermarkSpec(size, margin, relative_size, position, (0.0, 0.0))
+
+
+def to_relative(spec, img_size):
+    """把像素布局换算为相对于img_size短边的布局，用于按比例缩小的输出"""
+    if spec.relative:
+        return spec
+    short_edge = min(img_size)
+    return spec._replace(size=spec.size / short_edge, margin=spec.margin / short_edge, relative=True)
+
+
+@lru_cache(maxsize=256)
+def resolve_layout(spec, img_size):
+    """按图片尺寸解析布局，返回(字号, 边距, 偏移像素)；同一尺寸只计算一次"""
+    img_width, img_height = img_size
+    if spec.relative:
+        short_edge = min(img_width, img_height)
+        font_size = max(1, int(round(spec.size * short_edge)))
+        margin = max(1, int(round(spec.margin * short_edge)))
+    else:
+        font_size, margin = max(1, int(spec.size)), int(spec.margin)
+    offset = (int(round(spec.offset[0] * img_width)), int(round(spec.offset[1] * img_height)))
+    return font_size, margin, offset
+
+
+def compute_position(position, img_size, text_size, margin=10):
+    """根据预设位置计算水印左上角坐标"""
+    img_width, img_height = img_size
+    text_width, text_height = text_size
+
+    if position == 'top_left':
+        return margin, margin
+    elif position == 'top_center':
+        return (img_width - text_width) // 2, margin
+    elif position == 'top_right':
+        return img_width - text_width - margin, margin
+    elif position == 'left_center':
+        return margin, (img_height - text_height) // 2
+    elif position == 'center':
+        return (img_width - text_width) // 2, (img_height - text_height) // 2
+    elif position == 'right_center':
+        return img_width - text_width - margin, (img_height - text_height) // 2
+    elif position == 'bottom_left':
+        return margin, img_height - text_height - margin
+    elif position == 'bottom_center':
+        return (img_width - text_width) // 2, img_height - text_height - margin
+    else:
+        # 默认位置为右下角
+        return img_width - text_width - margin, img_height - text_height - margin
+
+
+def place_box(spec, img_size, box_size):
+    """按布局计算一个宽高为box_size的水印（文字或Logo）的左上角坐标"""
+    _, margin, offset = resolve_layout(spec, tuple(img_size))
+    if spec.anchor == 'manual':
+        # 使用手动拖拽的位置
+        return offset
+    # 使用预设位置
+    x, y = compute_position(spec.anchor, img_size, box_size, margin)
+    return x + offset[0], y + offset[1]
+
+
+def layout_watermark(spec, img_size, text):
+    """返回(字体, 字号, 文本宽, 文本高, x, y)"""
+    font_size, _, _ = resolve_layout(spec, tuple(img_size))
+    text_width, text_height = text_size(text, font_size)
+    x, y = place_box(spec, img_size, (text_width, text_height))
+    return load_font(font_size), font_size, text_width, text_height, x, y
+
+
+# ---------- 图片（Logo）水印 ----------
+
+# Logo默认宽度：图片短边的20%
+DEFAULT_LOGO_SCALE = 0.2
+
+
+@lru_cache(maxsize=8)
+def load_logo(logo_path, mtime):
+    """读取Logo并转换为预乘透明度的RGBa（按路径和修改时间缓存，文件变化后自动重新读取）"""
+    logo = Image.open(logo_path)
+    logo.load()
+    return logo.convert('RGBA').convert('RGBa')
+
+
+@lru_cache(maxsize=64)
+def logo_variant(logo_path, mtime, width, rotation, alpha):
+    """按目标宽度缩放、旋转并乘入透明度的Logo，每个输出尺寸只重采样一次
+
+    缩放和旋转在预乘透明度的RGBa模式下进行，避免透明像素的颜色渗到边缘；
+    结果转换回RGBA并把透明度乘入alpha通道，可以直接作为蒙版粘贴。
+    """
+    logo = load_logo(logo_path, mtime)
+    height = max(1, int(round(logo.height * width / logo.width)))
+    variant = logo.resize((width, height), Image.LANCZOS)
+    if rotation != 0:
+        variant = variant.rotate(rotation, resample=Image.BICUBIC, expand=True)
+    variant = variant.convert('RGBA')
+    if alpha < 255:
+        variant.putalpha(variant.getchannel('A').point(lambda v: v * alpha // 255))
+    return variant, (width, height)
+
+
+def get_logo(logo_path, img_size, logo_scale, rotation, alpha):
+    """返回(Logo图, 旋转前尺寸)，宽度为图片短边乘以logo_scale"""
+    width = max(1, int(round(min(img_size) * logo_scale)))
+    return logo_variant(logo_path, os.path.getmtime(logo_path), width, rotation, alpha)
+
+
+# ---------- 文字水印 ----------
+
+# 文字阴影：向右下偏移1像素的黑色，完全不透明的文字对应128的阴影透明度
+SHADOW_OFFSET = 1
+SHADOW_ALPHA = 128
+# 文字小图四周的留白
+TEXT_PAD = 2
+
+
+# 旋转的水印按这个倍数放大渲染、旋转后再缩小，边缘平滑；
+# 放大后的画布超过SUPERSAMPLE_PIXELS时降低倍数（大字号平铺单元本身已足够平滑）
+ROTATION_SUPERSAMPLE = 4
+SUPERSAMPLE_PIXELS = 4 * 1000 * 1000
+
+
+def supersample_factor(width, height):
+    factor = ROTATION_SUPERSAMPLE
+    while factor > 1 and width * height * factor * factor > SUPERSAMPLE_PIXELS:
+        factor -= 1
+    return factor
+
+
+def text_mask(text, font_size):
+    """文字的灰度蒙版，日期等文本由缓存的字形拼接"""
+    if use_glyph_atlas(text, font_size):
+        return assemble_text_mask(text, font_size)
+    return draw_text_mask(text, font_size, _measure_draw.textbbox((0, 0), text, font=load_font(font_size)))
+
+
+def colorize_text(mask, color, shadow_offset=SHADOW_OFFSET):
+    """按颜色和透明度把文字蒙版合成为带阴影的RGBA小图"""
+    # 蒙版已为SHADOW_OFFSET的阴影留出位置，更大的阴影偏移需要扩大画布
+    extra = shadow_offset - SHADOW_OFFSET
+    size = (mask.width + extra, mask.height + extra)
+
+    alpha = color[3]
+    shadow_alpha = SHADOW_ALPHA * alpha // 255
+    shadow = Image.new('RGBA', size, (0, 0, 0, 0))
+    shadow_mask = Image.new('L', size, 0)
+    shadow_mask.paste(mask.point(alpha_table(shadow_alpha)), (shadow_offset, shadow_offset))
+    shadow.putalpha(shadow_mask)
+
+    fill = Image.new('RGBA', size, tuple(color[:3]) + (0,))
+    fill_mask = mask.point(alpha_table(alpha))
+    if extra:
+        fill_mask = fill_mask.crop((0, 0) + size)
+    fill.putalpha(fill_mask)
+    return Image.alpha_composite(shadow, fill)
+
+
+@lru_cache(maxsize=256)
+def render_text_patch(text, font_size, color):
+    """把带阴影的文字渲染成RGBA小图，返回(小图, 文字原点在小图中的偏移)
+
+    文字和阴影先画成灰度蒙版，再按颜色和透明度合成为非预乘的RGBA，
+    边缘不会因为在透明底色上抗锯齿而出现黑边。阴影透明度随文字透明度一起缩放。
+    """
+    return colorize_text(text_mask(text, font_size), color), TEXT_PAD
+
+
+def rotate_supersampled(img, rotation, factor):
+    """旋转放大factor倍渲染的RGBA图并缩小回原尺寸，返回(结果, 旋转中心在结果中的坐标)
+
+    在预乘透明度的RGBa模式下做双三次插值旋转，透明像素的颜色不会渗到边缘；
+    缩小时按factor×factor的像素块取平均，相当于每个输出像素多点采样。
+    """
+    rotated = img.convert('RGBa').rotate(rotation, resample=Image.BICUBIC, expand=True)
+    result = rotated.reduce(factor).convert('RGBA')
+    return result, (rotated.width / 2 / factor, rotated.height / 2 / factor)
+
+
+@lru_cache(maxsize=256)
+def rotated_text_patch(text, font_size, color, rotation):
+    """旋转后的文字小图，返回(小图, 文字中心在小图中的坐标)；按文字、字号、颜色和角度缓存
+
+    文字放大渲染后旋转再缩小，结果裁剪到不透明部分的边界框，合成时不处理多余的透明像素。
+    """
+    factor = supersample_factor(*text_size(text, font_size))
+    patch = colorize_text(text_mask(text, font_size * factor), color, SHADOW_OFFSET * factor)
+    patch, (center_x, center_y) = rotate_supersampled(patch, rotation, factor)
+    bbox = patch.getchannel('A').getbbox() or (0, 0, 1, 1)
+    return patch.crop(bbox), (center_x - bbox[0], center_y - bbox[1])
+
+
+@lru_cache(maxsize=64)
+def render_tile(text, font_size, color, rotation):
+    """预渲染一个平铺单元：带阴影的文字，四周留出一行字高的间距，再按角度旋转"""
+    text_width, text_height = text_size(text, font_size)
+    gap = max(text_height, font_size // 2)
+    if rotation == 0:
+        patch, _ = render_text_patch(text, font_size, color)
+        tile = Image.new('RGBA', (patch.width + 2 * gap, patch.height + 2 * gap), (0, 0, 0, 0))
+        tile.paste(patch, (gap, gap))
+        return tile
+
+    factor = supersample_factor(text_width + 2 * gap, text_height + 2 * gap)
+    patch = colorize_text(text_mask(text, font_size * factor), color, SHADOW_OFFSET * factor)
+    gap *= factor
+    tile = Image.new('RGBA', (patch.width + 2 * gap, patch.height + 2 * gap), (0, 0, 0, 0))
+    tile.paste(patch, (gap, gap))
+    return rotate_supersampled(tile, rotation, factor)[0]
+
+
+# 平铺条带的缓存数量。只缓存两行单元高的条带，不缓存整图大小的水印层：
+# 4000万像素的图片整图RGBA水印层约160MB，不在ExportScheduler的内存估算之内
+TILE_STRIP_CACHE_SIZE = 4
+
+
+@lru_cache(maxsize=TILE_STRIP_CACHE_SIZE)
+def tiled_strip(text, font_size, color, rotation, width):
+    """宽度为width的文字平铺条带，按图片宽度缓存"""
+    return fill_strip(render_tile(text, font_size, color, rotation), width)
+
+
+@lru_cache(maxsize=TILE_STRIP_CACHE_SIZE)
+def tiled_logo_strip(logo_path, mtime, logo_width, rotation, alpha, width):
+    """宽度为width的Logo平铺条带，按图片宽度缓存"""
+    logo, (scaled_width, scaled_height) = logo_variant(logo_path, mtime, logo_width, rotation, alpha)
+    gap = min(scaled_width, scaled_height) // 2
+    tile = Image.new('RGBA', (logo.width + 2 * gap, logo.height + 2 * gap), (0, 0, 0, 0))
+    tile.paste(logo, (gap, gap))
+    return fill_strip(tile, width)
+
+
+def fill_strip(tile, width):
+    """用平铺单元拼出两行高的条带，第二行错开半个单元，条带竖直重复时形成斜向排列"""
+    tile_width, tile_height = tile.size
+    strip = Image.new('RGBA', (width, 2 * tile_height), (0, 0, 0, 0))
+    for x in range(0, width + tile_width, tile_width):
+        strip.paste(tile, (x, 0))
+        strip.paste(tile, (x - tile_width // 2, tile_height))
+    return strip
+
+
+def fill_layer(strip, size):
+    """把条带竖直铺满，得到整图大小的水印层（不缓存，用完即释放）
+
+    粘贴次数只与宽高除以单元尺寸之和成正比，而不是逐个绘制文字。
+    """
+    layer = Image.new('RGBA', size, (0, 0, 0, 0))
+    for y in range(0, size[1], strip.height):
+        layer.paste(strip, (0, y))
+    return layer
+
+
+def clip_layer(layer, box, img_size):
+    """把水印层裁剪到图片范围内，返回(裁剪后的水印层, 新位置)，完全在图片外时水印层为None"""
+    x, y = box
+    width, height = layer.size
+    left, top = max(0, -x), max(0, -y)
+    right, bottom = min(width, img_size[0] - x), min(height, img_size[1] - y)
+    if right <= left or bottom <= top:
+        return None, box
+    if (left, top, right, bottom) != (0, 0, width, height):
+        layer = layer.crop((left, top, right, bottom))
+    return layer, (x + left, y + top)
+
+
+def composite_layer(img, layer, box=(0, 0)):
+    """把RGBA水印层按透明度合成到图片上，返回结果图片
+
+    按图片模式选择合成方式，只转换水印层（通常远小于原图），不把整张图转换为RGBA：
+      RGB/L/CMYK  以水印层的alpha为蒙版，粘贴转换到同一模式的水印层
+      RGBA        alpha_composite
+      LA          亮度按蒙版混合，alpha按"over"规则叠加
+      I;16/I      16位灰度，用NumPy按alpha混合
+    其他模式（P、1、F等）先转换为RGB，带透明度时转换为RGBA。
+    """
+    layer, box = clip_layer(layer, box, img.size)
+    if layer is None:
+        return img
+
+    mode = img.mode
+    if mode == 'RGBA':
+        img.alpha_composite(layer, dest=box)
+    elif mode == 'RGB':
+        img.paste(layer, box, layer)
+    elif mode == 'L':
+        img.paste(layer.convert('L'), box, layer)
+    elif mode == 'CMYK':
+        img.paste(layer.convert('RGB').convert('CMYK'), box, layer)
+    elif mode == 'LA':
+        source = Image.merge('LA', (layer.convert('L'), Image.new('L', layer.size, 255)))
+        img.paste(source, box, layer.getchannel('A'))
+    elif mode in ('I;16', 'I'):
+        composite_16bit(img, layer, box)
+    else:
+        return composite_layer(expand_mode(img), layer, box)
+    return img
+
+
+def expand_mode(img):
+    """把P、1、F等没有合成快速路径的模式转换为RGB，带透明度时转换为RGBA"""
+    has_alpha = 'A' in img.mode or 'transparency' in img.info
+    return img.convert('RGBA' if has_alpha else 'RGB')
+
+
+def composite_16bit(img, layer, box):
+    """16位灰度图的合成：Pillow的蒙版粘贴对16位数据按字节插值，结果不正确"""
+    import numpy as np
+
+    width, height = layer.size
+    region = img.crop((box[0], box[1], box[0] + width, box[1] + height))
+    destination = np.asarray(region).astype(np.float32)
+    source = np.asarray(layer.convert('L'), dtype=np.float32) * 257
+    alpha = np.asarray(layer.getchannel('A'), dtype=np.float32) / 255
+    blended = np.rint(destination + (source - destination) * alpha)
+    dtype = np.uint16 if img.mode == 'I;16' else np.int32
+    img.paste(Image.fromarray(blended.astype(dtype)), box)
+
+
+def logo_layer(img_size, logo_path, logo_scale, spec, alpha, rotation=0):
+    """返回Logo水印层及其在图片上的位置(水印层, (x, y))"""
+    logo, (logo_width, logo_height) = get_logo(logo_path, img_size, logo_scale, rotation, alpha)
+    x, y = place_box(spec, img_size, (logo_width, logo_height))
+    # 旋转后保持Logo中心不变
+    x -= (logo.width - logo_width) // 2
+    y -= (logo.height - logo_height) // 2
+    return logo, (x, y)
+
+
+def watermark_layer(img_size, text, spec, color, rotation=0, logo_path=None, logo_scale=DEFAULT_LOGO_SCALE):
+    """返回尺寸为img_size的图片上的水印层及其位置(水印层, (x, y))
+
+    水印层是缓存的RGBA小图（平铺时为整图大小），位置可能超出图片范围。
+    预览拖拽时直接移动这个水印层，不需要重新绘制底图。
+    """
+    if spec.anchor == 'tile':
+        # 平铺模式：由缓存的条带拼出整图大小的水印层
+        return fill_layer(watermark_strip(img_size, text, spec, color, rotation, logo_path, logo_scale),
+                          tuple(img_size)), (0, 0)
+
+    if logo_path:
+        return logo_layer(img_size, logo_path, logo_scale, spec, color[3], rotation)
+
+    _, font_size, _, _, x, y = layout_watermark(spec, img_size, text)
+    patch, pad = render_text_patch(text, font_size, tuple(color))
+    box = (x - pad, y - pad)
+
+    # 如果有旋转角度，使用缓存的旋转文字，保持文字中心不变
+    if rotation != 0:
+        center_x, center_y = box[0] + patch.width / 2, box[1] + patch.height / 2
+        patch, (patch_x, patch_y) = rotated_text_patch(text, font_size, tuple(color), rotation)
+        box = (int(round(center_x - patch_x)), int(round(center_y - patch_y)))
+
+    return patch, box
+
+
+def draw_watermark(img, text, spec, color, rotation=0, logo_path=None, logo_scale=DEFAULT_LOGO_SCALE):
+    """在图片上绘制水印并返回结果图片
+
+    指定logo_path时绘制图片水印（透明度取color的alpha），否则绘制文字。
+    P等不能直接合成的模式会被转换，因此调用方应使用返回值而不是传入的img。
+    """
+    if spec.anchor == 'tile':
+        # 平铺模式：把缓存的条带逐行合成到图片上，不生成整图大小的水印层
+        strip = watermark_strip(img.size, text, spec, color, rotation, logo_path, logo_scale)
+        for y in range(0, img.height, strip.height):
+            img = composite_layer(img, strip, (0, y))
+        return img
+    layer, box = watermark_layer(img.size, text, spec, color, rotation, logo_path, logo_scale)
+    return composite_layer(img, layer, box)
+
+
+def watermark_strip(img_size, text, spec, color, rotation=0, logo_path=None, logo_scale=DEFAULT_LOGO_SCALE):
+    """平铺模式下与图片等宽的条带（缓存），竖直重复即铺满整张图"""
+    if logo_path:
+        logo_width = max(1, int(round(min(img_size) * logo_scale)))
+        return tiled_logo_strip(logo_path, os.path.getmtime(logo_path), logo_width, rotation, color[3], img_size[0])
+    font_size, _, _ = resolve_layout(spec, tuple(img_size))
+    return tiled_strip(text, font_size, tuple(color), rotation, img_size[0])
+
+
+# ---------- 自动位置 ----------
+
+# 自动位置的候选，得分相同时靠前的优先
+AUTO_CANDIDATES = ('bottom_right', 'bottom_left', 'top_right', 'top_left',
+                   'bottom_center', 'top_center', 'right_center', 'left_center', 'center')
+# 分析用亮度缩小图的长边；先最近邻取样到ANALYSIS_OVERSAMPLE倍再按块平均，避免读取整张图
+ANALYSIS_SIZE = 128
+ANALYSIS_OVERSAMPLE = 4
+# 得分 = 文字与背景的亮度差 - 背景标准差×STD_WEIGHT - 背景平均梯度×EDGE_WEIGHT
+STD_WEIGHT = 1.0
+EDGE_WEIGHT = 2.0
+
+# anchor为选中的位置，color为按背景选择的颜色（白色或黑色，透明度不变），score为得分
+Placement = namedtuple('Placement', 'anchor color score')
+
+
+def analysis_luma(img):
+    """长边为ANALYSIS_SIZE的亮度缩小图(float64数组)，耗时与原图大小基本无关"""
+    import numpy as np
+
+    factor = ANALYSIS_SIZE / max(img.size)
+    size = (max(1, round(img.width * factor)), max(1, round(img.height * factor)))
+    sampled = img.resize((size[0] * ANALYSIS_OVERSAMPLE, size[1] * ANALYSIS_OVERSAMPLE), Image.NEAREST)
+    if sampled.mode in ('I;16', 'I'):
+        sampled = to_8bit(sampled)
+    return np.asarray(sampled.convert('L').resize(size, Image.BOX), dtype=np.float64)
+
+
+def summed_area(values):
+    """积分图，任意矩形内的和只需四次查表"""
+    import numpy as np
+
+    table = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+    table[1:, 1:] = values.cumsum(0).cumsum(1)
+    return table
+
+
+def region_means(table, boxes):
+    """boxes为(n, 4)的[x0, y0, x1, y1]整数数组，返回各矩形内的平均值"""
+    x0, y0, x1, y1 = boxes.T
+    total = table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+    return total / ((x1 - x0) * (y1 - y0))
+
+
+def choose_placement(img, text, spec, color, rotation=0, logo_path=None, logo_scale=DEFAULT_LOGO_SCALE):
+    """按图片内容为自动位置选择候选位置和文字颜色，返回Placement
+
+    每个候选位置的水印范围换算到亮度缩小图上，用积分图一次算出所有候选区域的平均亮度、
+    标准差和平均梯度：背景越平坦、与文字（白或黑，取差得多的一个）的亮度差越大得分越高。
+    """
+    import numpy as np
+
+    luma = analysis_luma(img)
+    gradient = np.zeros_like(luma)
+    gradient[:, 1:] += np.abs(np.diff(luma, axis=1))
+    gradient[1:, :] += np.abs(np.diff(luma, axis=0))
+
+    # 各候选位置上水印层的范围（文字小图和Logo都有缓存，这里只计算位置）
+    scale_x, scale_y = luma.shape[1] / img.width, luma.shape[0] / img.height
+    boxes = []
+    for anchor in AUTO_CANDIDATES:
+        layer, (x, y) = watermark_layer(img.size, text, spec._replace(anchor=anchor), color, rotation,
+                                        logo_path, logo_scale)
+        box = [x * scale_x, y * scale_y, (x + layer.width) * scale_x, (y + layer.height) * scale_y]
+        boxes.append(box)
+    boxes = np.array(boxes)
+    limits = np.array([luma.shape[1], luma.shape[0]])
+    # 换算后的范围向外取整，并且至少包含缩小图的一个像素
+    start = np.clip(np.floor(boxes[:, :2]), 0, limits - 1)
+    end = np.clip(np.ceil(boxes[:, 2:]), start + 1, limits)
+    boxes = np.hstack([start, end]).astype(np.intp)
+
+    mean = region_means(summed_area(luma), boxes)
+    std = np.sqrt(np.maximum(region_means(summed_area(luma * luma), boxes) - mean * mean, 0))
+    edges = region_means(summed_area(gradient), boxes)
+    contrast = np.maximum(mean, 255 - mean)
+    scores = contrast - STD_WEIGHT * std - EDGE_WEIGHT * edges
+
+    best = int(np.argmax(scores))
+    # 背景偏暗时用白字，偏亮时用黑字
+    rgb = (255, 255, 255) if mean[best] < 128 else (0, 0, 0)
+    return Placement(AUTO_CANDIDATES[best], rgb + (color[3],), float(scores[best]))
+
+
+class PlacementLog:
+    """记录自动位置为每张图片选择的位置和颜色，导出结束后汇总到报告中"""
+
+    def __init__(self):
+        self.placements = {}
+
+    def record(self, image_path, placement):
+        self.placements[image_path] = placement
+
+    def format_report(self):
+        if not self.placements:
+            return ''
+        counts = {}
+        for placement in self.placements.values():
+            key = (placement.anchor, placement.color[:3] == (255, 255, 255))
+            counts[key] = counts.get(key, 0) + 1
+        parts = [f"{POSITION_LABELS[anchor]}{'白字' if white else '黑字'} {count} 张"
+                 for (anchor, white), count in sorted(counts.items(), key=lambda item: -item[1])]
+        return "自动位置：" + "，".join(parts)
+
+
+# ---------- 元数据透传 ----------
+
+# 解码时从原图取得的元数据：exif为原始EXIF段（Orientation已重置为1），
+# icc_profile为原始ICC数据，color_bands为原图的颜色通道数（用于判断ICC是否仍然适用）
+ImageMetadata = namedtuple('ImageMetadata', 'exif icc_profile dpi orientation color_bands')
+
+EXIF_HEADER = b'Exif\x00\x00'
+ORIENTATION_TAG = 0x0112
+# IFD1中JPEG缩略图的位置和长度
+THUMBNAIL_OFFSET_TAG = 0x0201
+THUMBNAIL_LENGTH_TAG = 0x0202
+
+# EXIF方向值对应的变换（与ImageOps.exif_transpose一致）
+ORIENTATION_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+
+def color_bands(mode):
+    """图片模式的颜色通道数（不含透明通道）"""
+    if mode in ('1', 'L', 'LA', 'I', 'I;16', 'F'):
+        return 1
+    if mode == 'CMYK':
+        return 4
+    return 3
+
+
+def find_orientation(exif):
+    """在原始EXIF的IFD0中查找Orientation标签，返回(方向值, 值在exif中的偏移)
+
+    只读取TIFF头和IFD0的目录项，不解析整个EXIF。找不到时返回(1, None)。
+    """
+    start = len(EXIF_HEADER) if exif.startswith(EXIF_HEADER) else 0
+    try:
+        byte_order = exif[start:start + 2]
+        if byte_order == b'II':
+            endian = '<'
+        elif byte_order == b'MM':
+            endian = '>'
+        else:
+            return 1, None
+        ifd = start + struct.unpack_from(endian + 'I', exif, start + 4)[0]
+        count = struct.unpack_from(endian + 'H', exif, ifd)[0]
+        for i in range(count):
+            entry = ifd + 2 + 12 * i
+            tag, field_type = struct.unpack_from(endian + 'HH', exif, entry)
+            if tag == ORIENTATION_TAG and field_type == 3:
+                return struct.unpack_from(endian + 'H', exif, entry + 8)[0], (entry + 8, endian)
+    except struct.error:
+        pass
+    return 1, None
+
+
+def remove_thumbnail(exif):
+    """去掉原始EXIF中IFD1的缩略图，返回新的EXIF
+
+    缩略图是未加水印、未按方向旋转的原图缩小版本，不能随输出文件写出。IFD0指向IFD1的偏移改为0，
+    缩略图数据在EXIF末尾时截掉，否则用0覆盖，其他数据的偏移都不变。没有缩略图时原样返回。
+    """
+    start = len(EXIF_HEADER) if exif.startswith(EXIF_HEADER) else 0
+    try:
+        byte_order = exif[start:start + 2]
+        if byte_order == b'II':
+            endian = '<'
+        elif byte_order == b'MM':
+            endian = '>'
+        else:
+            return exif
+        ifd = start + struct.unpack_from(endian + 'I', exif, start + 4)[0]
+        link = ifd + 2 + 12 * struct.unpack_from(endian + 'H', exif, ifd)[0]
+        next_ifd = struct.unpack_from(endian + 'I', exif, link)[0]
+        if not next_ifd:
+            return exif
+        thumbnail = {}
+        ifd = start + next_ifd
+        for i in range(struct.unpack_from(endian + 'H', exif, ifd)[0]):
+            entry = ifd + 2 + 12 * i
+            tag, field_type = struct.unpack_from(endian + 'HH', exif, entry)
+            if tag in (THUMBNAIL_OFFSET_TAG, THUMBNAIL_LENGTH_TAG):
+                thumbnail[tag] = struct.unpack_from(endian + ('H' if field_type == 3 else 'I'), exif, entry + 8)[0]
+    except struct.error:
+        return exif
+
+    patched = bytearray(exif)
+    struct.pack_into(endian + 'I', patched, link, 0)
+    offset, length = thumbnail.get(THUMBNAIL_OFFSET_TAG), thumbnail.get(THUMBNAIL_LENGTH_TAG)
+    if offset and length:
+        begin = start + offset
+        end = min(begin + length, len(patched))
+        if end >= len(patched):
+            del patched[begin:]
+        else:
+            patched[begin:end] = bytes(end - begin)
+    return bytes(patched)
+
+
+def read_orientation(img):
+    """返回(EXIF方向, Orientation已重置为1、去掉了缩略图的原始EXIF)
+
+    JPEG/PNG的方向在原始EXIF段中，TIFF的方向是文件本身的标签（不会写到输出文件里）。
+    """
+    exif = img.info.get('exif')
+    if exif:
+        orientation, location = find_orientation(exif)
+        if location is not None and orientation != 1:
+            offset, endian = location
+            patched = bytearray(exif)
+            struct.pack_into(endian + 'H', patched, offset, 1)
+            exif = bytes(patched)
+        return orientation, remove_thumbnail(exif)
+    tags = getattr(img, 'tag_v2', None)
+    if tags is not None:
+        return tags.get(ORIENTATION_TAG, 1), None
+    return 1, None
+
+
+def apply_orientation(img, orientation):
+    """把EXIF方向应用到像素上"""
+    if orientation in ORIENTATION_TRANSPOSE:
+        return img.transpose(ORIENTATION_TRANSPOSE[orientation])
+    return img
+
+
+def decode_image(image_path, source=None):
+    """打开并解码图片，同时取得需要透传的元数据
+
+    EXIF和ICC直接使用解码时读到的原始数据（JPEG的APP1/APP2段，PNG的eXIf/iCCP块），
+    保存时原样写回。EXIF方向在这里一次性应用到像素上，并把原始EXIF中的Orientation改为1，
+    这样水印按看到的方向定位，其他软件也不会再旋转一次；EXIF中没有水印的缩略图被去掉。返回(图片, ImageMetadata)。
+    source是已经读入内存的文件内容（类文件对象），提供时不再打开image_path。
+    """
+    img = Image.open(source or image_path)
+    img.load()
+    orientation, exif = read_orientation(img)
+    dpi = img.info.get('dpi')
+    if dpi and orientation >= 5:
+        dpi = (dpi[1], dpi[0])
+    metadata = ImageMetadata(exif, img.info.get('icc_profile'), dpi, orientation, color_bands(img.mode))
+    return apply_orientation(img, orientation), metadata
+
+
+# ---------- 缩小解码（预览、缩略图） ----------
+
+# image是按方向摆正后的缩小图，size是原图摆正后的尺寸，exif是原始EXIF（用于读取拍摄日期）
+ImageProxy = namedtuple('ImageProxy', 'image size orientation exif')
+
+# 缩小图缓存的数量（预览的各个尺寸和缩略图共用）
+PROXY_CACHE_SIZE = 64
+
+
+def select_reduced_frame(img, max_size):
+    """多分辨率TIFF中选择不小于目标尺寸的最小的一层，只读取各层的头信息"""
+    if getattr(img, 'format', None) != 'TIFF' or getattr(img, 'n_frames', 1) < 2:
+        return
+    best_frame, best_size = 0, img.size
+    for frame in range(1, img.n_frames):
+        img.seek(frame)
+        # NewSubfileType的第0位表示这一层是同一图片的缩小版本
+        if not img.tag_v2.get(254, 0) & 1 or max(img.size) < max_size:
+            continue
+        if img.size[0] < best_size[0]:
+            best_frame, best_size = frame, img.size
+    img.seek(best_frame)
+
+
+@lru_cache(maxsize=PROXY_CACHE_SIZE)
+def _decode_proxy(image_path, mtime, max_size):
+    img = Image.open(image_path)
+    size = img.size
+    orientation, exif = read_orientation(img)
+    if orientation >= 5:
+        size = (size[1], size[0])
+    # 目标框是正方形，方向是否交换宽高都不影响缩小比例
+    box = (max_size, max_size)
+    select_reduced_frame(img, max_size)
+    # JPEG在DCT阶段直接按1/2、1/4、1/8缩小解码
+    img.draft(None, box)
+    img.thumbnail(box, Image.LANCZOS, reducing_gap=2.0)
+    return ImageProxy(apply_orientation(img, orientation), size, orientation, exif)
+
+
+def decode_proxy(image_path, max_size):
+    """解码长边不超过max_size的缩小图，已按EXIF方向摆正
+
+    结果按(路径, 修改时间, 尺寸)缓存，预览、缩略图和拖拽定位共用；返回的图片是共享的，
+    绘制前需要先复制。
+    """
+    return _decode_proxy(image_path, os.path.getmtime(image_path), max_size)
+
+
+def metadata_options(img, metadata):
+    """保存时写回元数据的参数；颜色空间变化（如CMYK转RGB）后不再附带原ICC"""
+    if metadata is None:
+        return {}
+    # convert()会复制info中的ICC，PNG保存时会默认写入，不适用时要显式传None
+    options = {'icc_profile': None}
+    if metadata.exif:
+        options['exif'] = metadata.exif
+    if metadata.icc_profile and color_bands(img.mode) == metadata.color_bands:
+        options['icc_profile'] = metadata.icc_profile
+    if metadata.dpi:
+        options['dpi'] = metadata.dpi
+    return options
+
+
+def to_8bit(img):
+    """16位灰度转换为8位（取高字节）"""
+    import numpy as np
+
+    data = np.clip(np.asarray(img), 0, 65535).astype(np.uint16) >> 8
+    return Image.fromarray(data.astype(np.uint8))
+
+
+def flatten(img, background=(255, 255, 255)):
+    """把带透明度的图片合成到纯色背景上，用于不支持透明度的JPEG；LA得到灰度图片"""
+    if img.mode == 'LA':
+        result = Image.new('L', img.size, background[0])
+        result.paste(img.getchannel('L'), (0, 0), img.getchannel('A'))
+        return result
+    rgba = img.convert('RGBA')
+    result = Image.new('RGB', img.size, background)
+    result.paste(rgba, (0, 0), rgba)
+    return result
+
+
+def prepare_for_format(img, output_format):
+    """转换为输出格式支持的模式，能直接保存的模式保持不变"""
+    if output_format == 'JPEG':
+        if img.mode in ('I;16', 'I'):
+            return to_8bit(img)
+        if img.mode not in ('RGB', 'L', 'CMYK'):
+            if 'A' in img.mode or 'transparency' in img.info:
+                return flatten(img)
+            return img.convert('RGB')
+    elif img.mode == 'CMYK' or img.mode == 'F':
+        # PNG不支持CMYK和浮点数据
+        return img.convert('RGB')
+    return img
+
+
+def save_image(img, output_path, quality=95, metadata=None, target=None, mark=None):
+    """根据输出文件扩展名保存图片，metadata为decode_image取得的元数据
+
+    指定target（类文件对象）时写入target，格式仍按output_path的扩展名决定。
+    mark为要嵌入的隐形水印文本，在转换为输出格式之后、编码之前嵌入。
+    """
+    output_format = os.path.splitext(output_path)[1].lower()
+    if output_format == '.jpg' or output_format == '.jpeg':
+        img = prepare_for_format(img, 'JPEG')
+        if mark:
+            img = embed_mark(img, mark)
+        img.save(target or output_path, 'JPEG', quality=quality, **metadata_options(img, metadata))
+    else:
+        img = prepare_for_format(img, 'PNG')
+        if mark:
+            img = embed_mark(img, mark)
+        img.save(target or output_path, 'PNG', **metadata_options(img, metadata))
+
+
+def embed_mark(img, mark):
+    # NumPy只在需要隐形水印时加载
+    from invisible_mark import embed_mark
+    return embed_mark(img, mark)
+
+
+def add_watermark(image_path, output_path, text, font_size, color, position,
+                  watermark_pos=None, rotation=0, relative_size=False,
+                  logo_path=None, logo_scale=DEFAULT_LOGO_SCALE):
+    """给图片添加文字水印（指定logo_path时添加图片水印）"""
+    try:
+        job = compile_settings({
+            'text': text, 'font_size': font_size, 'color': color, 'position': position,
+            'rotation': rotation, 'relative_size': relative_size,
+            'logo_path': logo_path, 'logo_scale': logo_scale,
+        }, watermark_pos)
+    except Exception as e:
+        print(f"处理图片{image_path}时出错: {e}")
+        return False
+    return watermark_file(image_path, output_path, job, text)
+
+
+# ---------- 编译后的水印设置 ----------
+
+class CompiledWatermark(namedtuple('CompiledWatermark',
+                                   'text use_date color spec rotation logo_path logo_scale date_format '
+                                   'invisible_mark placement_log text_template numbering')):
+    """每个任务只编译一次的不可变水印设置：颜色已解析，布局已确定，字体和Logo已预先加载
+
+    placement_log是任务中各线程共用的PlacementLog，记录自动位置为每张图片选择的结果；
+    text_template是编译好的文本模板（TextTemplate，未使用模板时为None），
+    numbering是各线程共用的Numbering，决定模板中各图片的序号。
+    """
+    __slots__ = ()
+
+    def text_for(self, image_path, exif=None, mtime=None, source=None):
+        """该图片使用的水印文本：文本模板优先，其次是拍摄日期，否则为固定文本
+
+        exif是解码时已经取得的原始EXIF，mtime和source是已经取得的修改时间和读入内存的文件内容，
+        提供时不再访问文件。
+        """
+        if self.text_template:
+            return self.text_template.render(image_path, self.numbering, exif, mtime, source)
+        if self.use_date:
+            return format_capture_date(image_path, self.date_format, exif, mtime, source)
+        return self.text
+
+    def numbered(self, image_paths, start=1, count=None):
+        """按image_paths的顺序为图片编号（模板中的{index}和{count}），模板不用序号时原样返回"""
+        if not self.text_template or not self.text_template.fields & {'index', 'count'}:
+            return self
+        return self._replace(numbering=Numbering(image_paths, start, count))
+
+    def mark_for(self, image_path, exif=None):
+        """嵌入该图片的隐形水印文本（"标识|拍摄日期"），未设置隐形水印时为None"""
+        if not self.invisible_mark:
+            return None
+        return f"{self.invisible_mark}|{get_image_creation_date(image_path, exif)}"
+
+    def spec_at(self, img_size, scale=1.0):
+        """尺寸为img_size的图片上使用的布局
+
+        scale是图片相对原图的缩放比例（预览缩小图、多尺寸输出中的小尺寸小于1），
+        不为1时像素字号和边距按原图短边换算为比例，水印在缩小的图片上与原图上位置、大小一致。
+        """
+        if scale == 1.0:
+            return self.spec
+        return to_relative(self.spec, (img_size[0] / scale, img_size[1] / scale))
+
+    def layer(self, img_size, text, scale=1.0):
+        """水印层及其位置(水印层, (x, y))，见watermark_layer"""
+        return watermark_layer(img_size, text, self.spec_at(img_size, scale), self.color, self.rotation,
+                               self.logo_path, self.logo_scale)
+
+    def place(self, img, text, scale=1.0):
+        """自动位置时按图片内容选定位置和颜色，返回(选定后的设置, Placement)；其他位置返回(self, None)"""
+        if self.spec.anchor != 'auto':
+            return self, None
+        placement = choose_placement(img, text, self.spec_at(img.size, scale), self.color, self.rotation,
+                                     self.logo_path, self.logo_scale)
+        return self._replace(spec=self.spec._replace(anchor=placement.anchor), color=placement.color), placement
+
+    def render(self, img, text, scale=1.0):
+        """在图片上绘制水印并返回结果图片；预览、界面导出、命令行和各处理引擎都通过这里绘制"""
+        job, _ = self.place(img, text, scale)
+        return draw_watermark(img, text, job.spec_at(img.size, scale), job.color, job.rotation,
+                              job.logo_path, job.logo_scale)
+
+
+def compile_settings(settings, watermark_pos=None):
+    """把设置字典（来自模板、命令行或界面）编译为CompiledWatermark
+
+    字体和Logo在这里加载一次并进入缓存，文本模板在这里编译；Logo文件不存在、模板写错时在任务开始前就会报错。
+    """
+    spec = make_spec(settings['font_size'], settings['position'], watermark_pos,
+                     settings.get('relative_size', False))
+    if not spec.relative:
+        load_font(max(1, int(spec.size)))
+    logo_path = settings.get('logo_path') or None
+    if logo_path:
+        load_logo(logo_path, os.path.getmtime(logo_path))
+    date_format = settings.get('date_format') or DEFAULT_DATE_FORMAT
+    return CompiledWatermark(
+        text=settings.get('text') or "水印",
+        use_date=settings.get('use_date', False),
+        color=tuple(settings['color']),
+        spec=spec,
+        rotation=settings.get('rotation', 0),
+        logo_path=logo_path,
+        logo_scale=settings.get('logo_scale', DEFAULT_LOGO_SCALE),
+        date_format=date_format,
+        invisible_mark=settings.get('invisible_mark') or None,
+        placement_log=PlacementLog(),
+        text_template=compile_template(settings.get('text_template'), date_format),
+        numbering=Numbering(),
+    )
+
+
+def watermark_file(image_path, output_path, job, text=None, source=None, target=None):
+    """用编译好的设置给一张图片添加水印，text为None时按设置取文本
+
+    source/target是已读入内存的原图和接收输出的类文件对象（见async_export），不提供时直接读写文件。
+    """
+    try:
+        # 打开图片（同时取得需要透传的元数据）
+        img, metadata = decode_image(image_path, source)
+        if text is None:
+            text = job.text_for(image_path, metadata.exif)
+        job, placement = job.place(img, text)
+        if placement:
+            job.placement_log.record(image_path, placement)
+        img = job.render(img, text)
+
+        # 保存图片
+        save_image(img, output_path, metadata=metadata, target=target,
+                   mark=job.mark_for(image_path, metadata.exif))
+        return True
+    except Exception as e:
+        print(f"处理图片{image_path}时出错: {e}")
+        return False
+
+
+# ---------- 多尺寸输出 ----------
+
+# 内置导出配置：每个输出尺寸（rendition）声明最长边、格式、质量和文件名后缀。
+# max_size为None表示原始尺寸。
+DEFAULT_EXPORT_PROFILES = [
+    {
+        'name': '原图+网页尺寸',
+        'renditions': [
+            {'max_size': None, 'format': 'JPEG', 'quality': 95, 'suffix': ''},
+            {'max_size': 2048, 'format': 'JPEG', 'quality': 85, 'suffix': '_2048'},
+            {'max_size': 512, 'format': 'JPEG', 'quality': 80, 'suffix': '_512'},
+        ],
+    },
+]
+
+RENDITION_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png'}
+
+
+def load_export_profiles():
+    """返回内置导出配置加上export_profiles.json中的自定义配置"""
+    profiles = list(DEFAULT_EXPORT_PROFILES)
+    try:
+        profiles.extend(read_json('export_profiles.json', user_config_dir(), []))
+    except Exception as e:
+        print(f"加载导出配置失败: {e}")
+    return profiles
+
+
+def find_export_profile(name):
+    """按名称查找导出配置，找不到时返回None"""
+    for profile in load_export_profiles():
+        if profile.get('name') == name:
+            return profile
+    return None
+
+
+def rendition_size(size, max_size):
+    """按最长边限制计算输出尺寸，不放大图片"""
+    width, height = size
+    if not max_size or max(width, height) <= max_size:
+        return width, height
+    ratio = max_size / max(width, height)
+    return max(1, int(round(width * ratio))), max(1, int(round(height * ratio)))
+
+
+def export_renditions(image_path, outputs, job, text=None, source=None, open_target=None):
+    """一次解码，输出多个尺寸的水印图片
+
+    outputs是[(rendition, output_path)]列表。各尺寸按从大到小排序，
+    每个尺寸都从上一个（未加水印的）尺寸缩小得到，水印按该尺寸相对原图的缩放比例
+    在每个尺寸上只绘制一次。返回成功输出的数量。
+    source与watermark_file相同；open_target(output_path)返回接收该尺寸输出的类文件对象。
+    """
+    try:
+        img, metadata = decode_image(image_path, source)
+        if text is None:
+            text = job.text_for(image_path, metadata.exif)
+        mark = job.mark_for(image_path, metadata.exif)
+        # 自动位置按原图选定一次，各尺寸使用同样的位置和颜色
+        job, placement = job.place(img, text)
+        if placement:
+            job.placement_log.record(image_path, placement)
+    except Exception as e:
+        print(f"处理图片{image_path}时出错: {e}")
+        return 0
+
+    ordered = sorted(outputs, key=lambda item: -min(item[0].get('max_size') or float('inf'),
+                                                     max(img.size)))
+    success_count = 0
+    current = img
+    for index, (rendition, output_path) in enumerate(ordered):
+        try:
+            size = rendition_size(img.size, rendition.get('max_size'))
+            if size != current.size:
+                if current.mode in ('P', '1'):
+                    # Pillow对调色板和1位图片只能按最近邻缩小，先转换（合成时同样会转换）
+                    current = expand_mode(current)
+                current = current.resize(size, Image.LANCZOS, reducing_gap=3.0)
+            # 最后一个尺寸不需要再保留干净的副本
+            base = current if index == len(ordered) - 1 else current.copy()
+            result = job.render(base, text, min(current.size) / min(img.size))
+            save_image(result, output_path, rendition.get('quality', 95), metadata,
+                       open_target(output_path) if open_target else None, mark)
+            success_count += 1
+        except Exception as e:
+            print(f"处理图片{image_path}（{output_path}）时出错: {e}")
+    return success_count
+
+
+def rendition_output_name(name_without_ext, rendition):
+    """在命名规则得到的文件名后追加尺寸后缀并使用该尺寸的格式"""
+    ext = RENDITION_EXTENSIONS.get(rendition.get('format', 'JPEG'), 'jpg')
+    return f"{name_without_ext}{rendition.get('suffix', '')}.{ext}"
+
+
+def template_settings(template):
+    """把模板（界面格式）转换为compile_settings所需的设置字典"""
+    opacity = int(str(template.get('opacity', '80%')).rstrip('%'))
+    position = template.get('position', 8)
+    if isinstance(position, int):
+        position = POSITIONS[position] if 0 <= position < len(POSITIONS) else 'bottom_right'
+    return {
+        'text': template.get('text') or "水印",
+        'use_date': template.get('use_date', False),
+        'font_size': int(template.get('font_size', 30)),
+        'color': parse_color(template.get('color', '#FFFFFF'), opacity),
+        'position': position,
+        'rotation': template.get('rotation', 0),
+        'relative_size': template.get('relative_size', False),
+        'logo_path': template.get('logo') or None,
+        'logo_scale': parse_logo_scale(template.get('logo_scale', DEFAULT_LOGO_SCALE)),
+        'date_format': template.get('date_format') or DEFAULT_DATE_FORMAT,
+        'invisible_mark': template.get('invisible_mark') or None,
+        'text_template': template.get('text_template') or None,
+    }
+
+
+def parse_logo_scale(value):
+    """Logo大小可以是比例（0.2）或界面中的百分比文本（"20%"）"""
+    if isinstance(value, str):
+        return float(value.rstrip('%')) / 100
+    return float(value)